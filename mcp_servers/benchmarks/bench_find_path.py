@@ -0,0 +1,98 @@
+"""
+Path finding benchmark for Building.find_path.
+
+Generates multi-floor buildings with long corridors and times the previous BFS
+(which copied the path list at every expansion) against the parent-pointer BFS,
+the bidirectional search, both searches on the compact graph core and the
+hierarchical router, whose floor tables are built once before timing.
+The query goes from the far end of the first floor to the far end of the top floor.
+
+Run from the mcp_servers directory:
+    python -m benchmarks.bench_find_path
+"""
+import argparse
+from collections import deque
+from typing import List, Optional
+
+from building_mcp_server.building import Building, Room
+
+from .generator import generate_building
+from .timing import best_of
+
+
+def make_building(num_rooms: int, num_floors: int) -> Building:
+    """
+    Generated building whose floors are linked by a door between their first corridor segments,
+    which the legacy BFS follows as well
+    """
+    return generate_building(num_floors, num_rooms // num_floors, door_density=0, floor_links="door",
+                             name=f"bench_{num_rooms}")
+
+
+def legacy_find_path(building: Building, start_room: Room, end_room: Room) -> Optional[List[Room]]:
+    """The previous BFS, queueing (room, path + [room]) tuples"""
+    if start_room == end_room:
+        return [start_room]
+    visited = set()
+    queue = deque()
+    queue.append((start_room, [start_room]))
+    while queue:
+        current_room, path = queue.popleft()
+        visited.add(current_room.name)
+        for door_name in current_room.doors:
+            adjacent_room = building.get_room_by_name(door_name)
+            if adjacent_room == end_room:
+                return path + [adjacent_room]
+            if adjacent_room.name not in visited:
+                queue.append((adjacent_room, path + [adjacent_room]))
+                visited.add(adjacent_room.name)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--floors", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    columns = ["legacy", "parent BFS", "bidirectional", "compact BFS", "compact bidir", "hierarchical"]
+    print(f"{'rooms':>8} {'hops':>6} " + " ".join(f"{column + ' (ms)':>18}" for column in columns))
+    for num_rooms in args.rooms:
+        building = make_building(num_rooms, args.floors)
+        floors = building.floors
+        start, end = floors[0].rooms[-1], floors[-1].rooms[-1]
+        path = building.find_path(start, end)
+        assert len(legacy_find_path(building, start, end)) == len(path)
+        # Indexes are built once per building version, not per query
+        building.compact_graph()
+        building.find_path(start, end, bidirectional=True)
+        building.router()
+
+        def compact(bidirectional):
+            building.use_compact_graph = True
+            try:
+                building.find_path(start, end, bidirectional)
+            finally:
+                building.use_compact_graph = False
+
+        def hierarchical():
+            building.hierarchical_routing = True
+            try:
+                assert len(building.find_path(start, end)) == len(path)
+            finally:
+                building.hierarchical_routing = False
+
+        timings = [
+            best_of(args.repeat, legacy_find_path, building, start, end),
+            best_of(args.repeat, building.find_path, start, end),
+            best_of(args.repeat, building.find_path, start, end, True),
+            best_of(args.repeat, compact, False),
+            best_of(args.repeat, compact, True),
+            best_of(args.repeat, hierarchical),
+        ]
+        print(f"{num_rooms:>8} {len(path) - 1:>6} " + " ".join(f"{timing * 1000:>18.2f}" for timing in timings))
+
+
+if __name__ == "__main__":
+    main()
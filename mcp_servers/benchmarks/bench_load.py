@@ -0,0 +1,73 @@
+"""
+Cold-load benchmark for load_building_from_directory.
+
+Writes generated buildings with an increasing number of floors and compares the
+single-pass parallel loader with the previous two-pass loader.
+
+Run from the mcp_servers directory:
+    python -m benchmarks.bench_load
+"""
+import argparse
+import json
+import os
+import tempfile
+
+from building_mcp_server.building import Building, Floor, Room, load_building_from_directory
+
+from .generator import write_building
+from .timing import best_of
+
+
+def two_pass_load(directory_path: str, building_name: str) -> Building:
+    """The previous loader: lists the directory and parses every floor file twice"""
+    floors = []
+    room_instances = {}
+    for filename in sorted(os.listdir(directory_path)):
+        if filename.startswith('floor_') and filename.endswith('.json'):
+            with open(os.path.join(directory_path, filename), 'r') as f:
+                floor_data = json.load(f)
+                for room_name, room_data in floor_data["rooms"].items():
+                    if room_name not in room_instances:
+                        room_instances[room_name] = Room(
+                            name=room_name,
+                            doors=[],
+                            windows=room_data["windows"],
+                            lights=room_data["lights"],
+                            adjacent_rooms=room_data["adjacent_rooms"]
+                        )
+    for filename in sorted(os.listdir(directory_path)):
+        if filename.startswith('floor_') and filename.endswith('.json'):
+            with open(os.path.join(directory_path, filename), 'r') as f:
+                floor_data = json.load(f)
+                rooms = []
+                for room_name, room_data in floor_data["rooms"].items():
+                    room = room_instances[room_name]
+                    rooms.append(room)
+                    for adj_room_name in room_data["doors"]:
+                        if adj_room_name not in room.doors:
+                            room.doors.append(adj_room_name)
+                floors.append(Floor(rooms))
+    return Building(floors, building_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--floors", type=int, nargs="+", default=[1, 5, 15, 30, 60])
+    parser.add_argument("--rooms-per-floor", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as building_dir:
+        os.environ["BUILDING_DIR"] = building_dir
+        print(f"{'floors':>6} {'rooms':>8} {'two-pass (ms)':>14} {'single-pass (ms)':>17} {'speedup':>8}")
+        for num_floors in args.floors:
+            building_name = f"bench_{num_floors}"
+            directory_path = os.path.join(building_dir, building_name)
+            write_building(directory_path, num_floors, args.rooms_per_floor)
+            old = best_of(args.repeat, two_pass_load, directory_path, building_name)
+            new = best_of(args.repeat, load_building_from_directory, building_name)
+            print(f"{num_floors:>6} {num_floors * args.rooms_per_floor:>8} {old * 1000:>14.1f} {new * 1000:>17.1f} {old / new:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Memory benchmark for the Room representation.
+
+Loads synthetic buildings under tracemalloc and reports the bytes allocated per room by
+the previous Room dataclass (one __dict__ per room, every name parsed from JSON kept as its
+own string) against the slotted Room with interned names, and by a full
+load_building_from_directory, which also holds the floor indexes.
+
+Run from the mcp_servers directory:
+    python -m benchmarks.bench_memory
+"""
+import argparse
+import gc
+import json
+import os
+import tempfile
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from building_mcp_server.building import Room, list_floor_files, load_building_from_directory
+
+from .generator import write_building
+
+
+@dataclass
+class LegacyRoom:
+    """The previous Room, a plain dataclass"""
+    name: str
+    doors: List[str]
+    windows: int
+    lights: int
+    adjacent_rooms: Tuple[str, ...]
+    connectors: Dict[str, str] = field(default_factory=dict)
+    floor: Optional[object] = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.doors = list(self.doors)
+        self.adjacent_rooms = list(self.adjacent_rooms)
+        self.connectors = dict(self.connectors)
+
+
+def load_rooms(directory_path: str, room_class) -> List[list]:
+    """Parse the floor files of a building and create its rooms, without any index"""
+    floors = []
+    for filename in list_floor_files(directory_path):
+        with open(os.path.join(directory_path, filename)) as f:
+            floor_data = json.load(f)
+        floors.append([
+            room_class(name=room_name, doors=room_data["doors"], windows=room_data["windows"],
+                       lights=room_data["lights"], adjacent_rooms=room_data["adjacent_rooms"])
+            for room_name, room_data in floor_data["rooms"].items()
+        ])
+    return floors
+
+
+def traced_bytes(func, *args) -> int:
+    """Bytes still allocated by func once it returned, the result being kept alive"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--floors", type=int, nargs="+", default=[5, 50])
+    parser.add_argument("--rooms-per-floor", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as building_dir:
+        os.environ["BUILDING_DIR"] = building_dir
+        columns = ["legacy rooms", "slotted rooms", "loaded building"]
+        print(f"{'rooms':>8} " + " ".join(f"{column + ' (B/room)':>26}" for column in columns))
+        for num_floors in args.floors:
+            building_name = f"bench_{num_floors}"
+            directory_path = os.path.join(building_dir, building_name)
+            write_building(directory_path, num_floors, args.rooms_per_floor)
+            num_rooms = num_floors * args.rooms_per_floor
+            sizes = [
+                traced_bytes(load_rooms, directory_path, LegacyRoom),
+                traced_bytes(load_rooms, directory_path, Room),
+                traced_bytes(load_building_from_directory, building_name),
+            ]
+            print(f"{num_rooms:>8} " + " ".join(f"{size / num_rooms:>26.0f}" for size in sizes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Save benchmark for Building.to_json.
+
+Compares a full save of a building with the incremental save that follows
+a single Update_Lights on one floor.
+
+Run from the mcp_servers directory:
+    python -m benchmarks.bench_save
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from building_mcp_server.building import load_building_from_directory
+from .generator import write_building
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--floors", type=int, nargs="+", default=[1, 5, 15, 30, 60])
+    parser.add_argument("--rooms-per-floor", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as building_dir:
+        os.environ["BUILDING_DIR"] = building_dir
+        print(f"{'floors':>6} {'rooms':>8} {'full save (ms)':>15} {'one floor (ms)':>15}")
+        for num_floors in args.floors:
+            building_name = f"bench_{num_floors}"
+            write_building(os.path.join(building_dir, building_name), num_floors, args.rooms_per_floor)
+            building = load_building_from_directory(building_name)
+
+            for floor in building.floors:
+                floor.dirty = True
+            start = time.perf_counter()
+            building.to_json(building_name)
+            full = time.perf_counter() - start
+
+            building.floors[num_floors // 2].rooms[0].update_lights(1)
+            start = time.perf_counter()
+            building.to_json(building_name)
+            incremental = time.perf_counter() - start
+            print(f"{num_floors:>6} {num_floors * args.rooms_per_floor:>8} {full * 1000:>15.1f} {incremental * 1000:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Cold start benchmark for the binary snapshot format.
+
+Writes synthetic buildings as floor JSON files and as a snapshot, then compares the
+JSON loader, a full load of the snapshot, and mapping the snapshot to answer a first
+path query without creating any Room object. File sizes are reported as well.
+
+Run from the mcp_servers directory:
+    python -m benchmarks.bench_snapshot
+"""
+import argparse
+import os
+import tempfile
+
+from building_mcp_server.building import list_floor_files, load_building_from_directory
+from building_mcp_server.snapshot import SNAPSHOT_FILENAME, MappedSnapshot, load_snapshot
+
+from .generator import write_building
+from .timing import best_of
+
+
+def first_query(path: str, start: str, end: str) -> None:
+    """Map a snapshot and answer one path query"""
+    with MappedSnapshot(path) as snapshot:
+        snapshot.find_path_by_name(start, end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--floors", type=int, nargs="+", default=[5, 50, 250])
+    parser.add_argument("--rooms-per-floor", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as building_dir:
+        os.environ["BUILDING_DIR"] = building_dir
+        columns = ["JSON (KB)", "snapshot (KB)", "JSON load (ms)", "snapshot load (ms)", "mmap + query (ms)"]
+        print(f"{'rooms':>8} " + " ".join(f"{column:>18}" for column in columns))
+        for num_floors in args.floors:
+            building_name = f"bench_{num_floors}"
+            directory_path = os.path.join(building_dir, building_name)
+            building = write_building(directory_path, num_floors, args.rooms_per_floor)
+            snapshot_path = building.to_snapshot(building_name)
+            json_size = sum(os.path.getsize(os.path.join(directory_path, name)) for name in list_floor_files(directory_path))
+            # A query within the first floor, from its first corridor segment to its last office
+            start, end = building.floors[0].rooms[0].name, building.floors[0].rooms[-1].name
+            timings = [
+                best_of(args.repeat, load_building_from_directory, building_name),
+                best_of(args.repeat, load_snapshot, snapshot_path),
+                best_of(args.repeat, first_query, snapshot_path, start, end),
+            ]
+            sizes = [json_size / 1024, os.path.getsize(os.path.join(directory_path, SNAPSHOT_FILENAME)) / 1024]
+            print(f"{num_floors * args.rooms_per_floor:>8} "
+                  + " ".join(f"{size:>18.0f}" for size in sizes) + " "
+                  + " ".join(f"{timing * 1000:>18.2f}" for timing in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Deterministic synthetic buildings for the benchmarks.
+
+Every floor is a chain of corridor segments with offices along each segment. Each office has
+a door to its corridor segment and lists the offices next to it as adjacent; door_density is
+the share of those neighbouring offices that also get a door between them. Floors are linked
+by stairs at the first corridor segment and an elevator at the last one, or by a door between
+the first corridor segments. The same arguments always give the same building.
+"""
+import os
+import random
+from typing import List, Optional
+
+from building_mcp_server.building import Building, Floor, Room
+
+# How consecutive floors are linked
+FLOOR_LINKS = ("connectors", "door")
+
+
+def corridor_name(floor_number: int, segment: int) -> str:
+    return f"F{floor_number}_Corridor_{segment}"
+
+
+def office_name(floor_number: int, segment: int, index: int) -> str:
+    return f"F{floor_number}_Office_{segment}_{index}"
+
+
+def generate_floor(floor_number: int, rooms_per_floor: int, offices_per_segment: int,
+                   door_density: float, rng: random.Random) -> List[Room]:
+    """Rooms of one floor, rooms_per_floor of them, without the links to other floors"""
+    segments = max(1, rooms_per_floor // (offices_per_segment + 1))
+    # The last segment takes the rooms left over by the division
+    sizes = [offices_per_segment] * (segments - 1) + [rooms_per_floor - 1 - (segments - 1) * (offices_per_segment + 1)]
+    rooms = []
+    for segment, size in enumerate(sizes):
+        corridor = corridor_name(floor_number, segment)
+        offices = [office_name(floor_number, segment, index) for index in range(size)]
+        neighbours = [corridor_name(floor_number, other) for other in (segment - 1, segment + 1) if 0 <= other < segments]
+        rooms.append(Room(name=corridor, doors=offices + neighbours, windows=0, lights=size + 1,
+                          adjacent_rooms=offices + neighbours))
+        office_doors = [[corridor] for _ in offices]
+        for index in range(size - 1):
+            if rng.random() < door_density:
+                office_doors[index].append(offices[index + 1])
+                office_doors[index + 1].append(offices[index])
+        for index, office in enumerate(offices):
+            adjacent = [corridor] + offices[max(0, index - 1):index] + offices[index + 1:index + 2]
+            rooms.append(Room(name=office, doors=office_doors[index], windows=rng.randint(1, 4),
+                              lights=rng.randint(2, 6), adjacent_rooms=adjacent))
+    return rooms
+
+
+def generate_building(num_floors: int, rooms_per_floor: int, offices_per_segment: int = 4,
+                      door_density: float = 0.25, floor_links: str = "connectors", seed: int = 0,
+                      name: Optional[str] = None) -> Building:
+    """
+    A building of num_floors floors of rooms_per_floor rooms each.
+    floor_links is "connectors" (stairs and an elevator) or "door".
+    """
+    if floor_links not in FLOOR_LINKS:
+        raise ValueError(f"floor_links must be one of {', '.join(FLOOR_LINKS)}")
+    if rooms_per_floor < 1:
+        raise ValueError("A floor needs at least one room")
+    rng = random.Random(seed)
+    floor_rooms = [generate_floor(floor_number, rooms_per_floor, offices_per_segment, door_density, rng)
+                   for floor_number in range(1, num_floors + 1)]
+    if floor_links == "door":
+        # Doors are set before the floors exist, so the rooms are indexed with them
+        for lower, upper in zip(floor_rooms, floor_rooms[1:]):
+            lower[0].doors.append(upper[0].name)
+            upper[0].doors.append(lower[0].name)
+    building = Building([Floor(rooms) for rooms in floor_rooms],
+                        name or f"synthetic_{num_floors}x{rooms_per_floor}")
+    if floor_links == "connectors":
+        last_segment = max(1, rooms_per_floor // (offices_per_segment + 1)) - 1
+        links = [(0, "stairs")] + ([(last_segment, "elevator")] if last_segment > 0 else [])
+        for number in range(1, num_floors):
+            lower, upper = building.floors[number - 1], building.floors[number]
+            for segment, kind in links:
+                lower.get_room_by_name(corridor_name(number, segment)).add_connector(
+                    upper.get_room_by_name(corridor_name(number + 1, segment)), kind)
+    return building
+
+
+def write_building(directory_path: str, num_floors: int, rooms_per_floor: int, **options) -> Building:
+    """Generate a building and save it as floor JSON files into directory_path"""
+    building = generate_building(num_floors, rooms_per_floor, name=os.path.basename(directory_path), **options)
+    building.to_json(building.name, directory_path)
+    return building
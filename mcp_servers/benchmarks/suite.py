@@ -0,0 +1,196 @@
+"""
+Benchmark suite across building sizes.
+
+For each size (floors x rooms per floor) a building is generated, written under a temporary
+BUILDING_DIR and timed for: cold load, full save, single-floor save, every mutation tool,
+Find_Path (through call_tool and on the parsed building), Read_Building_data and
+Building_Stats. Tool calls go through call_tool, so they include argument validation, the
+resident building store and the journal write.
+
+Results are printed as a table and, with --output, written as JSON. With --baseline, the
+medians are compared with a previous JSON result and the run fails if any benchmark got
+slower than --tolerance times its baseline.
+
+Run from the mcp_servers directory:
+    python -m benchmarks.suite --sizes 5x200 20x500 --output results.json
+    python -m benchmarks.suite --baseline results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from building_mcp_server.building import load_building_from_directory
+
+from .generator import corridor_name, write_building
+
+DEFAULT_SIZES = ["5x200", "20x500", "50x1000"]
+
+
+def parse_size(size: str) -> Tuple[int, int]:
+    """"FLOORSxROOMS" -> (floors, rooms per floor)"""
+    try:
+        num_floors, rooms_per_floor = map(int, size.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid size {size}, expected FLOORSxROOMS such as 20x500")
+    return num_floors, rooms_per_floor
+
+
+def summarize(timings: List[float]) -> Dict[str, float]:
+    """Timings in seconds to min/median/max in milliseconds"""
+    return {
+        "min_ms": round(min(timings) * 1000, 4),
+        "median_ms": round(statistics.median(timings) * 1000, 4),
+        "max_ms": round(max(timings) * 1000, 4),
+    }
+
+
+def timed(timings: Dict[str, List[float]], name: str, func, *args):
+    """Run func once, adding its wall-clock time to timings[name]"""
+    start = time.perf_counter()
+    result = func(*args)
+    timings.setdefault(name, []).append(time.perf_counter() - start)
+    return result
+
+
+async def time_tools(building_name: str, num_floors: int, repeat: int) -> Dict[str, List[float]]:
+    """Time every tool through call_tool, mutations are undone by the next ones"""
+    from building_mcp_server.server import call_tool, store
+
+    timings: Dict[str, List[float]] = {}
+    store.invalidate()
+
+    async def tool(name: str, arguments: dict) -> str:
+        start = time.perf_counter()
+        result = await call_tool(name, {"building_name": building_name, **arguments})
+        timings.setdefault(name, []).append(time.perf_counter() - start)
+        text = result[0].text
+        if text.startswith("Error"):
+            raise RuntimeError(f"{name} failed: {text}")
+        return text
+
+    building = store.get(building_name)
+    corridor = corridor_name(1, 0)
+    far_start, far_end = building.floors[0].rooms[-1].name, building.floors[-1].rooms[-1].name
+    for iteration in range(repeat):
+        room_name = f"Bench_Room_{iteration}"
+        await tool("Add_Room", {"floor_number": 1, "room": {
+            "name": room_name, "doors": [], "windows": 1, "lights": 1, "adjacent_rooms": [corridor]}})
+        await tool("Add_Door", {"floor_number": 1, "room_name": room_name, "adjacent_room_name": corridor})
+        await tool("Update_Lights", {"floor_number": 1, "room_name": room_name, "new_lights": iteration + 2})
+        await tool("Update_Windows", {"floor_number": 1, "room_name": room_name, "new_windows": iteration + 2})
+        await tool("Remove_Door", {"floor_number": 1, "room_name": room_name, "adjacent_room_name": corridor})
+        if num_floors > 1:
+            await tool("Add_Connector", {"floor_number": 1, "room_name": room_name, "other_floor_number": 2,
+                                         "other_room_name": corridor_name(2, 0), "connector_type": "elevator"})
+            await tool("Remove_Connector", {"floor_number": 1, "room_name": room_name, "other_floor_number": 2,
+                                            "other_room_name": corridor_name(2, 0)})
+        await tool("Remove_Room", {"floor_number": 1, "room_name": room_name})
+        await tool("Find_Path", {"start_room_name": far_start, "end_room_name": far_end})
+        await tool("Read_Building_data", {"limit": 200})
+        await tool("Building_Stats", {})
+    # Floors are never removed by a tool, so Add_Floor runs last
+    for iteration in range(repeat):
+        floor_number = num_floors + iteration + 1
+        await tool("Add_Floor", {"floor_number": floor_number, "floor_data": {"rooms": {
+            f"Bench_Floor_{iteration}": {"doors": [], "windows": 1, "lights": 1, "adjacent_rooms": []}}}})
+    store.invalidate()
+    return timings
+
+
+def bench_size(building_dir: str, num_floors: int, rooms_per_floor: int, repeat: int) -> List[dict]:
+    """Every benchmark on one generated building"""
+    building_name = f"bench_{num_floors}x{rooms_per_floor}"
+    directory_path = os.path.join(building_dir, building_name)
+    write_building(directory_path, num_floors, rooms_per_floor)
+    timings: Dict[str, List[float]] = {}
+
+    for _ in range(repeat):
+        building = timed(timings, "cold_load", load_building_from_directory, building_name)
+    # Saving to a directory the building was not saved to writes every floor
+    save_paths = [os.path.join(building_dir, f"{building_name}_save_{index}") for index in range(2)]
+    for index in range(repeat):
+        timed(timings, "save_full", building.to_json, building_name, save_paths[index % 2])
+    for index in range(repeat):
+        building.floors[num_floors // 2].rooms[0].update_lights(index)
+        timed(timings, "save_one_floor", building.to_json, building_name, save_paths[(repeat - 1) % 2])
+
+    start, end = building.floors[0].rooms[-1], building.floors[-1].rooms[-1]
+    building.find_path(start, end)
+    for _ in range(repeat):
+        timed(timings, "find_path", building.find_path, start, end)
+
+    for name, tool_timings in asyncio.run(time_tools(building_name, num_floors, repeat)).items():
+        timings[f"tool.{name}"] = tool_timings
+
+    return [
+        {"benchmark": name, "floors": num_floors, "rooms_per_floor": rooms_per_floor,
+         "rooms": num_floors * rooms_per_floor, "repeat": len(values), **summarize(values)}
+        for name, values in timings.items()
+    ]
+
+
+def compare(results: List[dict], baseline: dict, tolerance: float) -> List[str]:
+    """Benchmarks whose median got slower than tolerance times the baseline one"""
+    previous = {(result["benchmark"], result["floors"], result["rooms_per_floor"]): result
+                for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get((result["benchmark"], result["floors"], result["rooms_per_floor"]))
+        if before is None or before["median_ms"] <= 0:
+            continue
+        ratio = result["median_ms"] / before["median_ms"]
+        if ratio > tolerance:
+            regressions.append(f"{result['benchmark']} {result['floors']}x{result['rooms_per_floor']}: "
+                               f"{before['median_ms']:.3f} ms -> {result['median_ms']:.3f} ms ({ratio:.2f}x)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_size, nargs="+", default=[parse_size(size) for size in DEFAULT_SIZES])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="Slowdown over the baseline median reported as a regression (default 1.25)")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as building_dir:
+        os.environ["BUILDING_DIR"] = building_dir
+        print(f"{'benchmark':<28} {'rooms':>8} {'min (ms)':>12} {'median (ms)':>12} {'max (ms)':>12}")
+        for num_floors, rooms_per_floor in args.sizes:
+            for result in bench_size(building_dir, num_floors, rooms_per_floor, args.repeat):
+                results.append(result)
+                print(f"{result['benchmark']:<28} {result['rooms']:>8} {result['min_ms']:>12.3f} "
+                      f"{result['median_ms']:>12.3f} {result['max_ms']:>12.3f}")
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""
+Timing helpers shared by the benchmarks.
+"""
+import time
+
+
+def best_of(repeat: int, func, *args) -> float:
+    """Best wall-clock time of several runs, in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
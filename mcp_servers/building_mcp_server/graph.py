@@ -0,0 +1,507 @@
+import sys
+import threading
+from array import array
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Set, TypeVar
+
+if TYPE_CHECKING:
+    from .building import Building, Floor, Room
+
+# Kinds of vertical connectors linking rooms on different floors
+CONNECTOR_TYPES = ("stairs", "elevator")
+
+Node = TypeVar("Node", bound=Hashable)
+
+
+def unwind_path(parents: Dict[Node, Optional[Node]], node: Node) -> List[Node]:
+    """Follow parent pointers back from node to the root of the search"""
+    path = []
+    while node is not None:
+        path.append(node)
+        node = parents[node]
+    path.reverse()
+    return path
+
+
+def bfs_path(start: Node, end: Node, successors: Callable[[Node], Iterable[Node]]) -> Optional[List[Node]]:
+    """
+    Shortest path from start to end with a parent-pointer BFS.
+    Only one parent entry is stored per visited node, the path is rebuilt once at the end.
+    """
+    if start == end:
+        return [start]
+    parents: Dict[Node, Optional[Node]] = {start: None}
+    queue = deque([start])
+    while queue:
+        current = queue.popleft()
+        for other in successors(current):
+            if other in parents:
+                continue
+            parents[other] = current
+            if other == end:
+                return unwind_path(parents, end)
+            queue.append(other)
+    return None
+
+
+def bfs_tree(start: Node, successors: Callable[[Node], Iterable[Node]]) -> Dict[Node, Optional[Node]]:
+    """Parent pointers of a full BFS from start, covering every node reachable from it"""
+    parents: Dict[Node, Optional[Node]] = {start: None}
+    queue = deque([start])
+    while queue:
+        current = queue.popleft()
+        for other in successors(current):
+            if other not in parents:
+                parents[other] = current
+                queue.append(other)
+    return parents
+
+
+def multi_target_bfs(start: Node, targets: Iterable[Node],
+                     successors: Callable[[Node], Iterable[Node]]) -> Dict[Node, Optional[List[Node]]]:
+    """
+    Shortest paths from start to every target with a single BFS.
+    The search stops as soon as the last target is reached, unreachable targets map to None.
+    """
+    remaining = set(targets)
+    parents: Dict[Node, Optional[Node]] = {start: None}
+    remaining.discard(start)
+    queue = deque([start])
+    while queue and remaining:
+        current = queue.popleft()
+        for other in successors(current):
+            if other in parents:
+                continue
+            parents[other] = current
+            remaining.discard(other)
+            queue.append(other)
+    return {target: unwind_path(parents, target) if target in parents else None for target in targets}
+
+
+class PathIndex:
+    """
+    LRU cache of single-source BFS trees.
+    A tree is computed the first time a room is used as a start, after which every path from
+    that room is read back in O(path length). The cache belongs to one version of the graph:
+    asking with another version drops every tree, so a stale path is never returned.
+    """
+
+    def __init__(self, max_sources: int):
+        self.max_sources = max_sources
+        self._trees: "OrderedDict[Hashable, Dict]" = OrderedDict()
+        self._version: Optional[Hashable] = None
+        self._lock = threading.Lock()  # concurrent queries share one published version
+
+    def find_path(self, version: Hashable, start: Node, end: Node,
+                  successors: Callable[[Node], Iterable[Node]]) -> Optional[List[Node]]:
+        """Shortest path from start to end, or None, for the graph at the given version"""
+        if start == end:
+            return [start]
+        with self._lock:
+            if version != self._version:
+                self._trees.clear()
+                self._version = version
+            tree = self._trees.get(start)
+            if tree is not None:
+                self._trees.move_to_end(start)
+
+        if tree is None:
+            tree = bfs_tree(start, successors)
+            with self._lock:
+                if version == self._version:
+                    self._trees[start] = tree
+                    while len(self._trees) > self.max_sources:
+                        self._trees.popitem(last=False)
+
+        if end not in tree:
+            return None
+        return unwind_path(tree, end)
+
+    def __len__(self) -> int:
+        return len(self._trees)
+
+
+class ComponentIndex:
+    """
+    Connected components of the rooms, ignoring the direction of doors, kept by a union-find.
+    A new door or connector joins two components in near constant time. A removed door or room
+    may split its component: the component is only flagged, and recomputed from its own rooms
+    on the next query. Rooms in different components have no path between them.
+    The index is shared by the versions of a building with the same rooms and links, so it keeps
+    no reference to any of them: the methods needing the links take the successors of the caller.
+    """
+
+    def __init__(self, names: Iterable[str], successors: Callable[[str], Iterable[str]]):
+        self._parent: Dict[str, str] = {}
+        self._members: Dict[str, List[str]] = {}  # root -> rooms of its component
+        self._removed: Set[str] = set()  # rooms removed since their component was computed
+        self._dirty: Set[str] = set()  # rooms whose component may have split
+        self._lock = threading.Lock()  # concurrent queries share one published version
+        for name in names:
+            self._parent[name] = name
+            self._members[name] = [name]
+        for name in list(self._parent):
+            self._union_links(name, self._parent, successors)
+
+    def copy(self) -> 'ComponentIndex':
+        """Copy of the index for another version of the same rooms"""
+        index = ComponentIndex.__new__(ComponentIndex)
+        with self._lock:
+            index._parent = dict(self._parent)
+            index._members = {root: list(members) for root, members in self._members.items()}
+            index._removed = set(self._removed)
+            index._dirty = set(self._dirty)
+        index._lock = threading.Lock()
+        return index
+
+    def _find(self, name: str) -> str:
+        parent = self._parent
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    def _union(self, first: str, second: str) -> None:
+        first, second = self._find(first), self._find(second)
+        if first == second:
+            return
+        members = self._members
+        if len(members[first]) < len(members[second]):
+            first, second = second, first
+        self._parent[second] = first
+        members[first].extend(members.pop(second))
+
+    def _union_links(self, name: str, scope, successors: Callable[[str], Iterable[str]]) -> None:
+        """Join a room with the rooms of scope its doors and connectors lead to"""
+        for other in successors(name):
+            if other in scope:
+                self._union(name, other)
+
+    def add(self, name: str, successors: Callable[[str], Iterable[str]], linked: Iterable[str] = ()) -> None:
+        """Add a room, joined to the rooms it leads to and to the rooms in linked"""
+        if name in self._parent:
+            # Removed and added again before its old component was recomputed
+            self._refresh(successors)
+        self._parent[name] = name
+        self._members[name] = [name]
+        self._union_links(name, self._parent, successors)
+        for other in linked:
+            if other in self._parent and other not in self._removed:
+                self._union(name, other)
+
+    def link(self, first: str, second: str) -> None:
+        """Record a door or connector between two rooms"""
+        if first in self._parent and second in self._parent and second not in self._removed:
+            self._union(first, second)
+
+    def unlink(self, name: str) -> None:
+        """Record that a door or connector of a room was removed"""
+        if name in self._parent:
+            self._dirty.add(name)
+
+    def discard(self, name: str) -> None:
+        """Record that a room was removed"""
+        if name in self._parent:
+            self._removed.add(name)
+            self._dirty.add(name)
+
+    def _refresh(self, successors: Callable[[str], Iterable[str]]) -> None:
+        """Recompute the components flagged since the last query, from their own rooms"""
+        if not self._dirty:
+            return
+        roots = {self._find(name) for name in self._dirty if name in self._parent}
+        self._dirty.clear()
+        for root in roots:
+            members = self._members.pop(root)
+            for name in members:
+                del self._parent[name]
+            alive = {name for name in members if name not in self._removed}
+            self._removed.difference_update(members)
+            for name in alive:
+                self._parent[name] = name
+                self._members[name] = [name]
+            for name in alive:
+                self._union_links(name, alive, successors)
+
+    def connected(self, first: str, second: str, successors: Callable[[str], Iterable[str]]) -> bool:
+        """True if the two rooms are in the same component"""
+        with self._lock:
+            self._refresh(successors)
+            parent = self._parent
+            if first not in parent or second not in parent:
+                return False
+            return self._find(first) == self._find(second)
+
+    def components(self, successors: Callable[[str], Iterable[str]]) -> List[List[str]]:
+        """Rooms of every component, largest first"""
+        with self._lock:
+            self._refresh(successors)
+            return sorted((list(members) for members in self._members.values()), key=len, reverse=True)
+
+
+def bidirectional_bfs(start: Node, end: Node,
+                      successors: Callable[[Node], Iterable[Node]],
+                      predecessors: Callable[[Node], Iterable[Node]]) -> Optional[List[Node]]:
+    """
+    Shortest path from start to end, searching forward from start and backward from end.
+    The smaller frontier is expanded one full level at a time, and the level where the two
+    searches meet is finished so the shortest of the meeting points is kept.
+    """
+    if start == end:
+        return [start]
+    forward: Dict[Node, Optional[Node]] = {start: None}
+    backward: Dict[Node, Optional[Node]] = {end: None}
+    forward_depth: Dict[Node, int] = {start: 0}
+    backward_depth: Dict[Node, int] = {end: 0}
+    forward_frontier = [start]
+    backward_frontier = [end]
+    while forward_frontier and backward_frontier:
+        if len(forward_frontier) <= len(backward_frontier):
+            frontier, parents, depth = forward_frontier, forward, forward_depth
+            other_depth, neighbours = backward_depth, successors
+        else:
+            frontier, parents, depth = backward_frontier, backward, backward_depth
+            other_depth, neighbours = forward_depth, predecessors
+        next_frontier = []
+        meeting, meeting_depth = None, None
+        for current in frontier:
+            current_depth = depth[current] + 1
+            for other in neighbours(current):
+                if other in parents:
+                    continue
+                parents[other] = current
+                depth[other] = current_depth
+                if other in other_depth:
+                    if meeting_depth is None or other_depth[other] < meeting_depth:
+                        meeting, meeting_depth = other, other_depth[other]
+                else:
+                    next_frontier.append(other)
+        if meeting is not None:
+            path = unwind_path(forward, meeting)
+            path.extend(reversed(unwind_path(backward, meeting)[:-1]))
+            return path
+        if frontier is forward_frontier:
+            forward_frontier = next_frontier
+        else:
+            backward_frontier = next_frontier
+    return None
+
+
+def _csr(rows: Iterable[Iterable[int]]) -> "tuple[array, array]":
+    """Pack rows of ids into CSR arrays, row i is targets[offsets[i]:offsets[i + 1]]"""
+    offsets = array('i', [0])
+    targets = array('i')
+    for row in rows:
+        targets.extend(row)
+        offsets.append(len(targets))
+    return offsets, targets
+
+
+class CompactGraph:
+    """
+    Integer-indexed copy of a building.
+    Room names are interned and numbered 0..n-1 in floor order, so the rooms of floor f are
+    the ids floor_offsets[f - 1]:floor_offsets[f]. Doors and adjacent rooms are stored as
+    CSR arrays: the doors of room i lead to door_targets[door_offsets[i]:door_offsets[i + 1]].
+    Stairs and elevators are kept the same way, with the index of their kind in CONNECTOR_TYPES,
+    and searches walk the link arrays holding the doors followed by the connectors of each room.
+    Room and Floor objects are only created on demand, as detached views.
+    """
+
+    def __init__(self, names: List[str], floor_offsets: array, windows: array, lights: array,
+                 door_offsets: array, door_targets: array,
+                 adjacency_offsets: array, adjacency_targets: array,
+                 reverse_door_offsets: Optional[array] = None, reverse_door_targets: Optional[array] = None,
+                 connector_offsets: Optional[array] = None, connector_targets: Optional[array] = None,
+                 connector_kinds: Optional[array] = None):
+        self.names = names
+        self.floor_offsets = floor_offsets
+        self.windows = windows
+        self.lights = lights
+        self.door_offsets = door_offsets
+        self.door_targets = door_targets
+        self.adjacency_offsets = adjacency_offsets
+        self.adjacency_targets = adjacency_targets
+        if reverse_door_offsets is None or reverse_door_targets is None:
+            reverse_door_offsets, reverse_door_targets = self._reverse(door_offsets, door_targets)
+        # Doors leading into each room, for searches running backward from the destination
+        self.reverse_door_offsets = reverse_door_offsets
+        self.reverse_door_targets = reverse_door_targets
+        if connector_offsets is None or connector_targets is None:
+            connector_offsets, connector_targets = array('i', [0]) * (len(names) + 1), array('i')
+        self.connector_offsets = connector_offsets
+        self.connector_targets = connector_targets
+        self.connector_kinds = connector_kinds if connector_kinds is not None else array('b')
+        if connector_targets:
+            self.link_offsets, self.link_targets = _csr(
+                self.doors_of(room_id).tolist() + self.connectors_of(room_id).tolist() for room_id in range(len(names))
+            )
+            self.reverse_link_offsets, self.reverse_link_targets = self._reverse(self.link_offsets, self.link_targets)
+        else:
+            # Without stairs or elevators the links are the doors, the arrays are shared
+            self.link_offsets, self.link_targets = door_offsets, door_targets
+            self.reverse_link_offsets, self.reverse_link_targets = reverse_door_offsets, reverse_door_targets
+        self._ids: Dict[str, int] = {name: room_id for room_id, name in enumerate(names)}
+
+    @classmethod
+    def from_building(cls, building: 'Building') -> 'CompactGraph':
+        """Build the compact graph of a building, doors to unknown rooms are dropped"""
+        names = []
+        rooms = []
+        ids = {}
+        floor_offsets = array('i', [0])
+        for floor in building.floors:
+            for room in floor.rooms:
+                # Room names are unique within a building, a repeated room keeps its first floor
+                if room.name not in ids:
+                    ids[room.name] = len(names)
+                    names.append(sys.intern(room.name))
+                    rooms.append(room)
+            floor_offsets.append(len(names))
+
+        door_offsets, door_targets = _csr(
+            (ids[name] for name in room.doors if name in ids) for room in rooms
+        )
+        adjacency_offsets, adjacency_targets = _csr(
+            (ids[name] for name in room.adjacent_rooms if name in ids) for room in rooms
+        )
+        connector_offsets, connector_targets = _csr(
+            (ids[name] for name in room.connectors if name in ids) for room in rooms
+        )
+        connector_kinds = array('b', (
+            CONNECTOR_TYPES.index(kind) for room in rooms for name, kind in room.connectors.items() if name in ids
+        ))
+        return cls(
+            names,
+            floor_offsets,
+            array('i', (room.windows for room in rooms)),
+            array('i', (room.lights for room in rooms)),
+            door_offsets,
+            door_targets,
+            adjacency_offsets,
+            adjacency_targets,
+            connector_offsets=connector_offsets,
+            connector_targets=connector_targets,
+            connector_kinds=connector_kinds,
+        )
+
+    def copy(self) -> 'CompactGraph':
+        """Copy sharing the link arrays, with its own windows and lights arrays"""
+        graph = CompactGraph.__new__(CompactGraph)
+        graph.__dict__.update(self.__dict__)
+        graph.windows = self.windows[:]
+        graph.lights = self.lights[:]
+        return graph
+
+    def _reverse(self, offsets: array, targets: array) -> "tuple[array, array]":
+        """Transpose CSR arrays, row i of the result lists the rows pointing to i"""
+        rows: List[List[int]] = [[] for _ in self.names]
+        for room_id in range(len(self.names)):
+            for other in targets[offsets[room_id]:offsets[room_id + 1]]:
+                rows[other].append(room_id)
+        return _csr(rows)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def num_floors(self) -> int:
+        return len(self.floor_offsets) - 1
+
+    def index_of(self, name: str) -> int:
+        """Get the id of a room by name"""
+        room_id = self._ids.get(name)
+        if room_id is None:
+            raise ValueError(f"Room '{name}' not found")
+        return room_id
+
+    def doors_of(self, room_id: int) -> Sequence[int]:
+        """Ids of the rooms connected to room_id by a door"""
+        return self.door_targets[self.door_offsets[room_id]:self.door_offsets[room_id + 1]]
+
+    def doors_into(self, room_id: int) -> Sequence[int]:
+        """Ids of the rooms with a door leading to room_id"""
+        return self.reverse_door_targets[self.reverse_door_offsets[room_id]:self.reverse_door_offsets[room_id + 1]]
+
+    def connectors_of(self, room_id: int) -> Sequence[int]:
+        """Ids of the rooms connected to room_id by stairs or an elevator"""
+        return self.connector_targets[self.connector_offsets[room_id]:self.connector_offsets[room_id + 1]]
+
+    def links_of(self, room_id: int) -> Sequence[int]:
+        """Ids of the rooms room_id leads to, through its doors, stairs and elevators"""
+        return self.link_targets[self.link_offsets[room_id]:self.link_offsets[room_id + 1]]
+
+    def links_into(self, room_id: int) -> Sequence[int]:
+        """Ids of the rooms leading to room_id"""
+        return self.reverse_link_targets[self.reverse_link_offsets[room_id]:self.reverse_link_offsets[room_id + 1]]
+
+    def adjacent_of(self, room_id: int) -> Sequence[int]:
+        """Ids of the rooms adjacent to room_id"""
+        return self.adjacency_targets[self.adjacency_offsets[room_id]:self.adjacency_offsets[room_id + 1]]
+
+    def room(self, room_id: int) -> 'Room':
+        """Detached Room view of a room id"""
+        from .building import Room
+
+        start, end = self.connector_offsets[room_id], self.connector_offsets[room_id + 1]
+        return Room(
+            name=self.names[room_id],
+            doors=[self.names[other] for other in self.doors_of(room_id)],
+            windows=self.windows[room_id],
+            lights=self.lights[room_id],
+            adjacent_rooms=[self.names[other] for other in self.adjacent_of(room_id)],
+            connectors={
+                self.names[other]: CONNECTOR_TYPES[kind]
+                for other, kind in zip(self.connector_targets[start:end], self.connector_kinds[start:end])
+            },
+        )
+
+    def floor(self, floor_number: int) -> 'Floor':
+        """Detached Floor view of a 1-based floor number"""
+        from .building import Floor
+
+        if not 1 <= floor_number <= self.num_floors:
+            raise ValueError(f"Floor {floor_number} does not exist")
+        start, end = self.floor_offsets[floor_number - 1], self.floor_offsets[floor_number]
+        return Floor([self.room(room_id) for room_id in range(start, end)])
+
+    def find_path(self, start: int, end: int, bidirectional: bool = False) -> Optional[List[int]]:
+        """
+        Find a path of room ids from start to end with BFS over the link arrays.
+        With bidirectional, the search also runs backward from end over the reverse link arrays.
+        Returns None if no path exists.
+        """
+        if start == end:
+            return [start]
+        if bidirectional:
+            return bidirectional_bfs(start, end, self.links_of, self.links_into)
+        offsets, targets = self.link_offsets, self.link_targets
+        parent = array('i', [-1]) * len(self.names)
+        parent[start] = start
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            for other in targets[offsets[current]:offsets[current + 1]]:
+                if parent[other] != -1:
+                    continue
+                parent[other] = current
+                if other == end:
+                    return self._unwind(parent, start, end)
+                queue.append(other)
+        return None
+
+    def _unwind(self, parent: array, start: int, end: int) -> List[int]:
+        """Follow parent pointers back from end to start"""
+        path = [end]
+        while path[-1] != start:
+            path.append(parent[path[-1]])
+        path.reverse()
+        return path
+
+    def find_path_by_name(self, start_room_name: str, end_room_name: str,
+                          bidirectional: bool = False) -> Optional[List[str]]:
+        """Find a path between two rooms by name, returns the room names or None"""
+        path = self.find_path(self.index_of(start_room_name), self.index_of(end_room_name), bidirectional)
+        if path is None:
+            return None
+        return [self.names[room_id] for room_id in path]
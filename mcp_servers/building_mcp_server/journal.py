@@ -0,0 +1,111 @@
+import json
+import os
+from typing import List
+
+from .building import Building
+from .operations import apply_mutation
+
+JOURNAL_FILENAME = "journal.jsonl"
+
+
+class Journal:
+    """
+    Append-only write-ahead journal of the mutations applied to a building.
+    Each record is one compact JSON line {"seq": int, "op": str, "floor": int, "args": dict}
+    and is fsynced before the mutation is acknowledged. "floor" is a list of floor numbers
+    for the stairs and elevator mutations changing several floors. Compaction folds the records into the
+    floor_N.json snapshots and deletes the journal.
+    """
+
+    def __init__(self, directory_path: str):
+        self.path = os.path.join(directory_path, JOURNAL_FILENAME)
+        self._file = None
+        self._drop_torn_tail()
+        self.pending = len(read_journal(self.path))  # records not folded into the snapshot yet
+
+    def _drop_torn_tail(self) -> None:
+        """Cut an incomplete last line left by a crash, so new records start on a line of their own"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def append(self, records: List[dict]) -> None:
+        """Append records to the journal and flush them to disk"""
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.pending += len(records)
+
+    def read(self) -> List[dict]:
+        """Read the records of the journal, a torn last line left by a crash is ignored"""
+        return read_journal(self.path)
+
+    def clear(self) -> None:
+        """Delete the journal once its records are part of the snapshot"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.pending = 0
+
+    def close(self) -> None:
+        """Close the journal file, it is reopened by the next append"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_journal(path: str) -> List[dict]:
+    """Read the records of a journal file"""
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Only the last record can be incomplete, it was never acknowledged
+                break
+    return records
+
+
+def record_floors(record: dict) -> List[int]:
+    """Numbers of the floors changed by a journal record"""
+    floor = record["floor"]
+    return floor if isinstance(floor, list) else [floor]
+
+
+def replay_journal(building: Building, directory_path: str) -> int:
+    """
+    Apply the journal records that are not part of the floor snapshots yet.
+    A floor file stores the sequence number of the last record it contains, so records
+    folded by an interrupted compaction are not applied twice.
+    A record changing several floors may have been folded into some of them only. It is
+    applied again, connectors complete the missing side, and a record that cannot be applied
+    again is skipped, the dangling connectors it leaves are dropped by the loader.
+    Returns the number of records applied.
+    """
+    applied = 0
+    for record in read_journal(os.path.join(directory_path, JOURNAL_FILENAME)):
+        seq = record["seq"]
+        building.journal_seq = max(building.journal_seq, seq)
+        folded = [
+            floor_number <= len(building.floors) and building.floors[floor_number - 1].journal_seq >= seq
+            for floor_number in record_floors(record)
+        ]
+        if all(folded):
+            continue
+        try:
+            apply_mutation(building, record["op"], record["args"])
+        except ValueError:
+            if not any(folded):
+                raise
+        for floor_number in record_floors(record):
+            building.floors[floor_number - 1].journal_seq = seq
+        applied += 1
+    return applied
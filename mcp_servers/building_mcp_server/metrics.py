@@ -0,0 +1,276 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Phases of a tool call: argument validation, building load (or freshness check), the query or
+# mutation itself, journal or storage writes, response serialization, and waits for the
+# building lock or a group commit. Time spent in none of them is reported as "other"
+PHASES = ("validate", "load", "execute", "persist", "serialize", "wait")
+
+# Upper bounds of the latency histogram buckets in seconds, from 50 us to about 52 s
+BUCKETS = tuple(0.00005 * 2 ** exponent for exponent in range(21))
+
+
+class Histogram:
+    """Latency histogram with fixed exponential buckets, percentiles are interpolated within a bucket"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last bucket holds everything above BUCKETS[-1]
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        """Estimated latency below which fraction of the observations fall, in seconds"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def summary(self) -> dict:
+        """Milliseconds: mean, p50, p95, p99 and max"""
+        return {
+            "mean": round(self.sum / self.count * 1000, 3) if self.count else 0.0,
+            "p50": round(self.percentile(0.50) * 1000, 3),
+            "p95": round(self.percentile(0.95) * 1000, 3),
+            "p99": round(self.percentile(0.99) * 1000, 3),
+            "max": round(self.max * 1000, 3),
+        }
+
+
+class ToolMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram()
+        self.phases: Dict[str, Histogram] = {}
+
+
+class CallTimer:
+    """
+    Timing of one tool call on the current thread.
+    Phases nest: the time of a phase excludes the phases started inside it.
+    """
+
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.failed = False
+        self.phases: Dict[str, float] = {}
+        self._stack: List[list] = []  # [phase name, start of its current stretch]
+        self.start = time.perf_counter()
+
+    def enter(self, phase: str) -> None:
+        now = time.perf_counter()
+        if self._stack:
+            parent = self._stack[-1]
+            self.phases[parent[0]] = self.phases.get(parent[0], 0.0) + now - parent[1]
+        self._stack.append([phase, now])
+
+    def exit(self) -> None:
+        now = time.perf_counter()
+        phase, start = self._stack.pop()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - start
+        if self._stack:
+            self._stack[-1][1] = now
+
+
+class _NullCall:
+    """Stands for a call or a phase when nothing is recorded"""
+    failed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL = _NullCall()
+
+
+class _Call:
+    def __init__(self, metrics: 'Metrics', tool: str):
+        self.metrics = metrics
+        self.timer = CallTimer(tool)
+
+    def __enter__(self) -> CallTimer:
+        self.metrics._local.call = self.timer
+        return self.timer
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics._local.call = None
+        if exc_type is not None:
+            self.timer.failed = True
+        self.metrics._record(self.timer, time.perf_counter() - self.timer.start)
+        return False
+
+
+class _Phase:
+    def __init__(self, timer: CallTimer, phase: str):
+        self.timer = timer
+        self.phase = phase
+
+    def __enter__(self):
+        self.timer.enter(self.phase)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.exit()
+        return False
+
+
+class Metrics:
+    """
+    Call counts, error counts and latency histograms of every tool, with the time of each
+    phase of a call. Phases are recorded on the thread running the call, so code outside a
+    tool call, or with metrics disabled, only pays for one attribute lookup per phase.
+    """
+
+    def __init__(self, enabled: Optional[bool] = None, dump_path: Optional[str] = None,
+                 dump_interval: Optional[float] = None):
+        if enabled is None:
+            enabled = os.getenv("BUILDING_METRICS", "1") == "1"
+        self.enabled = enabled
+        # Prometheus text file rewritten at most every dump_interval seconds
+        self.dump_path = dump_path if dump_path is not None else os.getenv("BUILDING_METRICS_FILE")
+        if dump_interval is None:
+            dump_interval = float(os.getenv("BUILDING_METRICS_INTERVAL", "10"))
+        self.dump_interval = dump_interval
+        self._tools: Dict[str, ToolMetrics] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_dump = 0.0
+        self._dump_failing = False  # the last dump failed and was logged
+        self.started = time.time()
+
+    def call(self, tool: str):
+        """Context manager timing a tool call, set failed on the value it gives to count an error"""
+        if not self.enabled:
+            return _NULL
+        return _Call(self, tool)
+
+    def phase(self, phase: str):
+        """Context manager timing a phase of the tool call running on this thread"""
+        timer = getattr(self._local, "call", None) if self.enabled else None
+        if timer is None:
+            return _NULL
+        return _Phase(timer, phase)
+
+    def _record(self, timer: CallTimer, seconds: float) -> None:
+        other = seconds - sum(timer.phases.values())
+        with self._lock:
+            tool = self._tools.get(timer.tool)
+            if tool is None:
+                tool = self._tools[timer.tool] = ToolMetrics()
+            tool.calls += 1
+            if timer.failed:
+                tool.errors += 1
+            tool.latency.observe(seconds)
+            for phase, phase_seconds in (*timer.phases.items(), ("other", max(other, 0.0))):
+                histogram = tool.phases.get(phase)
+                if histogram is None:
+                    histogram = tool.phases[phase] = Histogram()
+                histogram.observe(phase_seconds)
+            due = self.dump_path and time.monotonic() - self._last_dump >= self.dump_interval
+            if due:
+                self._last_dump = time.monotonic()
+        if due:
+            # The metrics file is a side channel, the tool call goes on without it
+            try:
+                self.dump()
+            except OSError:
+                if not self._dump_failing:
+                    logger.exception(f"Could not write the metrics file {self.dump_path}")
+                self._dump_failing = True
+            else:
+                self._dump_failing = False
+
+    def snapshot(self, tool: Optional[str] = None) -> dict:
+        """Counters and latency summaries of every tool, or of one tool"""
+        with self._lock:
+            tools = {
+                name: {
+                    "calls": metrics.calls,
+                    "errors": metrics.errors,
+                    "latency_ms": metrics.latency.summary(),
+                    "phases_ms": {phase: histogram.summary() for phase, histogram in metrics.phases.items()},
+                }
+                for name, metrics in sorted(self._tools.items())
+                if tool is None or name == tool
+            }
+        return {"enabled": self.enabled, "uptime_s": round(time.time() - self.started, 1), "tools": tools}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._tools = {}
+
+    def prometheus(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        lines = [
+            "# HELP building_tool_calls_total Tool calls.",
+            "# TYPE building_tool_calls_total counter",
+            "# HELP building_tool_errors_total Tool calls that failed.",
+            "# TYPE building_tool_errors_total counter",
+            "# HELP building_tool_latency_seconds Tool call latency.",
+            "# TYPE building_tool_latency_seconds histogram",
+            "# HELP building_tool_phase_seconds Time spent in each phase of the tool calls.",
+            "# TYPE building_tool_phase_seconds summary",
+        ]
+        with self._lock:
+            for name, metrics in sorted(self._tools.items()):
+                label = f'tool="{name}"'
+                lines.append(f"building_tool_calls_total{{{label}}} {metrics.calls}")
+                lines.append(f"building_tool_errors_total{{{label}}} {metrics.errors}")
+                cumulative = 0
+                for bound, count in zip((*BUCKETS, "+Inf"), metrics.latency.counts):
+                    cumulative += count
+                    le = bound if isinstance(bound, str) else f"{bound:g}"
+                    lines.append(f'building_tool_latency_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+                lines.append(f"building_tool_latency_seconds_sum{{{label}}} {metrics.latency.sum:.9f}")
+                lines.append(f"building_tool_latency_seconds_count{{{label}}} {metrics.latency.count}")
+                for phase, histogram in sorted(metrics.phases.items()):
+                    phase_label = f'{label},phase="{phase}"'
+                    lines.append(f"building_tool_phase_seconds_sum{{{phase_label}}} {histogram.sum:.9f}")
+                    lines.append(f"building_tool_phase_seconds_count{{{phase_label}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: Optional[str] = None) -> None:
+        """Write the Prometheus text file, replaced atomically so a scraper never reads half of it"""
+        path = path or self.dump_path
+        if not path:
+            return
+        directory_path = os.path.dirname(os.path.abspath(path))
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory_path, prefix=".metrics.", suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(self.prometheus())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+# Metrics of the tool calls served by this process
+metrics = Metrics()
@@ -0,0 +1,168 @@
+from typing import Callable, Dict, List, Union
+
+from .building import Building, Floor, Room
+
+
+def get_floor(building: Building, floor_number: int) -> Floor:
+    """Get a floor by its 1-based number, to change it"""
+    if not 1 <= floor_number <= len(building.floors):
+        raise ValueError(f"Floor {floor_number} does not exist")
+    return building.writable_floor(floor_number)
+
+
+def get_room(floor: Floor, room_name: str) -> Room:
+    """Get a room of a floor, raising if it does not exist"""
+    room = floor.get_room_by_name(room_name)
+    if room is None:
+        raise ValueError(f"Room {room_name} not found")
+    return room
+
+
+def get_building_room(building: Building, room_name: str) -> Room:
+    """Get a room of any floor, to change it, raising if it does not exist"""
+    room = building.writable_room(room_name)
+    if room is None:
+        raise ValueError(f"Room {room_name} not found")
+    return room
+
+
+def changed_floors(building: Building, floor_number: int, other_rooms) -> Union[int, List[int]]:
+    """floor_number alone, or followed by the numbers of the other floors holding other_rooms"""
+    numbers = {id(floor): number for number, floor in enumerate(building.floors, 1)}
+    others = [numbers[id(room.floor)] for room in other_rooms if room.floor is not None]
+    others = [number for number in dict.fromkeys(others) if number != floor_number]
+    return [floor_number] + others if others else floor_number
+
+
+def add_floor(building: Building, floor_number: int, floor_data: dict) -> Union[int, List[int]]:
+    """
+    Append a floor built from floor_data, floors are always numbered in order.
+    Stairs and elevators listed in the connectors of its rooms, as in the floor files, are
+    linked on both sides to the rooms of the floors already in the building.
+    """
+    rooms = []
+    links = []  # (room, room on another floor, connector type)
+    for room_name, room_data in floor_data["rooms"].items():
+        room = Room(
+            name=room_name,
+            doors=room_data["doors"],
+            windows=room_data["windows"],
+            lights=room_data["lights"],
+            adjacent_rooms=room_data["adjacent_rooms"]
+        )
+        rooms.append(room)
+        for other_name, kind in (room_data.get("connectors") or {}).items():
+            if other_name in floor_data["rooms"]:
+                raise ValueError(f"Rooms {room_name} and {other_name} are on the same floor, use a door")
+            links.append((room, get_building_room(building, other_name), kind))
+    building.add_floor(Floor(rooms))
+    for room, other_room, kind in links:
+        room.add_connector(other_room, kind)
+    return changed_floors(building, len(building.floors), (other_room for _, other_room, _ in links))
+
+
+def add_room(building: Building, floor_number: int, room: dict) -> Union[int, List[int]]:
+    """
+    Add a room and register it as adjacent to the rooms it lists.
+    Stairs and elevators listed in room["connectors"] are linked on both sides.
+    """
+    floor = get_floor(building, floor_number)
+    room = dict(room)
+    connectors = room.pop("connectors", None) or {}
+    connected_rooms = [(get_building_room(building, name), kind) for name, kind in connectors.items()]
+    # check the adjacent rooms and add new room to the adjacent room's adjacent_rooms list
+    for adjacent_room in room["adjacent_rooms"]:
+        adj_room = floor.get_room_by_name(adjacent_room)
+        if adj_room is not None:
+            adj_room.add_adjacent_room(room["name"])
+    new_room = Room(**room)
+    floor.add_room(new_room)
+    for other_room, kind in connected_rooms:
+        new_room.add_connector(other_room, kind)
+    return changed_floors(building, floor_number, (other_room for other_room, _ in connected_rooms))
+
+
+def remove_room(building: Building, floor_number: int, room_name: str) -> Union[int, List[int]]:
+    """Remove a room and every door, adjacency or connector pointing to it"""
+    floor = get_floor(building, floor_number)
+    room = get_room(floor, room_name)
+    connected_names = list(room.connectors)
+    floor.remove_room(room)
+    # Removing the room copies the floors of the rooms it was linked to, look them up afterwards
+    connected_rooms = [room for room in map(building.get_room_by_name, connected_names) if room is not None]
+    return changed_floors(building, floor_number, connected_rooms)
+
+
+def add_door(building: Building, floor_number: int, room_name: str, adjacent_room_name: str) -> int:
+    """Add a door between two rooms of a floor"""
+    floor = get_floor(building, floor_number)
+    room = get_room(floor, room_name)
+    room.add_door(get_room(floor, adjacent_room_name))
+    return floor_number
+
+
+def remove_door(building: Building, floor_number: int, room_name: str, adjacent_room_name: str) -> int:
+    """Remove the door between two rooms of a floor"""
+    floor = get_floor(building, floor_number)
+    room = get_room(floor, room_name)
+    room.remove_door(get_room(floor, adjacent_room_name))
+    return floor_number
+
+
+def add_connector(building: Building, floor_number: int, room_name: str,
+                  other_floor_number: int, other_room_name: str, connector_type: str) -> List[int]:
+    """Link two rooms on different floors by stairs or an elevator"""
+    room = get_room(get_floor(building, floor_number), room_name)
+    other_room = get_room(get_floor(building, other_floor_number), other_room_name)
+    room.add_connector(other_room, connector_type)
+    return [floor_number, other_floor_number]
+
+
+def remove_connector(building: Building, floor_number: int, room_name: str,
+                     other_floor_number: int, other_room_name: str) -> List[int]:
+    """Remove the stairs or elevator link between two rooms"""
+    room = get_room(get_floor(building, floor_number), room_name)
+    other_room = get_room(get_floor(building, other_floor_number), other_room_name)
+    room.remove_connector(other_room)
+    return [floor_number, other_floor_number]
+
+
+def update_lights(building: Building, floor_number: int, room_name: str, new_lights: int) -> int:
+    """Update the number of lights in a room"""
+    floor = get_floor(building, floor_number)
+    get_room(floor, room_name).update_lights(new_lights)
+    return floor_number
+
+
+def update_windows(building: Building, floor_number: int, room_name: str, new_windows: int) -> int:
+    """Update the number of windows in a room"""
+    floor = get_floor(building, floor_number)
+    get_room(floor, room_name).update_windows(new_windows)
+    return floor_number
+
+
+# Tool name -> function applying the mutation, each returns the number of the floor it changed,
+# or the list of floor numbers when a stairs or elevator link changed several floors
+MUTATIONS: Dict[str, Callable[..., Union[int, List[int]]]] = {
+    "Add_Floor": add_floor,
+    "Add_Room": add_room,
+    "Remove_Room": remove_room,
+    "Add_Door": add_door,
+    "Remove_Door": remove_door,
+    "Update_Lights": update_lights,
+    "Update_Windows": update_windows,
+    "Add_Connector": add_connector,
+    "Remove_Connector": remove_connector,
+}
+
+
+def apply_mutation(building: Building, name: str, arguments: dict) -> Union[int, List[int]]:
+    """
+    Apply a mutation tool to a building in memory.
+    arguments are the tool arguments, the building_name entry is ignored.
+    Returns the number of the floor that was changed, or the list of changed floors.
+    """
+    if name not in MUTATIONS:
+        raise ValueError(f"Unknown mutation {name}")
+    kwargs = {key: value for key, value in arguments.items() if key != "building_name"}
+    return MUTATIONS[name](building, **kwargs)
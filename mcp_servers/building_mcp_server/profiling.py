@@ -0,0 +1,114 @@
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from itertools import count
+from typing import TYPE_CHECKING, Callable, Optional, TypeVar
+
+# cProfile, pstats and tracemalloc are only imported once a call is profiled
+if TYPE_CHECKING:
+    import cProfile
+    import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+Result = TypeVar("Result")
+
+# Directory used by calls asking for a profile when BUILDING_PROFILE_DIR is not set
+DEFAULT_PROFILE_DIR = os.path.join(tempfile.gettempdir(), "building_mcp_profiles")
+
+
+class Profiler:
+    """
+    Profiles tool calls with cProfile and tracemalloc, and keeps the slow ones.
+    With a directory set every call is profiled, and the calls taking at least threshold_ms
+    leave two files behind: NAME.prof, the raw cProfile stats (for pstats or snakeviz), and
+    NAME.txt, the top functions by cumulative time and the top allocating lines.
+    A call can also ask for its own profile, which is then always kept.
+    One call is profiled at a time, calls arriving meanwhile run without a profile.
+    """
+
+    def __init__(self, directory: Optional[str] = None, threshold_ms: Optional[float] = None,
+                 top: Optional[int] = None, trace_memory: Optional[bool] = None):
+        self.directory = directory if directory is not None else os.getenv("BUILDING_PROFILE_DIR")
+        if threshold_ms is None:
+            threshold_ms = float(os.getenv("BUILDING_PROFILE_THRESHOLD_MS", "100"))
+        self.threshold_ms = threshold_ms
+        self.top = top if top is not None else int(os.getenv("BUILDING_PROFILE_TOP", "25"))
+        if trace_memory is None:
+            trace_memory = os.getenv("BUILDING_PROFILE_MEMORY", "1") == "1"
+        self.trace_memory = trace_memory
+        self._lock = threading.Lock()
+        self._counter = count(1)
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def run(self, tool: str, description: str, func: Callable[[], Result], force: bool = False) -> Result:
+        """
+        Run func, profiled when profiling is enabled or force is set.
+        description says what was called, it heads the text report.
+        """
+        if not (self.enabled or force) or not self._lock.acquire(blocking=False):
+            return func()
+        try:
+            return self._profile(tool, description, func, force)
+        finally:
+            self._lock.release()
+
+    def _profile(self, tool: str, description: str, func: Callable[[], Result], force: bool) -> Result:
+        import cProfile
+        import tracemalloc
+        # tracemalloc is process wide, leave it alone when someone else started it
+        trace_memory = self.trace_memory and not tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.start()
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profile.runcall(func)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            memory = tracemalloc.take_snapshot() if trace_memory else None
+            if trace_memory:
+                tracemalloc.stop()
+            if force or elapsed_ms >= self.threshold_ms:
+                try:
+                    self._save(tool, description, elapsed_ms, profile, memory)
+                except OSError:
+                    logger.exception(f"Could not save the profile of {tool}")
+
+    def _save(self, tool: str, description: str, elapsed_ms: float, profile: 'cProfile.Profile',
+              memory: Optional['tracemalloc.Snapshot']) -> str:
+        import cProfile
+        import pstats
+        import tracemalloc
+        directory_path = self.directory or DEFAULT_PROFILE_DIR
+        os.makedirs(directory_path, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{next(self._counter)}-{tool}-{elapsed_ms:.0f}ms"
+        path = os.path.join(directory_path, name)
+        profile.dump_stats(path + ".prof")
+
+        report = io.StringIO()
+        report.write(f"{description}\n{elapsed_ms:.3f} ms\n\n")
+        stats = pstats.Stats(profile, stream=report)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        if memory is not None:
+            memory = memory.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, cProfile.__file__),
+            ))
+            report.write(f"Top {self.top} allocating lines\n")
+            for statistic in memory.statistics("lineno")[:self.top]:
+                report.write(f"{statistic}\n")
+        with open(path + ".txt", "w") as f:
+            f.write(report.getvalue())
+        logger.info(f"Profile of {tool} ({elapsed_ms:.1f} ms) saved to {path}.txt")
+        return path
+
+
+# Profiler of the tool calls served by this process
+profiler = Profiler()
@@ -0,0 +1,100 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Type
+
+from mcp.types import Prompt, PromptArgument, TextContent, Tool, ToolAnnotations
+from pydantic import BaseModel
+
+Handler = Callable[[BaseModel], List[TextContent]]
+
+
+@dataclass(frozen=True)
+class ToolSpec:
+    """Everything the server knows about a tool, declared once"""
+    name: str
+    model: Type[BaseModel]  # arguments, validated before the handler runs
+    handler: Handler
+    description: str
+    prompt: str  # description of the prompt of the tool
+    writes: bool = False  # modifies a building
+    batchable: bool = False  # can be an operation of Apply_Batch
+
+
+class ToolRegistry:
+    """
+    The tools of the server, in declaration order.
+    The Tool and Prompt lists sent to clients are built from the argument models the first
+    time they are asked for and kept, so listing tools never regenerates a JSON schema.
+    common_properties are JSON schema properties every tool accepts besides the fields of its
+    model, the caller takes them out of the arguments before validating them.
+    """
+
+    def __init__(self, common_properties: Optional[Dict[str, dict]] = None):
+        self.common_properties = common_properties or {}
+        self._specs: Dict[str, ToolSpec] = {}
+        self._tools: Optional[List[Tool]] = None
+        self._prompts: Optional[List[Prompt]] = None
+
+    def register(self, spec: ToolSpec) -> ToolSpec:
+        if spec.name in self._specs:
+            raise ValueError(f"Tool {spec.name} is already registered")
+        self._specs[spec.name] = spec
+        self._tools = self._prompts = None
+        return spec
+
+    def tool(self, name: str, model: Type[BaseModel], description: str, prompt: Optional[str] = None,
+             writes: bool = False, batchable: bool = False) -> Callable[[Handler], Handler]:
+        """Decorator registering a handler as the tool name"""
+        def decorator(handler: Handler) -> Handler:
+            self.register(ToolSpec(name, model, handler, description, prompt or description, writes, batchable))
+            return handler
+        return decorator
+
+    def get(self, name: str) -> ToolSpec:
+        spec = self._specs.get(name)
+        if spec is None:
+            raise ValueError(f"Unknown tool {name}")
+        return spec
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._specs
+
+    def __iter__(self) -> Iterator[ToolSpec]:
+        return iter(self._specs.values())
+
+    def __len__(self) -> int:
+        return len(self._specs)
+
+    def tools(self) -> List[Tool]:
+        if self._tools is None:
+            self._tools = [
+                Tool(
+                    name=spec.name,
+                    description=spec.description,
+                    inputSchema=self._input_schema(spec),
+                    annotations=ToolAnnotations(readOnlyHint=not spec.writes),
+                )
+                for spec in self
+            ]
+        return self._tools
+
+    def _input_schema(self, spec: ToolSpec) -> dict:
+        schema = spec.model.model_json_schema()
+        if self.common_properties:
+            schema["properties"] = {**schema.get("properties", {}), **self.common_properties}
+        return schema
+
+    def prompts(self) -> List[Prompt]:
+        if self._prompts is None:
+            self._prompts = [
+                Prompt(
+                    name=spec.name,
+                    description=spec.prompt,
+                    arguments=[
+                        PromptArgument(name=field_name, description=field.description,
+                                       required=field.is_required())
+                        for field_name, field in spec.model.model_fields.items()
+                    ],
+                )
+                for spec in self
+            ]
+        return self._prompts
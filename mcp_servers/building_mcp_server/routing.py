@@ -0,0 +1,151 @@
+import heapq
+import threading
+import weakref
+from collections import deque
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from .graph import unwind_path
+
+if TYPE_CHECKING:
+    from .building import Building, Floor
+
+# Parent pointers and depths of a BFS that stays on one floor
+FloorTree = Tuple[Dict[str, Optional[str]], Dict[str, int]]
+
+
+def floor_bfs(start: str, doors: Dict[str, List[str]]) -> FloorTree:
+    """BFS from start over the doors of one floor, doors maps each room to its rooms on the same floor"""
+    parents: Dict[str, Optional[str]] = {start: None}
+    depth = {start: 0}
+    queue = deque([start])
+    while queue:
+        current = queue.popleft()
+        for other in doors.get(current, ()):
+            if other not in parents:
+                parents[other] = current
+                depth[other] = depth[current] + 1
+                queue.append(other)
+    return parents, depth
+
+
+class FloorTable:
+    """
+    Routing data of one floor.
+    Portals are the rooms of the floor leading to another floor, through stairs, an elevator
+    or a door. The BFS tree of each portal gives its distance, and path, to every room it
+    reaches on the floor, so the portal to portal distances are precomputed.
+    """
+
+    def __init__(self, floor: 'Floor'):
+        names: Set[str] = {room.name for room in floor.rooms}
+        self.doors: Dict[str, List[str]] = {}  # room -> rooms of the floor behind its doors
+        self.links: Dict[str, List[str]] = {}  # portal -> rooms of other floors it leads to
+        for room in floor.rooms:
+            self.doors[room.name] = [name for name in room.doors if name in names]
+            links = [name for name in room.doors if name not in names]
+            links.extend(name for name in room.connectors if name not in names)
+            if links:
+                self.links[room.name] = links
+        self.trees: Dict[str, FloorTree] = {portal: floor_bfs(portal, self.doors) for portal in self.links}
+        self.version = floor.topology_version
+        self.floor = weakref.ref(floor)  # tables are found by id(floor), which a later floor may reuse
+
+    def tree(self, room_name: str) -> FloorTree:
+        """BFS tree of a room on the floor, precomputed for portals"""
+        tree = self.trees.get(room_name)
+        return tree if tree is not None else floor_bfs(room_name, self.doors)
+
+
+class HierarchicalRouter:
+    """
+    Two level router for multi-floor buildings.
+    A query runs one BFS on the floor of the start room, then a Dijkstra search on the small
+    overlay graph whose nodes are the portals of every floor: portals of a floor are linked by
+    their precomputed distances, and portals of different floors by their stairs, elevators or
+    doors. Paths are as short as those of a BFS over every room.
+    """
+
+    def __init__(self, building: 'Building'):
+        self._building = weakref.ref(building)  # the building holds its router
+        self._tables: Dict[int, FloorTable] = {}  # id(floor) -> table
+        self._floor_of: Dict[str, FloorTable] = {}  # room name -> table of its floor
+        self._version = -1
+        self._lock = threading.Lock()  # concurrent queries share one published version
+
+    def refresh(self) -> None:
+        """Recompute the tables of the floors changed since the last refresh"""
+        building = self._building()
+        if building is None:
+            return
+        with self._lock:
+            if self._version == building.topology_version:
+                return
+            tables = {}
+            for floor in building.floors:
+                table = self._tables.get(id(floor))
+                if table is None or table.floor() is not floor or table.version != floor.topology_version:
+                    table = FloorTable(floor)
+                tables[id(floor)] = table
+            self._floor_of = {name: table for table in tables.values() for name in table.doors}
+            self._tables = tables
+            self._version = building.topology_version
+
+    def fork(self, building: 'Building') -> 'HierarchicalRouter':
+        """Router of a new version of the building, starting from the tables of this one"""
+        router = HierarchicalRouter(building)
+        with self._lock:
+            router._tables = dict(self._tables)
+            router._floor_of = self._floor_of
+            router._version = self._version
+        return router
+
+    def find_path(self, start: str, end: str) -> Optional[List[str]]:
+        """Shortest path of room names from start to end, or None"""
+        floor_of = self._floor_of
+        if start not in floor_of or end not in floor_of:
+            return None
+        if start == end:
+            return [start]
+
+        trees: Dict[str, FloorTree] = {}  # BFS trees used by this query
+        distance = {start: 0}
+        previous: Dict[str, Tuple[str, bool]] = {}  # room -> (room it was reached from, through a link)
+        heap = [(0, 0, start)]
+        counter = 1
+        while heap:
+            current_distance, _, current = heapq.heappop(heap)
+            if current == end:
+                break
+            if current_distance > distance[current]:
+                continue
+            table = floor_of[current]
+            parents, depth = trees[current] = table.tree(current)
+            # Walk the floor to its portals, or to the end room if it is on this floor
+            targets = list(table.links)
+            if floor_of[end] is table:
+                targets.append(end)
+            steps = [(other, depth[other], False) for other in targets if other in depth and other != current]
+            # Take the stairs, elevators and doors to the other floors
+            steps.extend((other, 1, True) for other in table.links.get(current, ()) if other in floor_of)
+            for other, length, through_link in steps:
+                other_distance = current_distance + length
+                if other_distance < distance.get(other, other_distance + 1):
+                    distance[other] = other_distance
+                    previous[other] = (current, through_link)
+                    heapq.heappush(heap, (other_distance, counter, other))
+                    counter += 1
+        else:
+            return None
+
+        # Expand the overlay route into rooms
+        path = [end]
+        node = end
+        while node != start:
+            origin, through_link = previous[node]
+            if through_link:
+                path.append(origin)
+            else:
+                path.extend(reversed(unwind_path(trees[origin][0], node)[:-1]))
+            node = origin
+        path.reverse()
+        return path
@@ -1,28 +1,35 @@
 import os
+import asyncio
 import mcp
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from mcp.server import Server
 import logging
 from typing import Annotated
-from mcp.shared.exceptions import McpError
-from mcp.server import Server
 import json
-from mcp.server import Server
 from mcp.types import (
-    ErrorData,
     TextContent,
     Tool,
     Prompt,
-    PromptArgument,
-    INVALID_PARAMS
 )
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from .building import *
+from .metrics import metrics
+from .profiling import profiler
+from .registry import ToolRegistry, ToolSpec
+from .store import BuildingStore
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 logger = logging.getLogger(__name__)
 
 server = Server("building_mcp_server")
 
+# Parsed buildings stay resident between tool calls
+store = BuildingStore()
+
+# Tool calls run on this pool, off the asyncio event loop
+MAX_TOOL_WORKERS = int(os.getenv("BUILDING_MCP_WORKERS", "8"))
+tool_executor = ThreadPoolExecutor(max_workers=MAX_TOOL_WORKERS, thread_name_prefix="building_tool")
+
 def get_building_dir():
     """Get the building directory from environment variable."""
     building_dir = os.getenv("BUILDING_DIR")
@@ -30,264 +37,148 @@ def get_building_dir():
         raise ValueError("BUILDING_DIR environment variable is not set")
     return building_dir
 
-class Read_Building_data(BaseModel):
+class ToolArguments(BaseModel):
+    """Base of the tool argument models, their validators are built on first use to keep startup short."""
+    model_config = ConfigDict(defer_build=True)
+
+class Read_Building_data(ToolArguments):
     """Parameters for loading building data."""
     building_name: Annotated[str, Field(description="Building name")]
+    floor_numbers: Annotated[Optional[List[int]], Field(default=None, description="Floor numbers to read, all floors when left out")]
+    fields: Annotated[Optional[List[str]], Field(default=None, description="Room fields to return besides the name: windows, lights, doors, adjacent_rooms, connectors. All of them when left out")]
+    cursor: Annotated[Optional[str], Field(default=None, description="next_cursor of the previous page, to read the rooms that follow")]
+    limit: Annotated[int, Field(default=200, ge=1, le=5000, description="Maximum number of rooms in the page")]
 
-class Add_Floor(BaseModel):
+class Add_Floor(ToolArguments):
     """Parameters for adding a floor to the building."""
     building_name: Annotated[str, Field(description="Building name")]
     floor_number: Annotated[int, Field(description="Floor number")]
-    floor_data: Annotated[dict, Field(description="Floor data in a dictionary format as {rooms: list[dict]}]")]
+    floor_data: Annotated[dict, Field(description="Floor data in a dictionary format as {rooms: list[dict]}], a room may list connectors: {room name on another floor: \"stairs\" or \"elevator\"}")]
 
-class Add_Room(BaseModel):
+class Add_Room(ToolArguments):
     """Parameters for adding a room to the building."""
     building_name: Annotated[str, Field(description="Building name")]
     floor_number: Annotated[int, Field(description="Floor number")]
-    room: Annotated[dict, Field(description="Room data in a dictionary format as {name: str, doors: list[str], windows: int, lights: int, adjacent_rooms: list[str]}")]
+    room: Annotated[dict, Field(description="Room data in a dictionary format as {name: str, doors: list[str], windows: int, lights: int, adjacent_rooms: list[str]}, optionally with connectors: {room name on another floor: \"stairs\" or \"elevator\"}")]
     
-class Remove_Room(BaseModel):
+class Remove_Room(ToolArguments):
     """Parameters for removing a room from the building."""
     building_name: Annotated[str, Field(description="Building name")]
     floor_number: Annotated[int, Field(description="Floor number")]
     room_name: Annotated[str, Field(description="Room name")]
 
-class Add_Door(BaseModel):
+class Add_Door(ToolArguments):
     """Parameters for adding a door to the building."""
     building_name: Annotated[str, Field(description="Building name")]
     floor_number: Annotated[int, Field(description="Floor number")]
     room_name: Annotated[str, Field(description="Room name")]
     adjacent_room_name: Annotated[str, Field(description="Adjacent room name")]
 
-class Remove_Door(BaseModel):
+class Remove_Door(ToolArguments):
     """Parameters for removing a door from the building."""
     building_name: Annotated[str, Field(description="Building name")]
     floor_number: Annotated[int, Field(description="Floor number")]
     room_name: Annotated[str, Field(description="Room name")]
     adjacent_room_name: Annotated[str, Field(description="Adjacent room name")]
 
-class Update_Lights(BaseModel):
+class Update_Lights(ToolArguments):
     """Parameters for updating the number of lights in a room."""
     building_name: Annotated[str, Field(description="Building name")]
     floor_number: Annotated[int, Field(description="Floor number")]
     room_name: Annotated[str, Field(description="Room name")]
     new_lights: Annotated[int, Field(description="New number of lights")]   
     
-class Update_Windows(BaseModel):
+class Update_Windows(ToolArguments):
     """Parameters for updating the number of windows in a room."""
     building_name: Annotated[str, Field(description="Building name")]
     floor_number: Annotated[int, Field(description="Floor number")]
     room_name: Annotated[str, Field(description="Room name")]
     new_windows: Annotated[int, Field(description="New number of windows")]
 
-class Find_Path(BaseModel):
+class Add_Connector(ToolArguments):
+    """Parameters for linking two rooms on different floors by stairs or an elevator."""
+    building_name: Annotated[str, Field(description="Building name")]
+    floor_number: Annotated[int, Field(description="Floor number of the first room")]
+    room_name: Annotated[str, Field(description="First room name")]
+    other_floor_number: Annotated[int, Field(description="Floor number of the second room")]
+    other_room_name: Annotated[str, Field(description="Second room name")]
+    connector_type: Annotated[str, Field(description="Connector type, stairs or elevator")]
+
+class Remove_Connector(ToolArguments):
+    """Parameters for removing the stairs or elevator link between two rooms."""
+    building_name: Annotated[str, Field(description="Building name")]
+    floor_number: Annotated[int, Field(description="Floor number of the first room")]
+    room_name: Annotated[str, Field(description="First room name")]
+    other_floor_number: Annotated[int, Field(description="Floor number of the second room")]
+    other_room_name: Annotated[str, Field(description="Second room name")]
+
+class Find_Path(ToolArguments):
     """Parameters for finding a path between two rooms."""
     building_name: Annotated[str, Field(description="Building name")]
     start_room_name: Annotated[str, Field(description="Start room name")]
     end_room_name: Annotated[str, Field(description="End room name")]   
-    
+    bidirectional: Annotated[bool, Field(default=False, description="Search from both rooms at once, faster for long routes")]
+
+class Find_Paths_Batch(ToolArguments):
+    """Parameters for finding the paths from several start rooms to several end rooms."""
+    building_name: Annotated[str, Field(description="Building name")]
+    start_room_names: Annotated[List[str], Field(description="Start room names")]
+    end_room_names: Annotated[List[str], Field(description="End room names, each is routed from every start room")]
+
+class Building_Stats(ToolArguments):
+    """Parameters for reading the statistics of a building."""
+    building_name: Annotated[str, Field(description="Building name")]
+    floor_numbers: Annotated[Optional[List[int]], Field(default=None, description="Floors to report one by one, all floors when left out")]
+
+class Find_Components(ToolArguments):
+    """Parameters for listing the connected components of a building."""
+    building_name: Annotated[str, Field(description="Building name")]
+    limit: Annotated[int, Field(default=20, ge=1, le=1000, description="Maximum number of components and isolated rooms listed")]
+
+class Server_Stats(ToolArguments):
+    """Parameters for reading the call statistics of the server."""
+    tool: Annotated[Optional[str], Field(default=None, description="Tool to report, all tools when left out")]
+    reset: Annotated[bool, Field(default=False, description="Clear the statistics once reported")]
+
+class Batch_Operation(ToolArguments):
+    """A single operation of a batch."""
+    tool: Annotated[str, Field(description="Mutation tool name: Add_Floor, Add_Room, Remove_Room, Add_Door, Remove_Door, Update_Lights, Update_Windows, Add_Connector or Remove_Connector")]
+    arguments: Annotated[dict, Field(description="Arguments of the tool, building_name can be left out")]
+
+class Apply_Batch(ToolArguments):
+    """Parameters for applying several mutations to a building at once."""
+    building_name: Annotated[str, Field(description="Building name")]
+    operations: Annotated[List[Batch_Operation], Field(description="Operations applied in order")]
+
+def serialize(value, **options) -> str:
+    """JSON text of a tool response"""
+    with metrics.phase("serialize"):
+        return json.dumps(value, **options)
+
+# Argument accepted by every tool to save a profile of the call, see profiling.Profiler
+PROFILE_ARGUMENT = "profile"
+
+# Every tool of the server, in the order they are listed
+tools = ToolRegistry(common_properties={
+    PROFILE_ARGUMENT: {"type": "boolean", "default": False, "title": "Profile",
+                       "description": "Save a cProfile and tracemalloc report of this call"},
+})
 
 @server.list_tools()
 async def list_tools() -> list[Tool]:
-    return [
-        Tool(
-            name="Read_Building_data",
-            description="Load building data",
-            inputSchema=Read_Building_data.model_json_schema(),
-        ),
-        Tool(
-            name="Add_Floor",
-            description="Add a floor to the building",
-            inputSchema=Add_Floor.model_json_schema(),
-        ),
-        Tool(
-            name="Add_Room",
-            description="Add a room to the building and also update the adjacent rooms, doors, windows, lights",
-            inputSchema=Add_Room.model_json_schema(),
-        ),
-        Tool(
-            name="Remove_Room",
-            description="Remove a room from the building",
-            inputSchema=Remove_Room.model_json_schema(),
-        ),
-        Tool(
-            name="Add_Door",
-            description="Add a door to the building",
-            inputSchema=Add_Door.model_json_schema(),
-        ),
-        Tool(
-            name="Remove_Door",
-            description="Remove a door from the building",
-            inputSchema=Remove_Door.model_json_schema(),
-        ),
-        Tool(
-            name="Update_Lights",
-            description="Update the number of lights in a room",
-            inputSchema=Update_Lights.model_json_schema(),
-        ),
-        Tool(
-            name="Update_Windows",
-            description="Update the number of windows in a room",
-            inputSchema=Update_Windows.model_json_schema(),
-        ),
-        Tool(
-            name="Find_Path",
-            description="Find a path between two rooms",
-            inputSchema=Find_Path.model_json_schema(),
-        ),
-        
-    ]
+    return tools.tools()
 
 @server.list_prompts()
 async def list_prompts() -> list[Prompt]:
-    return [
-        Prompt(
-            name="Read_Building_data",
-            description="Read building data from building name",
-            arguments=[
-                PromptArgument(
-                    name="building_name", description="Building name", required=True
-                )
-            ]
-        ),
-        Prompt(
-            name="Add_Floor",
-            description="Add a floor to the building",
-            arguments=[
-                PromptArgument(
-                    name="building_name", description="Building name", required=True
-                ),
-                PromptArgument(
-                    name="floor_number", description="Floor number", required=True
-                ),
-                PromptArgument(
-                    name="floor_data", description="Floor data", required=True
-                )
-            ]   
-        ),
-        Prompt(
-            name="Add_Room",
-            description="Add a room to the building",
-            arguments=[
-                PromptArgument(
-                    name="building_name", description="Building name", required=True
-                ),
-                PromptArgument(
-                    name="floor_number", description="Floor number", required=True
-                ),
-                PromptArgument(
-                    name="room", description="Room data", required=True
-                )
-            ]       
-        ),
-        Prompt(
-            name="Remove_Room",
-            description="Remove a room from the building",
-            arguments=[
-                PromptArgument(
-                    name="building_name", description="Building name", required=True
-                ),
-                PromptArgument(
-                    name="floor_number", description="Floor number", required=True
-                ),
-                PromptArgument(
-                    name="room_name", description="Room name", required=True
-                )
-            ]   
-        ),
-        Prompt(
-            name="Add_Door",
-            description="Add a door to the building",
-            arguments=[
-                PromptArgument(
-                    name="building_name", description="Building name", required=True
-                ),
-                PromptArgument(
-                    name="floor_number", description="Floor number", required=True
-                ),
-                PromptArgument(
-                    name="room_name", description="Room name", required=True
-                ),
-                PromptArgument(
-                    name="adjacent_room_name", description="Adjacent room name", required=True
-                )
-            ]   
-        ),
-        Prompt(
-            name="Remove_Door",
-            description="Remove a door from the building",
-            arguments=[
-                PromptArgument(
-                    name="building_name", description="Building name", required=True
-                ),
-                PromptArgument(
-                    name="floor_number", description="Floor number", required=True
-                ),
-                PromptArgument(
-                    name="room_name", description="Room name", required=True
-                ),
-                PromptArgument(
-                    name="adjacent_room_name", description="Adjacent room name", required=True
-                )
-            ]   
-        ),
-        Prompt(
-            name="Update_Lights",
-            description="Update the number of lights in a room",
-            arguments=[
-                PromptArgument(
-                    name="building_name", description="Building name", required=True
-                ),
-                PromptArgument(
-                    name="floor_number", description="Floor number", required=True
-                ),
-                PromptArgument(
-                    name="room_name", description="Room name", required=True
-                ),
-                PromptArgument(
-                    name="new_lights", description="New number of lights", required=True
-                )
-            ]   
-        ),
-        Prompt(
-            name="Update_Windows",
-            description="Update the number of windows in a room",
-            arguments=[
-                PromptArgument(
-                    name="building_name", description="Building name", required=True
-                ),
-                PromptArgument(
-                    name="floor_number", description="Floor number", required=True
-                ),
-                PromptArgument(
-                    name="room_name", description="Room name", required=True
-                ),
-                PromptArgument(
-                    name="new_windows", description="New number of windows", required=True
-                )
-            ] 
-            ),
-        Prompt(
-            name="Find_Path",
-            description="Find a path between two rooms",
-            arguments=[
-                PromptArgument(
-                    name="building_name", description="Building name", required=True
-                ),
-                PromptArgument(
-                    name="start_room_name", description="Start room name", required=True
-                ),
-                PromptArgument(
-                    name="end_room_name", description="End room name", required=True
-                )
-            ]   
-        )
-    ]
+    return tools.prompts()
 
 @server.call_tool()
 async def call_tool(name:str , arguments: Dict) -> list[TextContent]:
     """Call the MCP tool
 
+    The tool runs on the tool executor, so file I/O and graph searches never block the
+    event loop and several tool calls can be processed at the same time.
+
     Args:
         name (str): name of the tool to be called
         arguments (Dict): Arguments with type Dict 
@@ -295,135 +186,190 @@ async def call_tool(name:str , arguments: Dict) -> list[TextContent]:
     Returns:
         list[TextContent]: response of the tool in text content format
     """
-    logger.info(f"call_tool triggered with Arguments are: {arguments} with type {type(arguments)} and name :{name} ")
-    try:
-        building_dir = get_building_dir()
-        if name == "Read_Building_data":
-            args = Read_Building_data(**arguments)
-            message = ""
-            for floor in os.listdir(os.path.join(building_dir, args.building_name)):
-                with open(os.path.join(building_dir, args.building_name, floor), "r") as f:
-                    floor_data = json.load(f)
-                message += f"Floor {floor}: {floor_data}\n"
-            
-            return [TextContent(type="text", text=f"Building data: {message}")]
-        elif name == "Add_Floor":
-            args = Add_Floor(**arguments)
-            building = load_building_from_directory(args.building_name)
-            floor_data = args.floor_data
-            rooms = []
-            for room_name, room_data in floor_data["rooms"].items():
-                room = Room(
-                    name=room_name,
-                    doors=room_data["doors"],
-                    windows=room_data["windows"],
-                    lights=room_data["lights"],     
-                    adjacent_rooms=room_data["adjacent_rooms"]
-                )
-                rooms.append(room)
-            floor = Floor(rooms)
-            building.add_floor(floor)
-            building.to_json(args.building_name)
-            return [TextContent(type="text", text=f"Floor added successfully")]
-        elif name == "Add_Room":
-            args = Add_Room(**arguments)
-            building = load_building_from_directory(args.building_name)
-            room_data = args.room
-            floor_number = args.floor_number
-            floor = building.floors[floor_number - 1]
-            # check the adjacent rooms and add new room to the adjacent room's adjacent_rooms list
-            for adjacent_room in room_data["adjacent_rooms"]:
-                adj_room = floor.get_room_by_name(adjacent_room)
-                if adj_room is not None:
-                    adj_room.adjacent_rooms.append(room_data["name"])
-            
-            room = Room(**room_data)
-            floor.add_room(room)
-            
-            building.to_json(args.building_name)
-            return [TextContent(type="text", text=f"Room added successfully")]
-        elif name == "Remove_Room":
-            args = Remove_Room(**arguments)
-            building = load_building_from_directory(args.building_name)
-            floor_number = args.floor_number
-            room_name = args.room_name
-            floor = building.floors[floor_number - 1]
-            room = floor.get_room_by_name(room_name)
-            if room is None:
-                raise ValueError(f"Room {room_name} not found")
-            floor.remove_room(room)
-            building.to_json(args.building_name)
-            return [TextContent(type="text", text=f"Room removed successfully")]
-        elif name == "Add_Door":
-            args = Add_Door(**arguments)
-            building = load_building_from_directory(args.building_name)
-            room_name = args.room_name
-            adjacent_room_name = args.adjacent_room_name
-            floor_number = args.floor_number
-            floor = building.floors[floor_number - 1]
-            room = floor.get_room_by_name(room_name)
-            adjacent_room = floor.get_room_by_name(adjacent_room_name)
-            if room is None:
-                raise ValueError(f"Room {room_name} not found")
-            if adjacent_room is None:
-                raise ValueError(f"Room {adjacent_room_name} not found")
-            room.add_door(adjacent_room)
-            building.to_json(args.building_name)
-            return [TextContent(type="text", text=f"Door added successfully")]
-        elif name == "Remove_Door":
-            args = Remove_Door(**arguments)
-            building = load_building_from_directory(args.building_name)
-            floor_number = args.floor_number
-            room_name = args.room_name
-            adjacent_room_name = args.adjacent_room_name
-            floor = building.floors[floor_number - 1]
-            room = floor.get_room_by_name(room_name)
-            adjacent_room = floor.get_room_by_name(adjacent_room_name)
-            if room is None:
-                raise ValueError(f"Room {room_name} not found")
-            if adjacent_room is None:
-                raise ValueError(f"Room {adjacent_room_name} not found")
-            room.remove_door(adjacent_room)
-            building.to_json(args.building_name)
-            return [TextContent(type="text", text=f"Door removed successfully")]
-        elif name == "Update_Lights":
-            args = Update_Lights(**arguments)
-            building = load_building_from_directory(args.building_name)
-            floor_number = args.floor_number
-            room_name = args.room_name
-            new_lights = args.new_lights
-            floor = building.floors[floor_number - 1]
-            room = floor.get_room_by_name(room_name)
-            room.update_lights(new_lights)
-            building.to_json(args.building_name)
-            return [TextContent(type="text", text=f"Lights updated successfully")]
-        elif name == "Update_Windows":
-            args = Update_Windows(**arguments)
-            building = load_building_from_directory(args.building_name)
-            floor_number = args.floor_number
-            room_name = args.room_name
-            new_windows = args.new_windows
-            floor = building.floors[floor_number - 1]
-            room = floor.get_room_by_name(room_name)
-            room.update_windows(new_windows)
-            building.to_json(args.building_name)
-            return [TextContent(type="text", text=f"Windows updated successfully")]
-        elif name == "Find_Path":
-            args = Find_Path(**arguments)
-            building = load_building_from_directory(args.building_name)
-            start_room_name = args.start_room_name
-            end_room_name = args.end_room_name
-            path = building.find_path_by_name(start_room_name, end_room_name)
-            if path is None:
-                return [TextContent(type="text", text=f"No path found")]
-            else:
-                message =  "Path found:" + " -> ".join(room.name for room in path)
-                return [TextContent(type="text", text=message)]
-    except Exception as e:
-        error_details = traceback.format_exc()
-        return [TextContent(type="text", text=f"Error occured : {str(error_details)}")] 
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(tool_executor, run_tool, name, arguments)
+
+def run_tool(name: str, arguments: Dict) -> list[TextContent]:
+    """Run the MCP tool synchronously
+
+    Any tool accepts "profile": true among its arguments to save a profile of the call,
+    the property is added to every listed input schema, see profiling.Profiler.
+
+    Args:
+        name (str): name of the tool to be called
+        arguments (Dict): Arguments with type Dict 
+
+    Returns:
+        list[TextContent]: response of the tool in text content format
+    """
+    logger.debug("call_tool %s", name)
+    with metrics.call(name) as call:
+        try:
+            get_building_dir()
+            spec = tools.get(name)
+            arguments = dict(arguments or {})
+            profile = bool(arguments.pop(PROFILE_ARGUMENT, False))
+            with metrics.phase("validate"):
+                args = spec.model(**arguments)
+            with metrics.phase("execute"):
+                if profiler.enabled or profile:
+                    return profiler.run(name, f"{name} {str(arguments)[:2000]}",
+                                        lambda: spec.handler(args), force=profile)
+                return spec.handler(args)
+        except Exception as e:
+            call.failed = True
+            error_details = traceback.format_exc()
+            return [TextContent(type="text", text=f"Error occured : {str(error_details)}")] 
+
+@tools.tool(
+    "Read_Building_data", Read_Building_data,
+    "Read the rooms of a building as compact JSON, one page at a time, optionally filtered by floor and projected to some fields",
+    prompt="Read building data from building name",
+)
+def read_building_data(args: Read_Building_data) -> list[TextContent]:
+    # Served from the resident building, which holds the journaled mutations and does not depend on
+    # the storage backend writing JSON files, or from the snapshot of a building that is not resident
+    with store.read(args.building_name, mapped=True) as building:
+        page = building.read_rooms(args.floor_numbers, args.fields, args.cursor, args.limit)
+        message = serialize(page, separators=(",", ":"))
+    return [TextContent(type="text", text=f"Building data: {message}")]
+
+# Tools applying one operation of operations.py: name, arguments, description, response
+MUTATIONS = (
+    ("Add_Floor", Add_Floor, "Add a floor to the building", "Floor added successfully"),
+    ("Add_Room", Add_Room, "Add a room to the building and also update the adjacent rooms, doors, windows, lights",
+     "Room added successfully"),
+    ("Remove_Room", Remove_Room, "Remove a room from the building", "Room removed successfully"),
+    ("Add_Door", Add_Door, "Add a door to the building", "Door added successfully"),
+    ("Remove_Door", Remove_Door, "Remove a door from the building", "Door removed successfully"),
+    ("Update_Lights", Update_Lights, "Update the number of lights in a room", "Lights updated successfully"),
+    ("Update_Windows", Update_Windows, "Update the number of windows in a room", "Windows updated successfully"),
+    ("Add_Connector", Add_Connector, "Link two rooms on different floors by stairs or an elevator",
+     "Connector added successfully"),
+    ("Remove_Connector", Remove_Connector, "Remove the stairs or elevator link between two rooms",
+     "Connector removed successfully"),
+)
+
+def mutation_handler(name: str, message: str):
+    """Handler journaling the operation name through the store"""
+    def handle(args: BaseModel) -> list[TextContent]:
+        store.mutate(args.building_name, name, args.model_dump())
+        return [TextContent(type="text", text=message)]
+    return handle
+
+for name, model, description, message in MUTATIONS:
+    tools.register(ToolSpec(name, model, mutation_handler(name, message), description, description,
+                            writes=True, batchable=True))
+
+@tools.tool("Find_Path", Find_Path, "Find a path between two rooms")
+def find_path(args: Find_Path) -> list[TextContent]:
+    with store.read(args.building_name, mapped=True) as building:
+        path = building.find_path_names(args.start_room_name, args.end_room_name, args.bidirectional)
+    if path is None:
+        return [TextContent(type="text", text=f"No path found")]
+    with metrics.phase("serialize"):
+        message =  "Path found:" + " -> ".join(path)
+    return [TextContent(type="text", text=message)]
+
+@tools.tool(
+    "Find_Paths_Batch", Find_Paths_Batch,
+    "Find the paths from one or more start rooms to a list of end rooms in one call, with one search per start room",
+    prompt="Find the paths from several start rooms to several end rooms",
+)
+def find_paths_batch(args: Find_Paths_Batch) -> list[TextContent]:
+    with store.read(args.building_name) as building:
+        paths = building.find_paths_by_name(args.start_room_names, args.end_room_names)
+    results = [
+        {"start": start_name, "end": end_name,
+         "path": [room.name for room in path] if path is not None else None}
+        for start_name, end_paths in paths.items()
+        for end_name, path in end_paths.items()
+    ]
+    found = sum(result["path"] is not None for result in results)
+    message = f"Paths found for {found} of {len(results)} routes: "
+    return [TextContent(type="text", text=message + serialize(results))]
+
+@tools.tool(
+    "Building_Stats", Building_Stats,
+    "Room counts, total lights and windows, door counts and average doors per room of a building and of each floor",
+    prompt="Read the statistics of a building",
+)
+def building_stats(args: Building_Stats) -> list[TextContent]:
+    with store.read(args.building_name, mapped=True) as building:
+        stats = building.stats(args.floor_numbers)
+    return [TextContent(type="text", text="Building stats: " + serialize(stats, separators=(",", ":")))]
+
+@tools.tool(
+    "Find_Components", Find_Components,
+    "List the groups of rooms connected by doors, stairs or elevators, largest first, and the isolated rooms that no path reaches",
+    prompt="List the connected components and isolated rooms of a building",
+)
+def find_components(args: Find_Components) -> list[TextContent]:
+    with store.read(args.building_name) as building:
+        components = building.connected_components()
+    isolated = [rooms[0] for rooms in components if len(rooms) == 1]
+    result = {
+        "num_components": len(components),
+        "num_isolated_rooms": len(isolated),
+        "isolated_rooms": isolated[:args.limit],
+        "components": [{"size": len(rooms), "rooms": rooms[:args.limit]} for rooms in components[:args.limit]],
+    }
+    return [TextContent(type="text", text="Components: " + serialize(result, separators=(",", ":")))]
+
+@tools.tool(
+    "Server_Stats", Server_Stats,
+    "Call counts, error counts and p50/p95/p99 latencies of every tool, with the time spent validating arguments, loading the building, running the query or mutation, persisting and serializing, and the hits, misses, evictions and memory footprint of the resident buildings",
+    prompt="Read the call statistics of the server",
+)
+def server_stats(args: Server_Stats) -> list[TextContent]:
+    stats = metrics.snapshot(args.tool)
+    stats["store"] = store.cache_stats()
+    if args.reset:
+        metrics.reset()
+    return [TextContent(type="text", text="Server stats: " + serialize(stats, separators=(",", ":")))]
+
+@tools.tool(
+    "Apply_Batch", Apply_Batch,
+    "Apply an ordered list of mutations (Add_Floor, Add_Room, Remove_Room, Add_Door, Remove_Door, Update_Lights, Update_Windows, Add_Connector, Remove_Connector) to a building all-or-nothing, with one result per operation",
+    prompt="Apply several mutations to a building at once",
+    writes=True,
+)
+def apply_batch(args: Apply_Batch) -> list[TextContent]:
+    results = [None] * len(args.operations)
+    operations = []  # (result index, tool name, validated arguments)
+    for index, operation in enumerate(args.operations):
+        try:
+            spec = tools.get(operation.tool) if operation.tool in tools else None
+            if spec is None or not spec.batchable:
+                raise ValueError(f"Unknown mutation tool {operation.tool}")
+            op_args = spec.model(**{**operation.arguments, "building_name": args.building_name})
+            operations.append((index, operation.tool, op_args.model_dump()))
+        except Exception as e:
+            results[index] = {"tool": operation.tool, "status": "error", "message": str(e)}
+    # An invalid operation rejects the batch, the others are still checked and reported
+    errors = store.mutate_batch(
+        args.building_name,
+        [(tool, op_args) for _, tool, op_args in operations],
+        dry_run=len(operations) < len(results)
+    )
+    for (index, tool, _), error in zip(operations, errors):
+        if error is None:
+            results[index] = {"tool": tool, "status": "ok"}
+        else:
+            results[index] = {"tool": tool, "status": "error", "message": str(error)}
+    failed = sum(result["status"] == "error" for result in results)
+    if failed:
+        message = f"Batch not applied, {failed} of {len(results)} operations failed: "
+    else:
+        message = f"Batch applied successfully: "
+    return [TextContent(type="text", text=message + serialize(results))]
 
 async def serve():
     options = server.create_initialization_options()
-    async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
-        await server.run(read_stream, write_stream, options, raise_exceptions=True)
+    try:
+        async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
+            await server.run(read_stream, write_stream, options, raise_exceptions=True)
+    finally:
+        # Leave compact floor files behind instead of a journal to replay
+        store.flush_all()
+        metrics.dump()
@@ -0,0 +1,384 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+from .graph import CONNECTOR_TYPES, _csr, bfs_path, bidirectional_bfs
+from .stats import FloorStats, building_stats
+
+if TYPE_CHECKING:
+    from .building import Building, Floor, Room
+
+SNAPSHOT_FILENAME = "building.snapshot"
+SNAPSHOT_MAGIC = b"BLDSNAP\0"
+SNAPSHOT_VERSION = 1
+
+# Sections of a snapshot, in file order, with the array typecode of their items
+SECTIONS = (
+    ("meta", "B"),  # JSON object: building_name, floor journal_seq, load_token, topology_version, sources
+    ("string_offsets", "I"),  # string i is string_bytes[string_offsets[i]:string_offsets[i + 1]]
+    ("string_bytes", "B"),  # UTF-8 room names, room ids come first, then names of unknown rooms
+    ("name_order", "i"),  # room ids sorted by name bytes, for lookups by binary search
+    ("floor_offsets", "i"),  # rooms of floor f are the ids floor_offsets[f - 1]:floor_offsets[f]
+    ("room_records", "i"),  # fixed-width records (windows, lights) per room id
+    ("door_offsets", "i"),
+    ("door_targets", "i"),  # string ids
+    ("adjacency_offsets", "i"),
+    ("adjacency_targets", "i"),  # string ids
+    ("connector_offsets", "i"),
+    ("connector_targets", "i"),  # string ids
+    ("connector_kinds", "b"),  # index in CONNECTOR_TYPES
+    ("link_offsets", "i"),
+    ("link_targets", "i"),  # room ids reached through doors and connectors, used by searches
+    ("reverse_link_offsets", "i"),
+    ("reverse_link_targets", "i"),
+)
+# magic, version, number of strings, number of rooms, number of floors, then (offset, byte length) per section
+HEADER = struct.Struct(f"<8sIIII{2 * len(SECTIONS)}Q")
+ALIGNMENT = 8  # sections start on 8 byte boundaries, arrays are little-endian
+
+
+def write_snapshot(building: 'Building', path: str, sources: Optional[Dict[str, List[int]]] = None) -> None:
+    """
+    Write a building as a binary snapshot.
+    Rooms are numbered in floor order and every name is stored once in the string table,
+    doors and adjacent rooms are CSR arrays of string ids. The file is replaced atomically.
+    sources is the [mtime_ns, size] of each file the building was read from, by file name,
+    which tells whether the snapshot still matches them.
+    """
+    rooms = []
+    ids: Dict[str, int] = {}
+    floor_offsets = array('i', [0])
+    for floor in building.floors:
+        for room in floor.rooms:
+            # Room names are unique within a building, a repeated room keeps its first floor
+            if room.name not in ids:
+                ids[room.name] = len(rooms)
+                rooms.append(room)
+        floor_offsets.append(len(rooms))
+    num_rooms = len(rooms)
+    names = [room.name for room in rooms]
+
+    def string_id(name: str) -> int:
+        # Doors to rooms that do not exist are kept, their names go after the room names
+        string = ids.get(name)
+        if string is None:
+            string = ids[name] = len(names)
+            names.append(name)
+        return string
+
+    door_offsets, door_targets = _csr([string_id(name) for name in room.doors] for room in rooms)
+    adjacency_offsets, adjacency_targets = _csr([string_id(name) for name in room.adjacent_rooms] for room in rooms)
+    connector_offsets, connector_targets = _csr([string_id(name) for name in room.connectors] for room in rooms)
+    connector_kinds = array('b', (CONNECTOR_TYPES.index(kind) for room in rooms for kind in room.connectors.values()))
+    link_rows = [
+        [ids[name] for name in (*room.doors, *room.connectors) if ids[name] < num_rooms] for room in rooms
+    ]
+    link_offsets, link_targets = _csr(link_rows)
+    reverse_rows: List[List[int]] = [[] for _ in range(num_rooms)]
+    for room_id, row in enumerate(link_rows):
+        for other in row:
+            reverse_rows[other].append(room_id)
+    reverse_link_offsets, reverse_link_targets = _csr(reverse_rows)
+
+    encoded = [name.encode("utf-8") for name in names]
+    string_offsets = array('I', [0])
+    for data in encoded:
+        string_offsets.append(string_offsets[-1] + len(data))
+    name_order = array('i', sorted(range(num_rooms), key=encoded.__getitem__))
+    room_records = array('i')
+    for room in rooms:
+        room_records.extend((room.windows, room.lights))
+    meta = {
+        "building_name": building.name,
+        "journal_seq": [floor.journal_seq for floor in building.floors],
+        # Read cursors issued by the building stay valid on the snapshot
+        "load_token": building.load_token,
+        "topology_version": building.topology_version,
+        "sources": sources,
+    }
+
+    sections = {
+        "meta": json.dumps(meta).encode("utf-8"),
+        "string_offsets": string_offsets,
+        "string_bytes": b"".join(encoded),
+        "name_order": name_order,
+        "floor_offsets": floor_offsets,
+        "room_records": room_records,
+        "door_offsets": door_offsets,
+        "door_targets": door_targets,
+        "adjacency_offsets": adjacency_offsets,
+        "adjacency_targets": adjacency_targets,
+        "connector_offsets": connector_offsets,
+        "connector_targets": connector_targets,
+        "connector_kinds": connector_kinds,
+        "link_offsets": link_offsets,
+        "link_targets": link_targets,
+        "reverse_link_offsets": reverse_link_offsets,
+        "reverse_link_targets": reverse_link_targets,
+    }
+    directory_path, filename = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory_path or ".", prefix=f".{filename}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(b"\0" * HEADER.size)
+            layout = []
+            for name, _ in SECTIONS:
+                data = bytes(sections[name])
+                f.write(b"\0" * (-f.tell() % ALIGNMENT))
+                layout.extend((f.tell(), len(data)))
+                f.write(data)
+            f.seek(0)
+            f.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(names), num_rooms, len(building.floors), *layout))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class MappedSnapshot:
+    """
+    Read-only building backed by a memory-mapped snapshot.
+    Opening it only reads the header, the sections are used in place as typed memoryviews,
+    so path queries start right away and only touch the pages of the rooms they visit.
+    Room and Floor objects are created on demand, as detached views; read_rooms, stats and
+    find_path_names answer from the sections without creating any.
+    """
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise ValueError("Building snapshots can only be mapped on little-endian hosts")
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        fields = HEADER.unpack_from(self._view)
+        magic, version, self.num_strings, self.num_rooms, self.num_floors = fields[:5]
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} building snapshot")
+        layout = fields[5:]
+        for index, (name, typecode) in enumerate(SECTIONS):
+            offset, length = layout[2 * index], layout[2 * index + 1]
+            setattr(self, name, self._view[offset:offset + length].cast(typecode))
+        meta = json.loads(bytes(self.meta))
+        self.name = meta["building_name"]
+        self.journal_seq = meta["journal_seq"]
+        self.load_token = meta.get("load_token")
+        self.topology_version = meta.get("topology_version", 0)
+        self.sources = meta.get("sources")
+
+    def close(self) -> None:
+        """Release the sections and unmap the file"""
+        for name, _ in SECTIONS:
+            getattr(self, name).release()
+        self._view.release()
+        self._mmap.close()
+
+    def __enter__(self) -> 'MappedSnapshot':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.num_rooms
+
+    def name_of(self, string_id: int) -> str:
+        """Decode a room name from the string table"""
+        return str(self.string_bytes[self.string_offsets[string_id]:self.string_offsets[string_id + 1]], "utf-8")
+
+    def index_of(self, name: str) -> int:
+        """Get the id of a room by name"""
+        room_id = self._find(name)
+        if room_id is None:
+            raise ValueError(f"Room '{name}' not found")
+        return room_id
+
+    def _find(self, name: str) -> Optional[int]:
+        """Id of a room by name or None, with a binary search over the sorted names"""
+        target = name.encode("utf-8")
+        offsets, data, order = self.string_offsets, self.string_bytes, self.name_order
+        low, high = 0, self.num_rooms
+        while low < high:
+            middle = (low + high) // 2
+            room_id = order[middle]
+            if data[offsets[room_id]:offsets[room_id + 1]].tobytes() < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.num_rooms:
+            room_id = order[low]
+            if data[offsets[room_id]:offsets[room_id + 1]].tobytes() == target:
+                return room_id
+        return None
+
+    def _row(self, offsets: Sequence[int], targets: Sequence[int], room_id: int) -> Sequence[int]:
+        return targets[offsets[room_id]:offsets[room_id + 1]]
+
+    def links_of(self, room_id: int) -> Sequence[int]:
+        """Ids of the rooms room_id leads to, through its doors, stairs and elevators"""
+        return self._row(self.link_offsets, self.link_targets, room_id)
+
+    def links_into(self, room_id: int) -> Sequence[int]:
+        """Ids of the rooms leading to room_id"""
+        return self._row(self.reverse_link_offsets, self.reverse_link_targets, room_id)
+
+    def room(self, room_id: int) -> 'Room':
+        """Detached Room view of a room id"""
+        from .building import Room
+
+        start, end = self.connector_offsets[room_id], self.connector_offsets[room_id + 1]
+        return Room(
+            name=self.name_of(room_id),
+            doors=[self.name_of(other) for other in self._row(self.door_offsets, self.door_targets, room_id)],
+            windows=self.room_records[2 * room_id],
+            lights=self.room_records[2 * room_id + 1],
+            adjacent_rooms=[
+                self.name_of(other) for other in self._row(self.adjacency_offsets, self.adjacency_targets, room_id)
+            ],
+            connectors={
+                self.name_of(other): CONNECTOR_TYPES[kind]
+                for other, kind in zip(self.connector_targets[start:end], self.connector_kinds[start:end])
+            },
+        )
+
+    def floor(self, floor_number: int) -> 'Floor':
+        """Detached Floor view of a 1-based floor number"""
+        from .building import Floor
+
+        if not 1 <= floor_number <= self.num_floors:
+            raise ValueError(f"Floor {floor_number} does not exist")
+        start, end = self.floor_offsets[floor_number - 1], self.floor_offsets[floor_number]
+        return Floor([self.room(room_id) for room_id in range(start, end)])
+
+    def find_path(self, start: int, end: int, bidirectional: bool = False) -> Optional[List[int]]:
+        """Find a path of room ids from start to end, or None"""
+        if bidirectional:
+            return bidirectional_bfs(start, end, self.links_of, self.links_into)
+        return bfs_path(start, end, self.links_of)
+
+    def find_path_by_name(self, start_room_name: str, end_room_name: str,
+                          bidirectional: bool = False) -> Optional[List[str]]:
+        """Find a path between two rooms by name, returns the room names or None"""
+        path = self.find_path(self.index_of(start_room_name), self.index_of(end_room_name), bidirectional)
+        if path is None:
+            return None
+        return [self.name_of(room_id) for room_id in path]
+
+    def find_path_names(self, start_room_name: str, end_room_name: str,
+                        bidirectional: bool = False) -> Optional[List[str]]:
+        """Building.find_path_names on the snapshot: the room names of a path, or None"""
+        start = self._find(start_room_name)
+        if start is None:
+            raise ValueError(f"Start room '{start_room_name}' not found")
+        end = self._find(end_room_name)
+        if end is None:
+            raise ValueError(f"End room '{end_room_name}' not found")
+        path = self.find_path(start, end, bidirectional)
+        if path is None:
+            return None
+        return [self.name_of(room_id) for room_id in path]
+
+    def room_dict(self, room_id: int, fields: Sequence[str]) -> dict:
+        """Room.to_dict of a room id, read from the sections"""
+        room_dict = {"name": self.name_of(room_id)}
+        for field_name in fields:
+            if field_name == "windows":
+                room_dict["windows"] = self.room_records[2 * room_id]
+            elif field_name == "lights":
+                room_dict["lights"] = self.room_records[2 * room_id + 1]
+            elif field_name == "doors":
+                room_dict["doors"] = [
+                    self.name_of(other) for other in self._row(self.door_offsets, self.door_targets, room_id)
+                ]
+            elif field_name == "adjacent_rooms":
+                room_dict["adjacent_rooms"] = [
+                    self.name_of(other) for other in self._row(self.adjacency_offsets, self.adjacency_targets, room_id)
+                ]
+            elif field_name == "connectors":
+                start, end = self.connector_offsets[room_id], self.connector_offsets[room_id + 1]
+                if start < end:
+                    room_dict["connectors"] = {
+                        self.name_of(other): CONNECTOR_TYPES[kind]
+                        for other, kind in zip(self.connector_targets[start:end], self.connector_kinds[start:end])
+                    }
+        return room_dict
+
+    def read_rooms(self, floor_numbers: Optional[List[int]] = None, fields: Optional[List[str]] = None,
+                   cursor: Optional[str] = None, limit: int = 200) -> dict:
+        """Building.read_rooms on the snapshot, cursors of the building it was written from stay valid"""
+        from .building import read_room_page
+
+        floor_offsets = self.floor_offsets
+        return read_room_page(
+            self.name, [floor_offsets[f + 1] - floor_offsets[f] for f in range(self.num_floors)],
+            lambda floor_number, start, stop, fields: [
+                self.room_dict(room_id, fields)
+                for room_id in range(floor_offsets[floor_number - 1] + start, floor_offsets[floor_number - 1] + stop)
+            ],
+            f"{self.load_token}:{self.topology_version}", floor_numbers, fields, cursor, limit,
+        )
+
+    def floor_stats(self, floor_number: int) -> FloorStats:
+        """Totals of a 1-based floor number, from the offsets and room records of its rooms"""
+        start, end = self.floor_offsets[floor_number - 1], self.floor_offsets[floor_number]
+        stats = FloorStats()
+        stats.rooms = end - start
+        stats.windows = sum(self.room_records[2 * start:2 * end:2])
+        stats.lights = sum(self.room_records[2 * start + 1:2 * end:2])
+        stats.doors = self.door_offsets[end] - self.door_offsets[start]
+        stats.adjacent_rooms = self.adjacency_offsets[end] - self.adjacency_offsets[start]
+        stats.connectors = self.connector_offsets[end] - self.connector_offsets[start]
+        return stats
+
+    def stats(self, floor_numbers: Optional[List[int]] = None) -> dict:
+        """Building.stats on the snapshot"""
+        return building_stats(
+            self.name, [self.floor_stats(floor_number) for floor_number in range(1, self.num_floors + 1)], floor_numbers
+        )
+
+    def to_building(self) -> 'Building':
+        """Create the Room and Floor objects of the whole building"""
+        from .building import Building, Floor, Room
+
+        data = self.string_bytes.tobytes()
+        offsets = self.string_offsets.tolist()
+        names = [sys.intern(data[offsets[i]:offsets[i + 1]].decode("utf-8")) for i in range(self.num_strings)]
+        records = self.room_records.tolist()
+        door_offsets, door_targets = self.door_offsets.tolist(), self.door_targets.tolist()
+        adjacency_offsets, adjacency_targets = self.adjacency_offsets.tolist(), self.adjacency_targets.tolist()
+        connector_offsets = self.connector_offsets.tolist()
+        rooms = []
+        for room_id in range(self.num_rooms):
+            connectors = {}
+            for index in range(connector_offsets[room_id], connector_offsets[room_id + 1]):
+                connectors[names[self.connector_targets[index]]] = CONNECTOR_TYPES[self.connector_kinds[index]]
+            rooms.append(Room(
+                name=names[room_id],
+                doors=[names[other] for other in door_targets[door_offsets[room_id]:door_offsets[room_id + 1]]],
+                windows=records[2 * room_id],
+                lights=records[2 * room_id + 1],
+                adjacent_rooms=[
+                    names[other] for other in adjacency_targets[adjacency_offsets[room_id]:adjacency_offsets[room_id + 1]]
+                ],
+                connectors=connectors,
+            ))
+        floors = []
+        for floor_number in range(1, self.num_floors + 1):
+            floor = Floor(rooms[self.floor_offsets[floor_number - 1]:self.floor_offsets[floor_number]])
+            floor.journal_seq = self.journal_seq[floor_number - 1]
+            floors.append(floor)
+        return Building(floors, self.name)
+
+
+def load_snapshot(path: str) -> 'Building':
+    """Load a whole building from a snapshot file"""
+    with MappedSnapshot(path) as snapshot:
+        return snapshot.to_building()
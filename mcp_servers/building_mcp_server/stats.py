@@ -0,0 +1,86 @@
+from operator import attrgetter
+from typing import TYPE_CHECKING, Iterable, List, Optional
+
+if TYPE_CHECKING:
+    from .building import Room
+
+# Aggregates kept for every floor
+STAT_FIELDS = ("rooms", "lights", "windows", "doors", "adjacent_rooms", "connectors")
+
+
+class FloorStats:
+    """
+    Running totals of a floor, updated by every room, door, light and window change so that
+    statistics are read without walking the rooms.
+    doors and connectors count the ends held by the rooms of the floor: a door between two
+    rooms of the floor counts twice, as each room lists it.
+    """
+
+    __slots__ = STAT_FIELDS
+
+    def __init__(self):
+        for name in STAT_FIELDS:
+            setattr(self, name, 0)
+
+    @classmethod
+    def from_rooms(cls, rooms: List['Room']) -> 'FloorStats':
+        """Compute the totals of a list of rooms"""
+        stats = cls()
+        stats.rooms = len(rooms)
+        stats.lights = sum(map(attrgetter("lights"), rooms))
+        stats.windows = sum(map(attrgetter("windows"), rooms))
+        stats.doors = sum(map(len, map(attrgetter("doors"), rooms)))
+        stats.adjacent_rooms = sum(map(len, map(attrgetter("adjacent_rooms"), rooms)))
+        stats.connectors = sum(map(len, map(attrgetter("connectors"), rooms)))
+        return stats
+
+    def copy(self) -> 'FloorStats':
+        stats = FloorStats()
+        for name in STAT_FIELDS:
+            setattr(stats, name, getattr(self, name))
+        return stats
+
+    def add_room(self, room: 'Room', sign: int = 1) -> None:
+        """Count a room in the totals, or take it out with sign -1"""
+        self.rooms += sign
+        self.lights += sign * room.lights
+        self.windows += sign * room.windows
+        self.doors += sign * len(room.doors)
+        self.adjacent_rooms += sign * len(room.adjacent_rooms)
+        self.connectors += sign * len(room.connectors)
+
+    def as_dict(self) -> dict:
+        """Totals with the average number of doors per room"""
+        stats = {name: getattr(self, name) for name in STAT_FIELDS}
+        stats["average_degree"] = round(self.doors / self.rooms, 3) if self.rooms else 0.0
+        return stats
+
+
+def total_stats(floor_stats: Iterable[FloorStats]) -> dict:
+    """Totals of several floors, with doors and connectors counted once rather than per end"""
+    total = FloorStats()
+    for stats in floor_stats:
+        for name in STAT_FIELDS:
+            setattr(total, name, getattr(total, name) + getattr(stats, name))
+    result = total.as_dict()
+    result["doors"] = total.doors // 2
+    result["connectors"] = total.connectors // 2
+    return result
+
+
+def building_stats(building_name: str, floor_stats: List[FloorStats], floor_numbers: Optional[List[int]] = None) -> dict:
+    """
+    Totals of a building whose floors have the given statistics, with the statistics of the
+    given floors (all floors by default).
+    """
+    if floor_numbers is None:
+        floor_numbers = list(range(1, len(floor_stats) + 1))
+    floors = []
+    for floor_number in sorted(set(floor_numbers)):
+        if not 1 <= floor_number <= len(floor_stats):
+            raise ValueError(f"Floor {floor_number} does not exist")
+        floors.append({"floor": floor_number, **floor_stats[floor_number - 1].as_dict()})
+    stats = {"building_name": building_name, "num_floors": len(floor_stats)}
+    stats.update(total_stats(floor_stats))
+    stats["floors"] = floors
+    return stats
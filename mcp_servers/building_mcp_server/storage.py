@@ -0,0 +1,228 @@
+import os
+from abc import ABC, abstractmethod
+from contextlib import closing
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from .building import Building, Floor, Room, get_building_dir, load_building_from_directory
+
+# sqlite3 is only imported when the SQLite backend is used
+if TYPE_CHECKING:
+    import sqlite3
+
+DATABASE_FILENAME = "building.db"
+
+
+class StorageBackend(ABC):
+    """
+    Where the buildings are persisted.
+    A backend loads a whole building and saves the changes made to it since it was loaded
+    or last saved, the Room and Floor objects track what changed.
+    """
+
+    # True when save() makes every commit durable on its own, the store then needs no journal
+    transactional = False
+
+    @abstractmethod
+    def load(self, building_name: str) -> Building:
+        """Load a building by name"""
+
+    @abstractmethod
+    def save(self, building: Building, directory_path: str) -> None:
+        """Persist the changes made to a building into its directory"""
+
+
+class JsonStorage(StorageBackend):
+    """The floor_N.json files, the changed floors are rewritten by each save"""
+
+    def load(self, building_name: str) -> Building:
+        return load_building_from_directory(building_name)
+
+    def save(self, building: Building, directory_path: str) -> None:
+        building.to_json(building.name, directory_path)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS floors (number INTEGER PRIMARY KEY, journal_seq INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS rooms (
+    name TEXT PRIMARY KEY,
+    floor INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    windows INTEGER NOT NULL,
+    lights INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rooms_by_floor ON rooms (floor, position);
+CREATE TABLE IF NOT EXISTS doors (room TEXT NOT NULL, position INTEGER NOT NULL, target TEXT NOT NULL,
+                                  PRIMARY KEY (room, position));
+CREATE INDEX IF NOT EXISTS doors_by_target ON doors (target);
+CREATE TABLE IF NOT EXISTS adjacency (room TEXT NOT NULL, position INTEGER NOT NULL, target TEXT NOT NULL,
+                                      PRIMARY KEY (room, position));
+CREATE INDEX IF NOT EXISTS adjacency_by_target ON adjacency (target);
+CREATE TABLE IF NOT EXISTS connectors (room TEXT NOT NULL, target TEXT NOT NULL, kind TEXT NOT NULL,
+                                       PRIMARY KEY (room, target));
+"""
+
+# Tables holding one row per link of a room, with the Room attribute they come from
+LINK_TABLES = (("doors", "doors"), ("adjacency", "adjacent_rooms"))
+
+
+class SqliteStorage(StorageBackend):
+    """
+    One SQLite database per building, building.db in the building directory.
+    Rooms, doors, adjacent rooms and connectors are rows indexed by room name and floor, and
+    a save only touches the rows of the rooms changed since the last one, in one transaction:
+    a light or window update is a single-row UPDATE. The database runs in WAL mode, so other
+    processes can read it while the server writes.
+    A building directory without a database is loaded from its JSON files and written to
+    the database in full by the first save.
+    """
+
+    transactional = True
+
+    def _connect(self, path: str) -> 'sqlite3.Connection':
+        import sqlite3
+        connection = sqlite3.connect(path, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        return connection
+
+    def load(self, building_name: str) -> Building:
+        directory_path = os.path.join(get_building_dir(), building_name)
+        path = os.path.join(directory_path, DATABASE_FILENAME)
+        if not os.path.exists(path):
+            return load_building_from_directory(building_name)
+
+        with closing(self._connect(path)) as connection:
+            links: Dict[str, Dict[str, List[str]]] = {}
+            for table, _ in LINK_TABLES:
+                rows = links[table] = {}
+                for room_name, target in connection.execute(f"SELECT room, target FROM {table} ORDER BY room, position"):
+                    rows.setdefault(room_name, []).append(target)
+            connectors: Dict[str, Dict[str, str]] = {}
+            for room_name, target, kind in connection.execute("SELECT room, target, kind FROM connectors"):
+                connectors.setdefault(room_name, {})[target] = kind
+            floor_rooms: Dict[int, List[Room]] = {}
+            for name, floor_number, windows, lights in connection.execute(
+                    "SELECT name, floor, windows, lights FROM rooms ORDER BY floor, position"):
+                floor_rooms.setdefault(floor_number, []).append(Room(
+                    name=name,
+                    doors=links["doors"].get(name, ()),
+                    windows=windows,
+                    lights=lights,
+                    adjacent_rooms=links["adjacency"].get(name, ()),
+                    connectors=connectors.get(name, {}),
+                ))
+            floors = []
+            for floor_number, journal_seq in connection.execute("SELECT number, journal_seq FROM floors ORDER BY number"):
+                floor = Floor(floor_rooms.get(floor_number, []))
+                floor.journal_seq = journal_seq
+                floors.append(floor)
+
+        building = Building(floors, building_name)
+        building.mark_clean(path)
+        # Mutations journaled by the JSON storage before the switch; replay skips what the rows already hold
+        from .journal import replay_journal
+        replay_journal(building, directory_path)
+        building.drop_dangling_connectors()
+        return building
+
+    def save(self, building: Building, directory_path: str) -> None:
+        path = os.path.join(directory_path, DATABASE_FILENAME)
+        incremental = (
+            building._saved_path == os.path.abspath(path)
+            and building._saved_num_floors == len(building.floors)
+            and all(floor.changed_rooms is not None for floor in building.floors)
+        )
+        os.makedirs(directory_path, exist_ok=True)
+        with closing(self._connect(path)) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if incremental:
+                    self._save_changes(connection, building)
+                else:
+                    self._save_all(connection, building)
+                connection.execute("INSERT OR REPLACE INTO metadata VALUES ('building_name', ?)", (building.name,))
+                connection.execute("DELETE FROM floors WHERE number > ?", (len(building.floors),))
+                connection.executemany(
+                    "INSERT OR REPLACE INTO floors VALUES (?, ?)",
+                    [(number, floor.journal_seq) for number, floor in enumerate(building.floors, 1)],
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        building.mark_clean(path)
+
+    def _save_all(self, connection: 'sqlite3.Connection', building: Building) -> None:
+        """Replace every row with the content of the building"""
+        for table in ("rooms", "doors", "adjacency", "connectors"):
+            connection.execute(f"DELETE FROM {table}")
+        for floor_number, floor in enumerate(building.floors, 1):
+            rooms = floor.rooms
+            connection.executemany(
+                "INSERT OR REPLACE INTO rooms VALUES (?, ?, ?, ?, ?)",
+                [(room.name, floor_number, position, room.windows, room.lights) for position, room in enumerate(rooms)],
+            )
+            for room in rooms:
+                self._insert_links(connection, room)
+
+    def _save_changes(self, connection: 'sqlite3.Connection', building: Building) -> None:
+        """Write the rows of the rooms changed since the last save"""
+        # Removed rooms first, a room of the same name may have been added to another floor
+        for floor_number, floor in enumerate(building.floors, 1):
+            for name in floor.changed_rooms:
+                if floor.get_room_by_name(name) is None:
+                    if connection.execute("DELETE FROM rooms WHERE name = ? AND floor = ?",
+                                          (name, floor_number)).rowcount:
+                        self._delete_links(connection, name)
+
+        for floor_number, floor in enumerate(building.floors, 1):
+            for name, topology in floor.changed_rooms.items():
+                room = floor.get_room_by_name(name)
+                if room is None:
+                    continue
+                updated = connection.execute(
+                    "UPDATE rooms SET windows = ?, lights = ? WHERE name = ? AND floor = ?",
+                    (room.windows, room.lights, name, floor_number),
+                ).rowcount
+                if not updated:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO rooms SELECT ?, ?, COALESCE(MAX(position), -1) + 1, ?, ? "
+                        "FROM rooms WHERE floor = ?",
+                        (name, floor_number, room.windows, room.lights, floor_number),
+                    )
+                if topology or not updated:
+                    self._delete_links(connection, name)
+                    self._insert_links(connection, room)
+
+    def _delete_links(self, connection: 'sqlite3.Connection', room_name: str) -> None:
+        for table in ("doors", "adjacency", "connectors"):
+            connection.execute(f"DELETE FROM {table} WHERE room = ?", (room_name,))
+
+    def _insert_links(self, connection: 'sqlite3.Connection', room: Room) -> None:
+        for table, attribute in LINK_TABLES:
+            connection.executemany(
+                f"INSERT INTO {table} VALUES (?, ?, ?)",
+                [(room.name, position, target) for position, target in enumerate(getattr(room, attribute))],
+            )
+        connection.executemany(
+            "INSERT INTO connectors VALUES (?, ?, ?)",
+            [(room.name, target, kind) for target, kind in room.connectors.items()],
+        )
+
+
+# BUILDING_STORAGE values
+STORAGE_BACKENDS = {
+    "json": JsonStorage,
+    "sqlite": SqliteStorage,
+}
+
+
+def get_storage(name: Optional[str] = None) -> StorageBackend:
+    """Create the storage backend named by name, or by the BUILDING_STORAGE environment variable"""
+    if name is None:
+        name = os.getenv("BUILDING_STORAGE", "json")
+    backend = STORAGE_BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(f"Unknown storage backend {name}, expected one of {', '.join(STORAGE_BACKENDS)}")
+    return backend()
@@ -0,0 +1,641 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from .building import Building, get_building_dir
+from .journal import JOURNAL_FILENAME, Journal, record_floors
+from .metrics import metrics
+from .operations import apply_mutation
+from .snapshot import SNAPSHOT_FILENAME, MappedSnapshot, write_snapshot
+from .storage import DATABASE_FILENAME, StorageBackend, get_storage
+
+logger = logging.getLogger(__name__)
+
+# Number of journal records after which the journal is folded into the floor files
+COMPACT_THRESHOLD = 256
+
+# Seconds a write waits for more writes to the same building, when others are in flight, to commit them together
+GROUP_COMMIT_WINDOW = 0.002
+
+# Write building.snapshot next to the floor files, to serve read-only queries on buildings that are not resident.
+# Off by default, the store then adds no file to the building directories
+SNAPSHOTS = os.getenv("BUILDING_SNAPSHOTS", "0") == "1"
+
+# Memory the resident buildings may take before the least recently used are evicted, 0 for no limit
+MEMORY_BUDGET = int(float(os.getenv("BUILDING_MEMORY_BUDGET_MB", "1024")) * 1024 * 1024)
+
+# Bytes held by a parsed building per floor, per room and per door, adjacency or connector
+# end, fitted with tracemalloc on generated buildings of 200 to 60000 rooms (within ~15%
+# from 4000 rooms up), the floor and path indexes included
+FLOOR_BYTES = 2048
+ROOM_BYTES = 800
+LINK_BYTES = 16
+
+
+@dataclass
+class FileState:
+    """Fingerprint of a single building file"""
+    mtime_ns: int
+    size: int
+    digest: Optional[str] = None  # None means the content has not been hashed yet
+
+
+def _is_building_file(filename: str) -> bool:
+    """Return True for the files that make up a building on disk"""
+    return filename in ("building_metadata.json", JOURNAL_FILENAME, SNAPSHOT_FILENAME, DATABASE_FILENAME) or (
+        filename.startswith("floor_") and filename.endswith(".json")
+    )
+
+
+def _file_digest(path: str) -> str:
+    """Hash the content of a file"""
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def estimate_footprint(building: Building) -> int:
+    """
+    Estimated bytes held in memory by a parsed building, from the running floor statistics.
+    Only the published version is counted: a replaced one is freed once the queries holding it end.
+    """
+    footprint = 0
+    for floor in building.floors:
+        stats = floor.stats
+        links = stats.doors + stats.adjacent_rooms + stats.connectors
+        footprint += FLOOR_BYTES + stats.rooms * ROOM_BYTES + links * LINK_BYTES
+    return footprint
+
+
+def _scan_directory(directory_path: str) -> Dict[str, Tuple[int, int]]:
+    """Stat every building file in a directory, returns filename -> (mtime_ns, size)"""
+    stats = {}
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            if entry.is_file() and _is_building_file(entry.name):
+                st = entry.stat()
+                stats[entry.name] = (st.st_mtime_ns, st.st_size)
+    return stats
+
+
+class WriterLock:
+    """
+    Exclusive lock of the writes of the store to a building. Queries never take it: they share
+    the published version, which writes replace rather than change.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._writing = False
+
+    @property
+    def writing(self) -> bool:
+        return self._writing
+
+    def try_acquire(self) -> bool:
+        """Take the lock if nobody holds it, without blocking"""
+        if not self._lock.acquire(blocking=False):
+            return False
+        self._writing = True
+        return True
+
+    def release(self) -> None:
+        self._writing = False
+        self._lock.release()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        self._lock.acquire()
+        self._writing = True
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class StoreEntry:
+    def __init__(self, building: Building, journal: Journal, files: Dict[str, FileState]):
+        self.building = building
+        self.journal = journal
+        self.files = files
+        self.compacting = False
+        self.footprint = estimate_footprint(building)
+        self.snapshot_sources: Optional[dict] = None  # sources of the snapshot on disk, when known to match it
+
+    @property
+    def dirty(self) -> bool:
+        """True when the building holds changes that are not in its floor files yet"""
+        return self.journal.pending > 0 or any(floor.dirty for floor in self.building.floors)
+
+
+class PendingWrite:
+    """A mutation batch waiting for its group commit"""
+
+    def __init__(self, operations: List[Tuple[str, dict]], dry_run: bool):
+        self.operations = operations
+        self.dry_run = dry_run
+        self.errors: List[Optional[Exception]] = []  # error of each operation, or None
+        self.exception: Optional[Exception] = None  # set when the group could not be committed
+        self.done = False
+
+
+class BuildingSlot:
+    """Locks and resident entry of one building directory"""
+
+    def __init__(self):
+        self.lock = WriterLock()  # held by mutations, compaction, saves and eviction
+        # Serializes the freshness check, reloads, and the file writes of the store with them
+        self.load_lock = threading.Lock()
+        self.entry: Optional[StoreEntry] = None
+        self.commit_condition = threading.Condition()  # guards commit_queue, committing and writers
+        self.commit_queue: List[PendingWrite] = []
+        self.committing = False
+        self.writers = 0  # writes between their arrival and their return
+        # Snapshot serving mapped reads while the building is not resident, with the (mtime_ns, size) it was opened at.
+        # It is never closed: it is unmapped once the last query holding it drops it
+        self.mapped: Optional[MappedSnapshot] = None
+        self.mapped_state: Optional[Tuple[int, int]] = None
+
+    def drop(self) -> None:
+        if self.entry is not None:
+            self.entry.journal.close()
+            self.entry = None
+
+
+class BuildingStore:
+    """
+    Keeps parsed buildings resident in memory.
+    Every access checks the building files on disk (mtime and size first, content hash
+    only when those differ) and re-parses the building only when something actually changed.
+    Mutations are applied in memory and appended to the building journal; the journal is
+    folded into the floor files in the background once it holds compact_threshold records.
+    Mutations of a building are serialized and group-committed. A group is applied to a new
+    version of the building, forked from the published one and sharing its unchanged floors
+    and rooms, and that version is published once persisted. A query holds the version
+    published when it started: it takes no lock, never waits for a mutation and never sees
+    one half applied.
+    With a transactional storage backend the journal is skipped: each group is saved
+    directly, as one transaction touching only the changed rows.
+    Once the estimated footprint of the resident buildings exceeds memory_budget bytes, the
+    least recently used ones are evicted, clean ones first; a building with changes still
+    in its journal is flushed to its floor files before it is evicted.
+    With snapshots, each compaction and save of a building stored as JSON also writes its
+    binary snapshot, and the queries that can run on a MappedSnapshot are served
+    from it while the building is not resident and the snapshot matches its files.
+    """
+
+    def __init__(self, compact_threshold: int = COMPACT_THRESHOLD,
+                 group_commit_window: float = GROUP_COMMIT_WINDOW,
+                 storage: Optional[StorageBackend] = None, memory_budget: int = MEMORY_BUDGET,
+                 snapshots: bool = SNAPSHOTS):
+        self.storage = storage if storage is not None else get_storage()
+        self.compact_threshold = compact_threshold
+        self.group_commit_window = group_commit_window
+        self.memory_budget = memory_budget
+        self.snapshots = snapshots and not self.storage.transactional
+        self._slots: Dict[str, BuildingSlot] = OrderedDict()  # least recently used first
+        self._lock = threading.Lock()  # guards _slots and the counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.eviction_flushes = 0
+        self.mapped_reads = 0
+
+    def _directory_path(self, building_name: str) -> str:
+        return os.path.abspath(os.path.join(get_building_dir(), building_name))
+
+    def _slot(self, directory_path: str) -> BuildingSlot:
+        with self._lock:
+            slot = self._slots.get(directory_path)
+            if slot is None:
+                slot = self._slots[directory_path] = BuildingSlot()
+            return slot
+
+    @contextmanager
+    def read(self, building_name: str, mapped: bool = False) -> Iterator[Union[Building, MappedSnapshot]]:
+        """
+        Hold the published version of a building for a query. The version is never modified:
+        mutations committed meanwhile publish new versions, seen by the next queries.
+        With mapped, a building that is not resident is served from its snapshot when it still
+        matches the files, without loading it: the query then gets a MappedSnapshot, which
+        only answers read_rooms, stats and find_path_names.
+        """
+        directory_path = self._directory_path(building_name)
+        slot = self._slot(directory_path)
+        entry = slot.entry
+        if mapped and entry is None and self.snapshots:
+            snapshot = self._mapped_snapshot(slot, directory_path)
+            if snapshot is not None:
+                yield snapshot
+                return
+        if entry is not None and slot.lock.writing:
+            # The files are being written by the store itself, the published version is current
+            self._touch(directory_path, hit=True)
+        else:
+            entry = self._get_entry(slot, building_name, directory_path)
+        yield entry.building
+
+    def get(self, building_name: str) -> Building:
+        """Get a building, loading it from disk if it is not resident or changed on disk"""
+        with self.read(building_name) as building:
+            return building
+
+    def _get_entry(self, slot: BuildingSlot, building_name: str, directory_path: str) -> StoreEntry:
+        with metrics.phase("load"), slot.load_lock:
+            entry = slot.entry
+            stats = _scan_directory(directory_path)
+            if entry is not None and self._is_unchanged(directory_path, entry, stats):
+                self._touch(directory_path, hit=True)
+                return entry
+
+            self._touch(directory_path, hit=False)
+            slot.drop()
+            building = self.storage.load(building_name)
+            journal = Journal(directory_path)
+            files = {
+                filename: FileState(mtime_ns, size, _file_digest(os.path.join(directory_path, filename)))
+                for filename, (mtime_ns, size) in _scan_directory(directory_path).items()
+            }
+            slot.entry = StoreEntry(building, journal, files)
+            snapshot_state = files.get(SNAPSHOT_FILENAME)
+            if slot.mapped is not None and snapshot_state is not None and \
+                    slot.mapped_state == (snapshot_state.mtime_ns, snapshot_state.size):
+                # No need to write the snapshot again while it matches the files
+                slot.entry.snapshot_sources = slot.mapped.sources
+            slot.mapped = slot.mapped_state = None
+            self._enforce_budget(keep=slot)
+            return slot.entry
+
+    def _mapped_snapshot(self, slot: BuildingSlot, directory_path: str) -> Optional[MappedSnapshot]:
+        """The snapshot of a building that is not resident, None unless it matches the other building files"""
+        with slot.load_lock:
+            if slot.entry is not None:
+                return None
+            try:
+                stats = _scan_directory(directory_path)
+            except FileNotFoundError:
+                return None
+            snapshot_state = stats.pop(SNAPSHOT_FILENAME, None)
+            if snapshot_state is None or JOURNAL_FILENAME in stats:
+                return None
+            if slot.mapped is None or slot.mapped_state != snapshot_state:
+                try:
+                    slot.mapped = MappedSnapshot(os.path.join(directory_path, SNAPSHOT_FILENAME))
+                except (OSError, ValueError):
+                    slot.mapped = slot.mapped_state = None
+                    return None
+                slot.mapped_state = snapshot_state
+            snapshot = slot.mapped
+        if snapshot.sources != {filename: list(state) for filename, state in stats.items()}:
+            return None
+        with self._lock:
+            self.mapped_reads += 1
+        return snapshot
+
+    def _touch(self, directory_path: str, hit: bool) -> None:
+        with self._lock:
+            self._slots.move_to_end(directory_path)
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _enforce_budget(self, keep: BuildingSlot) -> None:
+        """
+        Evict resident buildings until their footprint fits in the budget, keeping keep.
+        Buildings in use are skipped rather than waited for.
+        """
+        if self.memory_budget <= 0:
+            return
+        with self._lock:
+            slots = list(self._slots.items())
+        resident = 0
+        candidates = []  # (dirty, directory path, slot), least recently used first
+        for directory_path, slot in slots:
+            entry = slot.entry
+            if entry is not None:
+                resident += entry.footprint
+                if slot is not keep:
+                    candidates.append((entry.dirty, directory_path, slot))
+        if resident <= self.memory_budget:
+            return
+        # Clean buildings first, the sort is stable so each group stays in LRU order
+        candidates.sort(key=lambda candidate: candidate[0])
+        for _, directory_path, slot in candidates:
+            if resident <= self.memory_budget:
+                break
+            if not slot.lock.try_acquire():
+                continue
+            # Never wait for the load lock, the caller may hold the one of another building
+            if not slot.load_lock.acquire(blocking=False):
+                slot.lock.release()
+                continue
+            try:
+                entry = slot.entry
+                if entry is None:
+                    continue
+                flushed = entry.dirty
+                if flushed:
+                    try:
+                        self._compact(entry, directory_path)
+                    except Exception:
+                        # The journal still holds the changes, keep the building resident
+                        logger.exception(f"Could not flush {directory_path} before evicting it")
+                        continue
+                slot.drop()
+                resident -= entry.footprint
+                with self._lock:
+                    self.evictions += 1
+                    self.eviction_flushes += flushed
+            finally:
+                slot.load_lock.release()
+                slot.lock.release()
+
+    def cache_stats(self) -> dict:
+        """Hit, miss and eviction counters with the resident buildings, most recently used first"""
+        with self._lock:
+            slots = list(self._slots.items())
+            stats = {
+                "memory_budget_bytes": self.memory_budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "eviction_flushes": self.eviction_flushes,
+                "mapped_reads": self.mapped_reads,
+            }
+        buildings = []
+        for directory_path, slot in reversed(slots):
+            entry = slot.entry
+            if entry is not None:
+                buildings.append({"building": os.path.basename(directory_path),
+                                  "footprint_bytes": entry.footprint, "dirty": entry.dirty})
+        stats["resident_bytes"] = sum(building["footprint_bytes"] for building in buildings)
+        stats["resident_buildings"] = buildings
+        return stats
+
+    def _is_unchanged(self, directory_path: str, entry: StoreEntry, stats: Dict[str, Tuple[int, int]]) -> bool:
+        """Compare the directory with the fingerprint of the resident building"""
+        if stats.keys() != entry.files.keys():
+            return False
+        for filename, (mtime_ns, size) in stats.items():
+            state = entry.files[filename]
+            if state.mtime_ns == mtime_ns and state.size == size:
+                continue
+            # The file was touched, only a different content means a different building
+            if state.digest is None:
+                return False
+            digest = _file_digest(os.path.join(directory_path, filename))
+            if digest != state.digest:
+                return False
+            state.mtime_ns, state.size = mtime_ns, size
+        return True
+
+    def _trust_files(self, entry: StoreEntry, directory_path: str) -> None:
+        """Take the current files as our own writes, there is no need to read them back for hashing"""
+        entry.files = {
+            filename: FileState(mtime_ns, size)
+            for filename, (mtime_ns, size) in _scan_directory(directory_path).items()
+        }
+
+    def mutate(self, building_name: str, name: str, arguments: dict) -> None:
+        """
+        Apply a mutation tool to the resident building and journal it.
+        If the mutation fails, the published version is left as it was and the error is raised.
+        """
+        error = self.mutate_batch(building_name, [(name, arguments)])[0]
+        if error is not None:
+            raise error
+
+    def mutate_batch(self, building_name: str, operations: List[Tuple[str, dict]],
+                     dry_run: bool = False) -> List[Optional[Exception]]:
+        """
+        Apply several mutation tools all-or-nothing and journal them with a single write.
+        Every operation is attempted, even after a failure, and the error of each one (or None)
+        is returned. If any operation failed, or dry_run is set, none of them is kept.
+        Writes to the same building queued meanwhile are committed together, with one journal
+        write and fsync for the whole group. When other writes are in flight, the group is held
+        open group_commit_window seconds for the writes arriving right behind them; a write on
+        its own is committed at once.
+        """
+        directory_path = self._directory_path(building_name)
+        slot = self._slot(directory_path)
+        pending = PendingWrite(operations, dry_run)
+        with metrics.phase("wait"), slot.commit_condition:
+            slot.commit_queue.append(pending)
+            slot.writers += 1
+            # The first writer to find no commit in progress commits the queued group
+            while not pending.done and slot.committing:
+                slot.commit_condition.wait()
+            leader = not pending.done
+            if leader:
+                slot.committing = True
+                concurrent = slot.writers > 1
+
+        try:
+            if leader:
+                self._lead_commit(slot, building_name, directory_path, concurrent)
+        finally:
+            with slot.commit_condition:
+                slot.writers -= 1
+
+        if pending.exception is not None:
+            raise pending.exception
+        return pending.errors
+
+    def _lead_commit(self, slot: BuildingSlot, building_name: str, directory_path: str, concurrent: bool) -> None:
+        """Commit the queued writes as one group, then let the next writer lead"""
+        group: List[PendingWrite] = []
+        try:
+            if concurrent and self.group_commit_window > 0:
+                with metrics.phase("wait"):
+                    time.sleep(self.group_commit_window)
+            with slot.commit_condition:
+                group, slot.commit_queue = slot.commit_queue, []
+            self._commit_group(slot, building_name, directory_path, group)
+        except Exception as e:
+            for write in group:
+                write.exception = write.exception or e
+        finally:
+            with slot.commit_condition:
+                slot.committing = False
+                for write in group:
+                    write.done = True
+                slot.commit_condition.notify_all()
+        # The commit may have grown the building past the budget
+        self._enforce_budget(keep=slot)
+
+    def _commit_group(self, slot: BuildingSlot, building_name: str, directory_path: str,
+                      group: List[PendingWrite]) -> None:
+        """
+        Apply a group of writes in arrival order and journal the successful ones at once.
+        A failed write is rolled back on its own by forking the published version again and
+        applying again the writes of the group that already succeeded.
+        """
+        with slot.lock.write():
+            try:
+                entry = self._get_entry(slot, building_name, directory_path)
+            except Exception as e:
+                for write in group:
+                    write.exception = e
+                return
+
+            published = entry.building
+            building = published.fork()
+            records = []  # records of the successful writes of the group
+            committed = []
+            for write in group:
+                seq = building.journal_seq + len(records)
+                write_records = []
+                write.errors = []
+                for name, arguments in write.operations:
+                    args = {key: value for key, value in arguments.items() if key != "building_name"}
+                    try:
+                        floor_numbers = apply_mutation(building, name, args)
+                    except Exception as e:
+                        write.errors.append(e)
+                        continue
+                    write.errors.append(None)
+                    write_records.append({"seq": seq + len(write_records) + 1, "op": name, "floor": floor_numbers, "args": args})
+
+                if write.dry_run or any(error is not None for error in write.errors):
+                    # The published version is untouched, fork it again with the writes kept so far
+                    try:
+                        building = published.fork()
+                        for record in records:
+                            apply_mutation(building, record["op"], record["args"])
+                    except Exception as e:
+                        for other in committed:
+                            other.exception = e
+                        return
+                else:
+                    records.extend(write_records)
+                    committed.append(write)
+
+            if not records:
+                return
+            for record in records:
+                for floor_number in record_floors(record):
+                    building.writable_floor(floor_number).journal_seq = record["seq"]
+            building.journal_seq = records[-1]["seq"]
+            # Queries arriving meanwhile serve the published version without checking the files
+            with slot.load_lock:
+                try:
+                    with metrics.phase("persist"):
+                        if self.storage.transactional:
+                            self.storage.save(building, directory_path)
+                            entry.journal.clear()
+                        else:
+                            entry.journal.append(records)
+                except Exception as e:
+                    slot.drop()
+                    for write in committed:
+                        write.exception = e
+                    return
+
+                entry.building = building
+                entry.footprint = estimate_footprint(building)
+                if self.storage.transactional:
+                    self._trust_files(entry, directory_path)
+                    return
+                st = os.stat(entry.journal.path)
+                entry.files[JOURNAL_FILENAME] = FileState(st.st_mtime_ns, st.st_size)
+
+            if entry.journal.pending >= self.compact_threshold and not entry.compacting:
+                entry.compacting = True
+                threading.Thread(target=self._compact_in_background, args=(slot, directory_path), daemon=True).start()
+
+    def _compact_in_background(self, slot: BuildingSlot, directory_path: str) -> None:
+        try:
+            with slot.lock.write(), slot.load_lock:
+                if slot.entry is not None:
+                    self._compact(slot.entry, directory_path)
+        except Exception:
+            logger.exception(f"Journal compaction failed for {directory_path}")
+
+    def _compact(self, entry: StoreEntry, directory_path: str) -> None:
+        """
+        Write the floors changed by the journal, then delete the journal and write the
+        snapshot of the floors written. A clean building is left alone.
+        Called with the writer lock of the building and the load lock.
+        """
+        entry.compacting = False
+        building = entry.building
+        if entry.journal.pending == 0 and not any(floor.dirty for floor in building.floors):
+            return
+        self.storage.save(building, directory_path)
+        entry.journal.clear()
+        self._trust_files(entry, directory_path)
+        self._write_snapshot(entry, directory_path)
+
+    def _write_snapshot(self, entry: StoreEntry, directory_path: str) -> None:
+        """
+        Write the snapshot of a building matching its files, unless the one on disk already does.
+        Called with the writer lock of the building and the load lock.
+        """
+        if not self.snapshots or entry.dirty or JOURNAL_FILENAME in entry.files:
+            return
+        sources = {
+            filename: [state.mtime_ns, state.size]
+            for filename, state in entry.files.items() if filename != SNAPSHOT_FILENAME
+        }
+        if SNAPSHOT_FILENAME in entry.files and entry.snapshot_sources == sources:
+            return
+        path = os.path.join(directory_path, SNAPSHOT_FILENAME)
+        try:
+            write_snapshot(entry.building, path, sources)
+            st = os.stat(path)
+        except OSError:
+            # Queries load the building instead
+            logger.exception(f"Could not write the snapshot of {directory_path}")
+            return
+        entry.files[SNAPSHOT_FILENAME] = FileState(st.st_mtime_ns, st.st_size)
+        entry.snapshot_sources = sources
+
+    def flush(self, building_name: str) -> None:
+        """Fold the journal of a building into its floor files"""
+        directory_path = self._directory_path(building_name)
+        slot = self._slot(directory_path)
+        with slot.lock.write():
+            entry = self._get_entry(slot, building_name, directory_path)
+            with slot.load_lock:
+                self._compact(entry, directory_path)
+
+    def flush_all(self) -> None:
+        """Fold the journal of every resident building into its floor files"""
+        with self._lock:
+            slots = list(self._slots.items())
+        for directory_path, slot in slots:
+            with slot.lock.write(), slot.load_lock:
+                if slot.entry is not None:
+                    self._compact(slot.entry, directory_path)
+
+    def save(self, building_name: str, building: Building) -> None:
+        """Persist a building and remember the files written as the resident version"""
+        directory_path = self._directory_path(building_name)
+        slot = self._slot(directory_path)
+        with slot.lock.write(), slot.load_lock:
+            self.storage.save(building, directory_path)
+            if slot.entry is not None and slot.entry.building is not building:
+                slot.drop()
+            if slot.entry is None:
+                slot.entry = StoreEntry(building, Journal(directory_path), {})
+            # The snapshot now holds every mutation
+            slot.entry.journal.clear()
+            self._trust_files(slot.entry, directory_path)
+            self._write_snapshot(slot.entry, directory_path)
+
+    def invalidate(self, building_name: Optional[str] = None) -> None:
+        """Drop a resident building (or all of them) so the next access reloads from disk"""
+        if building_name is None:
+            with self._lock:
+                slots = list(self._slots.values())
+        else:
+            slots = [self._slot(self._directory_path(building_name))]
+        for slot in slots:
+            with slot.lock.write(), slot.load_lock:
+                slot.drop()
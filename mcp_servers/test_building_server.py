@@ -1,5 +1,9 @@
 import os
+import sys
 import json
+import time
+import asyncio
+import threading
 import pytest
 from unittest.mock import patch, MagicMock
 from building_mcp_server.server import (
@@ -11,8 +15,24 @@ from building_mcp_server.server import (
     Remove_Door,
     Update_Lights,
     Update_Windows,
-    call_tool
+    Server_Stats,
+    call_tool,
+    list_prompts,
+    list_tools,
+    store,
+    tools
 )
+from building_mcp_server.building import Building, Floor, Room, load_building_from_directory
+from building_mcp_server.journal import JOURNAL_FILENAME, Journal
+from building_mcp_server.store import BuildingStore, estimate_footprint
+from building_mcp_server.graph import PathIndex, bfs_tree
+from building_mcp_server.snapshot import SNAPSHOT_FILENAME, MappedSnapshot, load_snapshot, write_snapshot
+from building_mcp_server.metrics import metrics
+from building_mcp_server.profiling import profiler
+from building_mcp_server.registry import ToolRegistry
+from building_mcp_server.stats import FloorStats
+from benchmarks.generator import corridor_name, generate_building, office_name, write_building
+from building_mcp_server.storage import DATABASE_FILENAME, SqliteStorage, StorageBackend, get_storage
 
 # Test data
 TEST_BUILDING_NAME = "test_building"
@@ -81,6 +101,39 @@ async def test_read_building_data_success(mock_building_dir):
     assert str(TEST_FLOOR_NUMBER) in result[0].text
     assert "room1" in result[0].text
 
+@pytest.mark.asyncio
+async def test_read_building_data_pages(mock_building_dir):
+    """Test floor filters, field projection and cursor pagination of Read_Building_data"""
+    make_tower(3, 5).to_json(TEST_BUILDING_NAME)
+    rooms = []
+    cursor = None
+    while True:
+        arguments = {"building_name": TEST_BUILDING_NAME, "floor_numbers": [3, 2], "fields": ["lights"], "limit": 4}
+        if cursor is not None:
+            arguments["cursor"] = cursor
+        result = await call_tool("Read_Building_data", arguments)
+        page = json.loads(result[0].text[len("Building data: "):])
+        assert page["num_floors"] == 3
+        rooms.extend((floor["floor"], room) for floor in page["floors"] for room in floor["rooms"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert [floor_number for floor_number, _ in rooms] == [2] * 5 + [3] * 5
+    assert all(set(room) == {"name", "lights"} for _, room in rooms)
+
+    building = load_building_from_directory(TEST_BUILDING_NAME)
+    page = building.read_rooms(limit=1)
+    building.floors[0].remove_room(building.floors[0].rooms[-1])
+    with pytest.raises(ValueError):
+        building.read_rooms(cursor=page["next_cursor"])
+    with pytest.raises(ValueError):
+        building.read_rooms(fields=["colour"])
+    # A reload starts the versions over, the cursors of the previous load expire with it
+    building.to_json(TEST_BUILDING_NAME)
+    page = load_building_from_directory(TEST_BUILDING_NAME).read_rooms(limit=1)
+    with pytest.raises(ValueError, match="expired"):
+        load_building_from_directory(TEST_BUILDING_NAME).read_rooms(cursor=page["next_cursor"])
+
 @pytest.mark.asyncio
 async def test_read_building_data_nonexistent(mock_building_dir):
     """Test reading non-existent building data"""
@@ -303,4 +356,1181 @@ async def test_find_path_no_path(mock_building_dir):
         "start_room_name": "room2",
         "end_room_name": "nonexistent_room"
     })
-    assert "Error" in result[0].text
\ No newline at end of file
+    assert "Error" in result[0].text
+
+def test_store_keeps_building_resident(mock_building_dir):
+    """Test that an unchanged building is served from memory"""
+    store = BuildingStore()
+    building = store.get(TEST_BUILDING_NAME)
+    assert store.get(TEST_BUILDING_NAME) is building
+
+def test_store_ignores_touch_without_changes(mock_building_dir):
+    """Test that a file touched without content changes does not trigger a reload"""
+    store = BuildingStore()
+    building = store.get(TEST_BUILDING_NAME)
+    floor_file = os.path.join(mock_building_dir, f"floor_{TEST_FLOOR_NUMBER}.json")
+    stat = os.stat(floor_file)
+    os.utime(floor_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert store.get(TEST_BUILDING_NAME) is building
+
+def test_store_reloads_after_external_edit(mock_building_dir):
+    """Test that an external edit of a floor file is picked up"""
+    store = BuildingStore()
+    building = store.get(TEST_BUILDING_NAME)
+    floor_data = json.loads(json.dumps(TEST_FLOOR_DATA))
+    floor_data["rooms"]["room1"]["lights"] = 7
+    with open(os.path.join(mock_building_dir, f"floor_{TEST_FLOOR_NUMBER}.json"), "w") as f:
+        json.dump(floor_data, f)
+    reloaded = store.get(TEST_BUILDING_NAME)
+    assert reloaded is not building
+    assert reloaded.floors[0].get_room_by_name("room1").lights == 7
+
+@pytest.mark.asyncio
+async def test_failed_mutation_is_not_kept_in_memory(mock_building_dir):
+    """Test that a failed mutation does not leave the resident building modified"""
+    result = await call_tool("Add_Room", {
+        "building_name": TEST_BUILDING_NAME,
+        "floor_number": TEST_FLOOR_NUMBER,
+        "room": {"name": "room3", "doors": ["room1"], "windows": 0, "lights": 0, "adjacent_rooms": ["room2"]}
+    })
+    assert "Error" in result[0].text
+    building = store.get(TEST_BUILDING_NAME)
+    assert building.floors[0].get_room_by_name("room3") is None
+    assert building.floors[0].get_room_by_name("room2").adjacent_rooms == ["room1"]
+
+def test_load_orders_floors_numerically(tmp_path):
+    """Test that floor_10.json is loaded after floor_9.json and doors are wired on every floor"""
+    building_path = tmp_path / TEST_BUILDING_NAME
+    building_path.mkdir()
+    for floor_number in range(1, 12):
+        floor_data = {"rooms": {
+            f"a{floor_number}": {"doors": [f"b{floor_number}"], "windows": 0, "lights": floor_number, "adjacent_rooms": [f"b{floor_number}"]},
+            f"b{floor_number}": {"doors": [f"a{floor_number}"], "windows": 0, "lights": 0, "adjacent_rooms": [f"a{floor_number}"]}
+        }}
+        with open(building_path / f"floor_{floor_number}.json", "w") as f:
+            json.dump(floor_data, f)
+    os.environ["BUILDING_DIR"] = str(tmp_path)
+    building = load_building_from_directory(TEST_BUILDING_NAME)
+    assert [floor.rooms[0].lights for floor in building.floors] == list(range(1, 12))
+    assert building.floors[9].get_room_by_name("a10").doors == ["b10"]
+
+def test_load_leaves_the_garbage_collector_as_it_found_it(mock_building_dir):
+    """Test that the collector paused by a load resumes, and that a disabled one stays disabled"""
+    import gc
+    load_building_from_directory(TEST_BUILDING_NAME)
+    assert gc.isenabled()
+    gc.disable()
+    try:
+        building = load_building_from_directory(TEST_BUILDING_NAME)
+        assert not gc.isenabled()
+    finally:
+        gc.enable()
+    assert building.floors[0].get_room_by_name("room1").doors == ["room2"]
+
+@pytest.mark.asyncio
+async def test_mutation_only_rewrites_changed_floor(mock_building_dir):
+    """Test that updating a room only rewrites the file of its floor"""
+    with open(os.path.join(mock_building_dir, "floor_2.json"), "w") as f:
+        json.dump({"rooms": {"room3": {"doors": [], "windows": 0, "lights": 0, "adjacent_rooms": []}}}, f)
+    floor_2_inode = os.stat(os.path.join(mock_building_dir, "floor_2.json")).st_ino
+    result = await call_tool("Update_Lights", {
+        "building_name": TEST_BUILDING_NAME,
+        "floor_number": TEST_FLOOR_NUMBER,
+        "room_name": "room1",
+        "new_lights": 5
+    })
+    assert "Lights updated successfully" in result[0].text
+    store.flush(TEST_BUILDING_NAME)
+    assert os.stat(os.path.join(mock_building_dir, "floor_2.json")).st_ino == floor_2_inode
+    with open(os.path.join(mock_building_dir, f"floor_{TEST_FLOOR_NUMBER}.json")) as f:
+        assert json.load(f)["rooms"]["room1"]["lights"] == 5
+    assert not [filename for filename in os.listdir(mock_building_dir) if filename.endswith(".tmp")]
+
+def test_remove_floor_deletes_stale_floor_file(mock_building_dir):
+    """Test that removing a floor renumbers the floors above and drops the last file"""
+    with open(os.path.join(mock_building_dir, "floor_2.json"), "w") as f:
+        json.dump({"rooms": {"room3": {"doors": [], "windows": 0, "lights": 0, "adjacent_rooms": []}}}, f)
+    building = load_building_from_directory(TEST_BUILDING_NAME)
+    building.remove_floor(building.floors[0])
+    building.to_json(TEST_BUILDING_NAME)
+    assert sorted(os.listdir(mock_building_dir)) == ["building_metadata.json", "floor_1.json"]
+    with open(os.path.join(mock_building_dir, "floor_1.json")) as f:
+        assert list(json.load(f)["rooms"]) == ["room3"]
+
+@pytest.mark.asyncio
+async def test_mutation_is_journaled_and_replayed(mock_building_dir):
+    """Test that a mutation is written to the journal and replayed by the loader"""
+    result = await call_tool("Update_Windows", {
+        "building_name": TEST_BUILDING_NAME,
+        "floor_number": TEST_FLOOR_NUMBER,
+        "room_name": "room1",
+        "new_windows": 4
+    })
+    assert "Windows updated successfully" in result[0].text
+    with open(os.path.join(mock_building_dir, JOURNAL_FILENAME)) as f:
+        records = [json.loads(line) for line in f]
+    assert [record["op"] for record in records] == ["Update_Windows"]
+    building = load_building_from_directory(TEST_BUILDING_NAME)
+    assert building.floors[0].get_room_by_name("room1").windows == 4
+
+def test_interrupted_compaction_is_not_replayed_twice(mock_building_dir):
+    """Test that records already folded into a floor file are skipped on replay"""
+    store = BuildingStore()
+    store.mutate(TEST_BUILDING_NAME, "Add_Room", {"floor_number": TEST_FLOOR_NUMBER, "room": TEST_ROOM_DATA})
+    # Crash between writing the floor files and deleting the journal
+    store.get(TEST_BUILDING_NAME).to_json(TEST_BUILDING_NAME)
+    with open(os.path.join(mock_building_dir, JOURNAL_FILENAME), "a") as f:
+        f.write('{"seq": 2, "op": "Update_Li')
+    building = load_building_from_directory(TEST_BUILDING_NAME)
+    assert [room.name for room in building.floors[0].rooms] == ["room1", "room2", TEST_ROOM_NAME]
+    assert building.journal_seq == 1
+
+def test_journal_is_compacted_in_background(mock_building_dir):
+    """Test that the journal is folded into the floor files once it reaches the threshold"""
+    store = BuildingStore(compact_threshold=2)
+    for new_lights in (4, 5):
+        store.mutate(TEST_BUILDING_NAME, "Update_Lights", {
+            "floor_number": TEST_FLOOR_NUMBER, "room_name": "room1", "new_lights": new_lights
+        })
+    journal_path = os.path.join(mock_building_dir, JOURNAL_FILENAME)
+    deadline = time.monotonic() + 5
+    while os.path.exists(journal_path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not os.path.exists(journal_path)
+    with open(os.path.join(mock_building_dir, f"floor_{TEST_FLOOR_NUMBER}.json")) as f:
+        assert json.load(f)["rooms"]["room1"]["lights"] == 5
+
+@pytest.mark.asyncio
+async def test_apply_batch_success(mock_building_dir):
+    """Test that a batch is applied and journaled with one record per operation"""
+    result = await call_tool("Apply_Batch", {
+        "building_name": TEST_BUILDING_NAME,
+        "operations": [
+            {"tool": "Add_Room", "arguments": {"floor_number": TEST_FLOOR_NUMBER, "room": TEST_ROOM_DATA}},
+            {"tool": "Add_Door", "arguments": {"floor_number": TEST_FLOOR_NUMBER, "room_name": "room1", "adjacent_room_name": TEST_ROOM_NAME}},
+            {"tool": "Update_Lights", "arguments": {"floor_number": TEST_FLOOR_NUMBER, "room_name": TEST_ROOM_NAME, "new_lights": 8}}
+        ]
+    })
+    assert "Batch applied successfully" in result[0].text
+    building = load_building_from_directory(TEST_BUILDING_NAME)
+    room = building.floors[0].get_room_by_name(TEST_ROOM_NAME)
+    assert room.lights == 8
+    assert "room1" in room.doors
+
+@pytest.mark.asyncio
+async def test_apply_batch_is_all_or_nothing(mock_building_dir):
+    """Test that a failing operation rejects the whole batch and every operation is reported"""
+    result = await call_tool("Apply_Batch", {
+        "building_name": TEST_BUILDING_NAME,
+        "operations": [
+            {"tool": "Update_Lights", "arguments": {"floor_number": TEST_FLOOR_NUMBER, "room_name": "room1", "new_lights": 8}},
+            {"tool": "Update_Lights", "arguments": {"floor_number": TEST_FLOOR_NUMBER, "room_name": "nonexistent_room", "new_lights": 1}},
+            {"tool": "Update_Windows", "arguments": {"floor_number": TEST_FLOOR_NUMBER, "room_name": "room2"}},
+            {"tool": "Update_Windows", "arguments": {"floor_number": TEST_FLOOR_NUMBER, "room_name": "room2", "new_windows": 3}}
+        ]
+    })
+    assert "Batch not applied, 2 of 4 operations failed" in result[0].text
+    results = json.loads(result[0].text.split(": ", 1)[1])
+    assert [r["status"] for r in results] == ["ok", "error", "error", "ok"]
+    assert not os.path.exists(os.path.join(mock_building_dir, JOURNAL_FILENAME))
+    assert store.get(TEST_BUILDING_NAME).floors[0].get_room_by_name("room1").lights == 3
+
+def test_reads_never_wait_for_writes(mock_building_dir):
+    """Test that a mutation commits while a query holds the building, and the query keeps its version"""
+    store = BuildingStore()
+    second_reader = threading.Event()
+    mutated = threading.Event()
+
+    def mutate():
+        store.mutate(TEST_BUILDING_NAME, "Update_Lights", {
+            "floor_number": TEST_FLOOR_NUMBER, "room_name": "room1", "new_lights": 9
+        })
+        mutated.set()
+
+    with store.read(TEST_BUILDING_NAME) as building:
+        reader = threading.Thread(target=lambda: store.get(TEST_BUILDING_NAME) and second_reader.set())
+        reader.start()
+        assert second_reader.wait(5)
+        writer = threading.Thread(target=mutate)
+        writer.start()
+        assert mutated.wait(5)
+        assert building.floors[0].get_room_by_name("room1").lights == 3
+        assert building.floors[0].stats.lights == 5
+    writer.join(5)
+    current = store.get(TEST_BUILDING_NAME)
+    assert current is not building
+    assert current.floors[0].get_room_by_name("room1").lights == 9
+    assert current.floors[0].stats.lights == 11
+
+@pytest.mark.asyncio
+async def test_concurrent_mutations_are_all_applied(mock_building_dir):
+    """Test that concurrent tool calls on one building do not lose updates"""
+    await call_tool("Add_Room", {
+        "building_name": TEST_BUILDING_NAME,
+        "floor_number": TEST_FLOOR_NUMBER,
+        "room": {"name": "hall", "doors": [], "windows": 0, "lights": 0, "adjacent_rooms": []}
+    })
+    results = await asyncio.gather(*[
+        call_tool("Add_Room", {
+            "building_name": TEST_BUILDING_NAME,
+            "floor_number": TEST_FLOOR_NUMBER,
+            "room": {"name": f"office{i}", "doors": [], "windows": 1, "lights": i, "adjacent_rooms": []}
+        })
+        for i in range(20)
+    ])
+    assert all("Room added successfully" in result[0].text for result in results)
+    building = load_building_from_directory(TEST_BUILDING_NAME)
+    assert len(building.floors[0].rooms) == 23
+
+def test_concurrent_writes_are_group_committed(mock_building_dir):
+    """Test that writes arriving together share one journal write, and a failing one is rolled back alone"""
+    store = BuildingStore(group_commit_window=0.05)
+    appends = []
+    original_append = Journal.append
+
+    def counting_append(journal, records):
+        appends.append(len(records))
+        original_append(journal, records)
+
+    errors = {}
+
+    def update(room_name, new_lights):
+        try:
+            store.mutate(TEST_BUILDING_NAME, "Update_Lights", {
+                "floor_number": TEST_FLOOR_NUMBER, "room_name": room_name, "new_lights": new_lights
+            })
+        except ValueError as e:
+            errors[room_name] = e
+
+    store.get(TEST_BUILDING_NAME)
+    slot = store._slot(store._directory_path(TEST_BUILDING_NAME))
+    with patch.object(Journal, "append", counting_append):
+        # Hold the writes back as if a commit were in progress, so that they queue up together
+        with slot.commit_condition:
+            slot.committing = True
+        threads = [threading.Thread(target=update, args=(room_name, new_lights))
+                   for room_name, new_lights in (("room1", 6), ("nonexistent_room", 1), ("room2", 7))]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while len(slot.commit_queue) < 3 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        with slot.commit_condition:
+            slot.committing = False
+            slot.commit_condition.notify_all()
+        for thread in threads:
+            thread.join(5)
+    assert list(errors) == ["nonexistent_room"]
+    assert appends == [2]
+    building = load_building_from_directory(TEST_BUILDING_NAME)
+    assert building.floors[0].get_room_by_name("room1").lights == 6
+    assert building.floors[0].get_room_by_name("room2").lights == 7
+
+def test_lone_write_skips_group_commit_window(mock_building_dir):
+    """Test that a write with no other write in flight commits without waiting for the window"""
+    store = BuildingStore(group_commit_window=5)
+    store.get(TEST_BUILDING_NAME)
+    start = time.monotonic()
+    store.mutate(TEST_BUILDING_NAME, "Update_Lights", {
+        "floor_number": TEST_FLOOR_NUMBER, "room_name": "room1", "new_lights": 6
+    })
+    assert time.monotonic() - start < 2
+    assert store.get(TEST_BUILDING_NAME).floors[0].get_room_by_name("room1").lights == 6
+
+def test_compact_graph_matches_building(mock_building_dir):
+    """Test that the compact graph answers like the Room objects and exposes room views"""
+    building = load_building_from_directory(TEST_BUILDING_NAME)
+    building.use_compact_graph = True
+    graph = building.compact_graph()
+    assert len(graph) == 2
+    assert graph.find_path_by_name("room1", "room2") == ["room1", "room2"]
+    assert graph.room(graph.index_of("room1")) == building.floors[0].get_room_by_name("room1")
+    assert [room.name for room in graph.floor(TEST_FLOOR_NUMBER).rooms] == ["room1", "room2"]
+    room1, room2 = building.floors[0].rooms
+    assert building.find_path(room1, room2) == [room1, room2]
+    # Window and light updates are written into the arrays
+    room1.update_lights(7)
+    room2.update_windows(9)
+    assert building.compact_graph() is graph
+    assert graph.room(graph.index_of("room1")).lights == 7 and graph.room(graph.index_of("room2")).windows == 9
+    # A version forked from the building updates its own copy of the counts
+    fork = building.fork()
+    fork.writable_room("room1").update_lights(3)
+    assert fork.compact_graph() is not graph and fork.compact_graph().door_targets is graph.door_targets
+    assert fork.compact_graph().lights[graph.index_of("room1")] == 3 and graph.lights[graph.index_of("room1")] == 7
+    # Room and door mutations make the next use rebuild the arrays
+    room1.remove_door(room2)
+    assert building.compact_graph() is not graph
+    assert building.find_path(room1, room2) is None
+
+def test_bidirectional_search_finds_shortest_paths():
+    """Test that every search mode finds paths of the same length on the sample building"""
+    os.environ["BUILDING_DIR"] = os.path.join(os.path.dirname(__file__), "..", "building_data")
+    building = load_building_from_directory("Main")
+    graph = building.compact_graph()
+    rooms = building.floors[0].rooms
+    for start in rooms:
+        for end in rooms:
+            path = building.find_path(start, end)
+            lengths = {
+                len(found) if found is not None else None
+                for found in (
+                    path,
+                    building.find_path(start, end, bidirectional=True),
+                    graph.find_path_by_name(start.name, end.name),
+                    graph.find_path_by_name(start.name, end.name, bidirectional=True),
+                )
+            }
+            assert len(lengths) == 1
+            if path is not None:
+                assert path[0] is start and path[-1] is end
+                assert all(b.name in a.doors for a, b in zip(path, path[1:]))
+
+@pytest.mark.parametrize("use_compact_graph", [False, True])
+def test_path_index_follows_topology_version(use_compact_graph):
+    """Test that cached BFS trees answer repeated queries and are dropped by door changes only"""
+    os.environ["BUILDING_DIR"] = os.path.join(os.path.dirname(__file__), "..", "building_data")
+    reference = load_building_from_directory("Main")
+    building = load_building_from_directory("Main")
+    building.use_compact_graph = use_compact_graph
+    building.path_index = PathIndex(2)
+    rooms = building.floors[0].rooms
+    start = rooms[0]
+    for end in rooms:
+        expected = reference.find_path_by_name(start.name, end.name)
+        path = building.find_path(start, end)
+        assert (path is None and expected is None) or len(path) == len(expected)
+    assert len(building.path_index) == 1
+
+    # Lights and windows do not change the routes, the cached tree is kept
+    start.update_lights(start.lights + 1)
+    building.find_path(start, rooms[-1])
+    assert len(building.path_index) == 1
+
+    # A removed door invalidates every cached tree
+    for end in rooms:
+        path = building.find_path(start, end)
+        if path is not None and len(path) > 1:
+            path[0].remove_door(path[1])
+            reference.floors[0].get_room_by_name(path[0].name).remove_door(
+                reference.floors[0].get_room_by_name(path[1].name))
+            break
+    for end in rooms:
+        expected = reference.find_path_by_name(start.name, end.name)
+        path = building.find_path(start, end)
+        assert (path is None and expected is None) or len(path) == len(expected)
+
+    # Only the most recently used start rooms are kept
+    for other in rooms[:3]:
+        building.find_path(other, rooms[-1])
+    assert len(building.path_index) == 2
+
+@pytest.mark.asyncio
+async def test_find_paths_batch(mock_building_dir):
+    """Test routing several start rooms to several end rooms in one call"""
+    result = await call_tool("Add_Room", {
+        "building_name": TEST_BUILDING_NAME,
+        "floor_number": TEST_FLOOR_NUMBER,
+        "room": TEST_ROOM_DATA
+    })
+    assert "Room added successfully" in result[0].text
+
+    # Removing its only door leaves test_room unreachable
+    result = await call_tool("Remove_Door", {
+        "building_name": TEST_BUILDING_NAME,
+        "floor_number": TEST_FLOOR_NUMBER,
+        "room_name": "room2",
+        "adjacent_room_name": TEST_ROOM_NAME
+    })
+    assert "Door removed successfully" in result[0].text
+
+    result = await call_tool("Find_Paths_Batch", {
+        "building_name": TEST_BUILDING_NAME,
+        "start_room_names": ["room1", TEST_ROOM_NAME],
+        "end_room_names": ["room2", TEST_ROOM_NAME]
+    })
+    assert result[0].text.startswith("Paths found for 2 of 4 routes: ")
+    results = json.loads(result[0].text.split(": ", 1)[1])
+    assert results == [
+        {"start": "room1", "end": "room2", "path": ["room1", "room2"]},
+        {"start": "room1", "end": TEST_ROOM_NAME, "path": None},
+        {"start": TEST_ROOM_NAME, "end": "room2", "path": None},
+        {"start": TEST_ROOM_NAME, "end": TEST_ROOM_NAME, "path": [TEST_ROOM_NAME]},
+    ]
+
+    result = await call_tool("Find_Paths_Batch", {
+        "building_name": TEST_BUILDING_NAME,
+        "start_room_names": ["room1"],
+        "end_room_names": ["nonexistent_room"]
+    })
+    assert "Error" in result[0].text
+
+def test_find_paths_matches_find_path():
+    """Test that the multi-target search finds paths as short as single searches, in every mode"""
+    os.environ["BUILDING_DIR"] = os.path.join(os.path.dirname(__file__), "..", "building_data")
+    building = load_building_from_directory("Main")
+    rooms = [room for floor in building.floors for room in floor.rooms]
+    names = [room.name for room in rooms]
+    expected = {
+        start.name: {end.name: building.find_path(start, end) for end in rooms} for start in rooms
+    }
+    for use_compact_graph, path_index in ((False, None), (True, None), (False, PathIndex(4)), (True, PathIndex(4))):
+        building.use_compact_graph = use_compact_graph
+        building.path_index = path_index
+        paths = building.find_paths_by_name(names, names)
+        for start_name in names:
+            for end_name in names:
+                path, single = paths[start_name][end_name], expected[start_name][end_name]
+                assert (path is None) == (single is None)
+                if path is not None:
+                    assert len(path) == len(single)
+                    assert path[0].name == start_name and path[-1].name == end_name
+
+SECOND_FLOOR_DATA = {
+    "rooms": {
+        "stairs_2": {"doors": ["lab"], "windows": 0, "lights": 1, "adjacent_rooms": ["lab"]},
+        "lab": {"doors": ["stairs_2"], "windows": 3, "lights": 4, "adjacent_rooms": ["stairs_2"]}
+    }
+}
+
+@pytest.mark.asyncio
+async def test_connectors_link_floors(mock_building_dir):
+    """Test that stairs are saved on both floors and followed by Find_Path"""
+    result = await call_tool("Add_Floor", {
+        "building_name": TEST_BUILDING_NAME,
+        "floor_number": 2,
+        "floor_data": SECOND_FLOOR_DATA
+    })
+    assert "Floor added successfully" in result[0].text
+    result = await call_tool("Find_Path", {
+        "building_name": TEST_BUILDING_NAME,
+        "start_room_name": "room2",
+        "end_room_name": "lab"
+    })
+    assert "No path found" in result[0].text
+
+    result = await call_tool("Add_Connector", {
+        "building_name": TEST_BUILDING_NAME,
+        "floor_number": 1,
+        "room_name": "room1",
+        "other_floor_number": 2,
+        "other_room_name": "stairs_2",
+        "connector_type": "stairs"
+    })
+    assert "Connector added successfully" in result[0].text
+    result = await call_tool("Find_Path", {
+        "building_name": TEST_BUILDING_NAME,
+        "start_room_name": "room2",
+        "end_room_name": "lab"
+    })
+    assert "Path found:room2 -> room1 -> stairs_2 -> lab" in result[0].text
+
+    store.flush(TEST_BUILDING_NAME)
+    with open(os.path.join(mock_building_dir, "floor_1.json")) as f:
+        assert json.load(f)["rooms"]["room1"]["connectors"] == {"stairs_2": "stairs"}
+    with open(os.path.join(mock_building_dir, "floor_2.json")) as f:
+        assert json.load(f)["rooms"]["stairs_2"]["connectors"] == {"room1": "stairs"}
+
+    # Connectors only link different floors
+    result = await call_tool("Add_Connector", {
+        "building_name": TEST_BUILDING_NAME,
+        "floor_number": 1,
+        "room_name": "room1",
+        "other_floor_number": 1,
+        "other_room_name": "room2",
+        "connector_type": "elevator"
+    })
+    assert "Error" in result[0].text
+
+    # Removing a room drops its connectors on the other floors
+    result = await call_tool("Remove_Room", {
+        "building_name": TEST_BUILDING_NAME,
+        "floor_number": 1,
+        "room_name": "room1"
+    })
+    assert "Room removed successfully" in result[0].text
+    building = load_building_from_directory(TEST_BUILDING_NAME)
+    assert building.floors[1].get_room_by_name("stairs_2").connectors == {}
+
+@pytest.mark.asyncio
+async def test_add_floor_links_room_connectors(mock_building_dir):
+    """Test that connectors in the rooms of an added floor are linked on both floors"""
+    floor_data = json.loads(json.dumps(SECOND_FLOOR_DATA))
+    floor_data["rooms"]["stairs_2"]["connectors"] = {"room1": "stairs"}
+    result = await call_tool("Add_Floor", {
+        "building_name": TEST_BUILDING_NAME,
+        "floor_number": 2,
+        "floor_data": floor_data
+    })
+    assert "Floor added successfully" in result[0].text
+    result = await call_tool("Find_Path", {
+        "building_name": TEST_BUILDING_NAME,
+        "start_room_name": "room2",
+        "end_room_name": "lab"
+    })
+    assert "Path found:room2 -> room1 -> stairs_2 -> lab" in result[0].text
+
+    store.flush(TEST_BUILDING_NAME)
+    with open(os.path.join(mock_building_dir, "floor_1.json")) as f:
+        assert json.load(f)["rooms"]["room1"]["connectors"] == {"stairs_2": "stairs"}
+    with open(os.path.join(mock_building_dir, "floor_2.json")) as f:
+        assert json.load(f)["rooms"]["stairs_2"]["connectors"] == {"room1": "stairs"}
+
+    # Connectors to unknown rooms or to rooms of the same floor are rejected, and no floor is added
+    for connectors in ({"nowhere": "stairs"}, {"lab": "elevator"}):
+        floor_data["rooms"]["stairs_2"]["connectors"] = connectors
+        result = await call_tool("Add_Floor", {
+            "building_name": TEST_BUILDING_NAME,
+            "floor_number": 3,
+            "floor_data": floor_data
+        })
+        assert "Error" in result[0].text
+    assert len(store.get(TEST_BUILDING_NAME).floors) == 2
+
+def test_partially_folded_connector_is_completed(mock_building_dir):
+    """Test that a connector folded into one of its two floors is completed on replay"""
+    store = BuildingStore()
+    store.mutate(TEST_BUILDING_NAME, "Add_Floor", {"floor_number": 2, "floor_data": SECOND_FLOOR_DATA})
+    store.flush(TEST_BUILDING_NAME)
+    store.mutate(TEST_BUILDING_NAME, "Add_Connector", {
+        "floor_number": 1, "room_name": "room1",
+        "other_floor_number": 2, "other_room_name": "stairs_2", "connector_type": "elevator"
+    })
+    # Crash after the compaction wrote floor 1 but before it wrote floor 2
+    floor_data = store.get(TEST_BUILDING_NAME).floors[0].to_dict()
+    with open(os.path.join(mock_building_dir, "floor_1.json"), "w") as f:
+        json.dump(floor_data, f)
+
+    building = load_building_from_directory(TEST_BUILDING_NAME)
+    assert building.floors[0].get_room_by_name("room1").connectors == {"stairs_2": "elevator"}
+    assert building.floors[1].get_room_by_name("stairs_2").connectors == {"room1": "elevator"}
+
+def make_tower(num_floors, rooms_per_floor):
+    """Floors of corridor chains, linked by stairs at one end, an elevator at the other and a door"""
+    floors = []
+    for floor_number in range(1, num_floors + 1):
+        rooms = []
+        for index in range(rooms_per_floor):
+            name = f"room_{floor_number}_{index}"
+            doors = [f"room_{floor_number}_{other}" for other in (index - 1, index + 1) if 0 <= other < rooms_per_floor]
+            rooms.append(Room(name=name, doors=doors, windows=1, lights=1, adjacent_rooms=doors))
+        floors.append(Floor(rooms))
+    building = Building(floors, "Tower")
+    for lower, upper in zip(floors, floors[1:]):
+        lower.rooms[0].add_connector(upper.rooms[0], "stairs")
+        if len(floors) > 2:
+            lower.rooms[-1].add_connector(upper.rooms[-1], "elevator")
+    # A door between two floors also links them
+    floors[0].rooms[rooms_per_floor // 2].doors.append(floors[-1].rooms[rooms_per_floor // 2].name)
+    floors[-1].rooms[rooms_per_floor // 2].doors.append(floors[0].rooms[rooms_per_floor // 2].name)
+    return building
+
+def test_hierarchical_router_matches_bfs():
+    """Test that routes between floors on the portal overlay are as short as a BFS over every room"""
+    building = make_tower(4, 7)
+    rooms = [room for floor in building.floors for room in floor.rooms]
+    expected = {(start.name, end.name): building.find_path(start, end) for start in rooms for end in rooms}
+    building.hierarchical_routing = True
+    for use_compact_graph in (False, True):
+        building.use_compact_graph = use_compact_graph
+        for start in rooms:
+            for end in rooms:
+                path = building.find_path(start, end)
+                assert len(path) == len(expected[start.name, end.name])
+                assert path[0] is start and path[-1] is end
+                assert all(b.name in a.doors or b.name in a.connectors for a, b in zip(path, path[1:]))
+
+    # Only the floors changed since the last query are recomputed
+    router = building.router()
+    tables = dict(router._tables)
+    building.floors[2].rooms[0].remove_connector(building.floors[3].rooms[0])
+    router.refresh()
+    assert [router._tables[key] is tables[key] for key in tables] == [True, True, False, False]
+    path = building.find_path_by_name("room_4_0", "room_3_0")
+    assert [room.name for room in path][:2] == ["room_4_0", "room_4_1"]
+
+def test_floor_reverse_indexes_follow_mutations(mock_building_dir):
+    """Test that the name and reverse door/adjacency indexes of a floor match a scan of its rooms"""
+    building = load_building_from_directory(TEST_BUILDING_NAME)
+    floor = building.floors[0]
+
+    def check():
+        for name in [room.name for room in floor.rooms] + [TEST_ROOM_NAME]:
+            assert {room.name for room in floor.rooms_with_door_to(name)} == {
+                room.name for room in floor.rooms if name in room.doors}
+            assert {room.name for room in floor.rooms_adjacent_to(name)} == {
+                room.name for room in floor.rooms if name in room.adjacent_rooms}
+        assert all(floor.get_room_by_name(room.name) is room for room in floor.rooms)
+
+    check()
+    store = BuildingStore()
+    store.mutate(TEST_BUILDING_NAME, "Add_Room", {"floor_number": TEST_FLOOR_NUMBER, "room": TEST_ROOM_DATA})
+    floor = store.get(TEST_BUILDING_NAME).floors[0]
+    check()
+    store.mutate(TEST_BUILDING_NAME, "Add_Door", {
+        "floor_number": TEST_FLOOR_NUMBER, "room_name": "room1", "adjacent_room_name": TEST_ROOM_NAME})
+    floor = store.get(TEST_BUILDING_NAME).floors[0]
+    check()
+    store.mutate(TEST_BUILDING_NAME, "Remove_Door", {
+        "floor_number": TEST_FLOOR_NUMBER, "room_name": "room2", "adjacent_room_name": TEST_ROOM_NAME})
+    floor = store.get(TEST_BUILDING_NAME).floors[0]
+    check()
+    store.mutate(TEST_BUILDING_NAME, "Remove_Room", {"floor_number": TEST_FLOOR_NUMBER, "room_name": "room1"})
+    floor = store.get(TEST_BUILDING_NAME).floors[0]
+    check()
+    assert floor.get_room_by_name("room1") is None
+    assert floor.get_room_by_name(TEST_ROOM_NAME).doors == []
+    assert floor.get_room_by_name("room2").adjacent_rooms == [TEST_ROOM_NAME]
+    with pytest.raises(ValueError):
+        floor.add_room(Room(name="room2", doors=[], windows=0, lights=0, adjacent_rooms=[]))
+
+def test_rooms_are_slotted_and_share_names(mock_building_dir):
+    """Test that rooms have no per-instance dict and that room names are stored once"""
+    building = load_building_from_directory(TEST_BUILDING_NAME)
+    room1, room2 = building.floors[0].rooms
+    assert not hasattr(room1, "__dict__")
+    assert room1.doors[0] is room2.name
+    assert room2.adjacent_rooms[0] is room1.name
+    # The Room API is unchanged
+    room = Room(name="".join(["room", "3"]), doors=("room1",), windows=1, lights=1, adjacent_rooms=("room1",))
+    assert room.doors == ["room1"] and room.adjacent_rooms == ["room1"] and room.connectors == {}
+    assert room.name is sys.intern("room3")
+
+def test_snapshot_round_trip_and_mapped_queries(tmp_path):
+    """Test that a binary snapshot keeps every room and answers path queries without loading rooms"""
+    building = make_tower(3, 5)
+    building.floors[0].rooms[1].doors.append("demolished_room")
+    building.floors[1].journal_seq = 4
+    path = str(tmp_path / SNAPSHOT_FILENAME)
+    write_snapshot(building, path)
+
+    with MappedSnapshot(path) as snapshot:
+        assert len(snapshot) == 15 and snapshot.num_floors == 3
+        for floor_number, floor in enumerate(building.floors, 1):
+            assert snapshot.floor(floor_number).rooms == floor.rooms
+        rooms = [room for floor in building.floors for room in floor.rooms]
+        for start in rooms:
+            for end in rooms:
+                expected = building.find_path(start, end)
+                for bidirectional in (False, True):
+                    found = snapshot.find_path_by_name(start.name, end.name, bidirectional)
+                    assert len(found) == len(expected)
+                    assert found[0] == start.name and found[-1] == end.name
+        with pytest.raises(ValueError):
+            snapshot.index_of("demolished_room")
+
+    loaded = load_snapshot(path)
+    assert [floor.rooms for floor in loaded.floors] == [floor.rooms for floor in building.floors]
+    assert [floor.journal_seq for floor in loaded.floors] == [0, 4, 0]
+    assert loaded.name == "Tower"
+
+@pytest.mark.asyncio
+async def test_building_loads_from_snapshot_only(mock_building_dir):
+    """Test that a building directory holding only a snapshot is served, and saved back as JSON"""
+    building = load_building_from_directory(TEST_BUILDING_NAME)
+    building.to_snapshot(TEST_BUILDING_NAME)
+    os.remove(os.path.join(mock_building_dir, f"floor_{TEST_FLOOR_NUMBER}.json"))
+
+    result = await call_tool("Find_Path", {
+        "building_name": TEST_BUILDING_NAME,
+        "start_room_name": "room1",
+        "end_room_name": "room2"
+    })
+    assert "Path found:room1 -> room2" in result[0].text
+    result = await call_tool("Update_Lights", {
+        "building_name": TEST_BUILDING_NAME,
+        "floor_number": TEST_FLOOR_NUMBER,
+        "room_name": "room1",
+        "new_lights": 9
+    })
+    assert "Lights updated successfully" in result[0].text
+    store.flush(TEST_BUILDING_NAME)
+    with open(os.path.join(mock_building_dir, f"floor_{TEST_FLOOR_NUMBER}.json")) as f:
+        assert json.load(f)["rooms"]["room1"]["lights"] == 9
+
+def test_store_serves_read_only_queries_from_the_snapshot(tmp_path):
+    """Test that queries on a building that is not resident run on its snapshot while it matches the files"""
+    os.environ["BUILDING_DIR"] = str(tmp_path)
+    write_building(str(tmp_path / "tower"), 3, 20)
+    # Off by default, a building that is only read gets no snapshot
+    store = BuildingStore()
+    store.get("tower")
+    store.flush_all()
+    assert not os.path.exists(tmp_path / "tower" / SNAPSHOT_FILENAME)
+    store = BuildingStore(group_commit_window=0, snapshots=True)
+    start, end = office_name(1, 0, 0), office_name(3, 0, 0)
+    store.get("tower")
+    store.flush_all()
+    assert not os.path.exists(tmp_path / "tower" / SNAPSHOT_FILENAME)
+    store.mutate("tower", "Update_Lights", {"floor_number": 1, "room_name": start, "new_lights": 42})
+    store.flush("tower")
+    assert os.path.exists(tmp_path / "tower" / SNAPSHOT_FILENAME)
+    building = store.get("tower")
+    first_page = building.read_rooms(limit=25)
+    store.invalidate("tower")
+
+    with store.read("tower", mapped=True) as snapshot:
+        assert isinstance(snapshot, MappedSnapshot)
+        # Cursors issued by the building go on over the snapshot
+        assert snapshot.read_rooms(limit=25) == first_page
+        assert snapshot.read_rooms(cursor=first_page["next_cursor"], limit=25) == \
+            building.read_rooms(cursor=first_page["next_cursor"], limit=25)
+        assert snapshot.read_rooms([2], ["lights", "connectors"]) == building.read_rooms([2], ["lights", "connectors"])
+        assert snapshot.stats() == building.stats() and snapshot.stats([1, 3]) == building.stats([1, 3])
+        path = snapshot.find_path_names(start, end)
+        assert len(path) == len(building.find_path_names(start, end)) and path[0] == start and path[-1] == end
+        with pytest.raises(ValueError, match="End room 'Nowhere' not found"):
+            snapshot.find_path_names(start, "Nowhere")
+    stats = store.cache_stats()
+    assert stats["mapped_reads"] == 1 and stats["resident_buildings"] == []
+
+    # A floor file changed by someone else makes the next query load the building
+    with open(tmp_path / "tower" / "floor_2.json") as f:
+        floor = json.load(f)
+    floor["rooms"][office_name(2, 0, 0)]["lights"] = 7
+    with open(tmp_path / "tower" / "floor_2.json", "w") as f:
+        json.dump(floor, f)
+    with store.read("tower", mapped=True) as loaded:
+        assert isinstance(loaded, Building)
+        assert loaded.get_room_by_name(office_name(2, 0, 0)).lights == 7
+    # Evicting the clean building leaves the stale snapshot alone, the next write replaces it
+    write_building(str(tmp_path / "annex"), 1, 5)
+    store.memory_budget = 1
+    store.get("annex")
+    assert store.cache_stats()["evictions"] == 1
+    with store.read("tower", mapped=True) as reloaded:
+        assert isinstance(reloaded, Building)
+    store.mutate("tower", "Update_Lights", {"floor_number": 2, "room_name": office_name(2, 0, 0), "new_lights": 8})
+    store.flush("tower")
+    store.invalidate("tower")
+    with store.read("tower", mapped=True) as snapshot:
+        assert snapshot.stats()["lights"] == loaded.stats()["lights"] + 1
+    assert store.cache_stats()["mapped_reads"] == 2
+
+
+def test_sqlite_storage_round_trip(mock_building_dir):
+    """Test that a building migrated from JSON to SQLite loads back identical, connectors included"""
+    storage = SqliteStorage()
+    building = make_tower(3, 5)
+    building.floors[0].rooms[0].add_connector(building.floors[2].rooms[0], "elevator")
+    building.floors[1].journal_seq = 3
+    building.to_json(TEST_BUILDING_NAME)
+
+    migrated = storage.load(TEST_BUILDING_NAME)
+    storage.save(migrated, mock_building_dir)
+    assert os.path.exists(os.path.join(mock_building_dir, DATABASE_FILENAME))
+    for filename in os.listdir(mock_building_dir):
+        if filename.endswith(".json"):
+            os.remove(os.path.join(mock_building_dir, filename))
+
+    loaded = storage.load(TEST_BUILDING_NAME)
+    assert [floor.to_dict() for floor in loaded.floors] == [floor.to_dict() for floor in building.floors]
+    assert loaded.find_path(loaded.floors[0].rooms[-1], loaded.floors[2].rooms[-1]) is not None
+
+    loaded.floors[1].remove_room(loaded.floors[1].rooms[2])
+    loaded.floors[2].add_room(Room(name="Annex", doors=[], windows=1, lights=1, adjacent_rooms=[]))
+    storage.save(loaded, mock_building_dir)
+    reloaded = storage.load(TEST_BUILDING_NAME)
+    assert [floor.to_dict() for floor in reloaded.floors] == [floor.to_dict() for floor in loaded.floors]
+
+    with pytest.raises(ValueError):
+        get_storage("xml")
+
+    class LoadOnlyStorage(StorageBackend):
+        def load(self, building_name):
+            return storage.load(building_name)
+
+    # A backend must implement both load and save
+    with pytest.raises(TypeError):
+        LoadOnlyStorage()
+
+def test_sqlite_storage_updates_single_row(mock_building_dir, monkeypatch):
+    """Test that Update_Lights through the SQLite storage is one row UPDATE, without a journal"""
+    storage = SqliteStorage()
+    storage.save(storage.load(TEST_BUILDING_NAME), mock_building_dir)
+    statements = []
+    connect = storage._connect
+
+    def traced_connect(path):
+        connection = connect(path)
+        connection.set_trace_callback(statements.append)
+        return connection
+
+    monkeypatch.setattr(storage, "_connect", traced_connect)
+    sqlite_store = BuildingStore(group_commit_window=0, storage=storage)
+    sqlite_store.mutate(TEST_BUILDING_NAME, "Update_Lights", {
+        "floor_number": TEST_FLOOR_NUMBER, "room_name": "room1", "new_lights": 8
+    })
+
+    writes = [statement for statement in statements
+              if statement.split()[0] in ("INSERT", "UPDATE", "DELETE") and "metadata" not in statement and "floors" not in statement]
+    assert writes == ["UPDATE rooms SET windows = 2, lights = 8 WHERE name = 'room1' AND floor = 1"]
+    assert not os.path.exists(os.path.join(mock_building_dir, JOURNAL_FILENAME))
+    assert storage.load(TEST_BUILDING_NAME).floors[0].get_room_by_name("room1").lights == 8
+    assert sqlite_store.get(TEST_BUILDING_NAME).floors[0].get_room_by_name("room1").lights == 8
+
+@pytest.mark.asyncio
+async def test_building_stats_follow_mutations(mock_building_dir):
+    """Test that the running floor totals match a recomputation after every kind of mutation"""
+    make_tower(2, 4).to_json(TEST_BUILDING_NAME)
+    mutations = [
+        ("Update_Lights", {"floor_number": 1, "room_name": "room_1_0", "new_lights": 11}),
+        ("Update_Windows", {"floor_number": 2, "room_name": "room_2_3", "new_windows": 0}),
+        ("Add_Room", {"floor_number": 2, "room": {"name": "Lab", "doors": ["room_2_0"], "windows": 4,
+                                                 "lights": 6, "adjacent_rooms": ["room_2_0"]}}),
+        ("Add_Connector", {"floor_number": 1, "room_name": "room_1_3", "other_floor_number": 2,
+                           "other_room_name": "Lab", "connector_type": "stairs"}),
+        ("Remove_Door", {"floor_number": 1, "room_name": "room_1_1", "adjacent_room_name": "room_1_2"}),
+        ("Remove_Room", {"floor_number": 2, "room_name": "Lab"}),
+    ]
+    for tool, arguments in mutations:
+        result = await call_tool(tool, {"building_name": TEST_BUILDING_NAME, **arguments})
+        assert "successfully" in result[0].text
+        building = store.get(TEST_BUILDING_NAME)
+        for floor in building.floors:
+            expected = FloorStats.from_rooms(floor.rooms).as_dict()
+            assert floor.stats.as_dict() == expected
+
+    result = await call_tool("Building_Stats", {"building_name": TEST_BUILDING_NAME, "floor_numbers": [2]})
+    stats = json.loads(result[0].text[len("Building stats: "):])
+    rooms = [room for floor in building.floors for room in floor.rooms]
+    assert stats["rooms"] == len(rooms) == 8
+    assert stats["lights"] == sum(room.lights for room in rooms)
+    assert stats["doors"] == sum(len(room.doors) for room in rooms) // 2
+    assert stats["connectors"] == 1
+    assert [floor["floor"] for floor in stats["floors"]] == [2]
+    assert stats["floors"][0]["windows"] == sum(room.windows for room in building.floors[1].rooms)
+
+def test_component_index_follows_mutations():
+    """Test that the component index agrees with a BFS as doors, connectors and rooms change"""
+    building = make_tower(3, 6)
+    building.hierarchical_routing = False
+    floors = building.floors
+
+    def check():
+        names = list(building._room_floors)
+        for start in names:
+            reachable = set(bfs_tree(start, building._links_of))
+            for end in names:
+                assert building.components().connected(start, end, building._links_of) == (end in reachable), (start, end)
+
+    check()
+    floors[0].get_room_by_name("room_1_2").remove_door(floors[0].get_room_by_name("room_1_3"))
+    floors[1].get_room_by_name("room_2_2").remove_door(floors[1].get_room_by_name("room_2_3"))
+    check()
+    floors[0].rooms[0].remove_connector(floors[1].rooms[0])
+    floors[0].rooms[-1].remove_connector(floors[1].rooms[-1])
+    floors[2].rooms[0].remove_connector(floors[1].rooms[0])
+    check()
+    assert building.find_path(floors[1].rooms[0], floors[1].rooms[-1]) is None
+    floors[1].remove_room(floors[1].get_room_by_name("room_2_4"))
+    floors[1].add_room(Room(name="Isolated", doors=[], windows=0, lights=1, adjacent_rooms=[]))
+    check()
+    for name in ("room_2_3", "room_2_5"):
+        floors[1].get_room_by_name(name).add_adjacent_room("room_2_4")
+    floors[1].add_room(Room(name="room_2_4", doors=["room_2_3", "room_2_5"], windows=0, lights=1,
+                            adjacent_rooms=["room_2_3", "room_2_5"]))
+    floors[1].get_room_by_name("room_2_3").add_door(floors[1].get_room_by_name("room_2_2"))
+    floors[1].rooms[0].add_connector(floors[2].rooms[0], "elevator")
+    check()
+    building.add_floor(Floor([Room(name="Roof", doors=[], windows=0, lights=0, adjacent_rooms=[])]))
+    check()
+    components = building.connected_components()
+    assert sum(map(len, components)) == len(building._room_floors)
+    assert ["Roof"] in components and ["Isolated"] in components
+
+@pytest.mark.asyncio
+async def test_find_components_lists_isolated_rooms(mock_building_dir):
+    """Test the Find_Components tool and the unreachable Find_Path answer"""
+    await call_tool("Add_Room", {"building_name": TEST_BUILDING_NAME, "floor_number": TEST_FLOOR_NUMBER,
+                                 "room": {"name": "Vault", "doors": [], "windows": 0, "lights": 1, "adjacent_rooms": []}})
+    result = await call_tool("Find_Path", {"building_name": TEST_BUILDING_NAME, "start_room_name": "room1",
+                                           "end_room_name": "Vault"})
+    assert "No path found" in result[0].text
+    result = await call_tool("Find_Components", {"building_name": TEST_BUILDING_NAME})
+    components = json.loads(result[0].text[len("Components: "):])
+    assert components["num_components"] == 2
+    assert components["isolated_rooms"] == ["Vault"]
+    assert components["components"][0] == {"size": 2, "rooms": ["room1", "room2"]}
+
+def test_generated_buildings_are_deterministic():
+    """Test that the benchmark generator gives the same connected building for the same arguments"""
+    first = generate_building(4, 37, door_density=0.5, seed=3)
+    second = generate_building(4, 37, door_density=0.5, seed=3)
+    assert [floor.to_dict() for floor in first.floors] == [floor.to_dict() for floor in second.floors]
+    assert [len(floor.rooms) for floor in first.floors] == [37] * 4
+    assert len(first.connected_components()) == 1
+    other = generate_building(4, 37, door_density=0.5, seed=4)
+    assert [floor.to_dict() for floor in other.floors] != [floor.to_dict() for floor in first.floors]
+    linked_by_doors = generate_building(3, 20, floor_links="door")
+    assert all(not room.connectors for floor in linked_by_doors.floors for room in floor.rooms)
+    assert len(linked_by_doors.connected_components()) == 1
+
+@pytest.mark.asyncio
+async def test_server_stats_report_tool_latencies(mock_building_dir, tmp_path):
+    """Test the per-tool counters, phase timings, Server_Stats and the Prometheus dump"""
+    metrics.reset()
+    for _ in range(3):
+        await call_tool("Find_Path", {"building_name": TEST_BUILDING_NAME, "start_room_name": "room1",
+                                      "end_room_name": "room2"})
+    await call_tool("Update_Lights", {"building_name": TEST_BUILDING_NAME, "floor_number": TEST_FLOOR_NUMBER,
+                                      "room_name": "room1", "new_lights": 4})
+    await call_tool("Update_Lights", {"building_name": TEST_BUILDING_NAME, "floor_number": TEST_FLOOR_NUMBER,
+                                      "room_name": "missing", "new_lights": 4})
+
+    result = await call_tool("Server_Stats", {"tool": None})
+    stats = json.loads(result[0].text[len("Server stats: "):])
+    find_path = stats["tools"]["Find_Path"]
+    assert find_path["calls"] == 3 and find_path["errors"] == 0
+    assert {"validate", "load", "execute", "serialize"} <= set(find_path["phases_ms"])
+    latency = find_path["latency_ms"]
+    assert 0 < latency["p50"] <= latency["p95"] <= latency["p99"] <= latency["max"]
+    update_lights = stats["tools"]["Update_Lights"]
+    assert update_lights["calls"] == 2 and update_lights["errors"] == 1
+    assert "persist" in update_lights["phases_ms"]
+
+    path = tmp_path / "metrics.prom"
+    metrics.dump(str(path))
+    text = path.read_text()
+    assert 'building_tool_calls_total{tool="Find_Path"} 3' in text
+    assert 'building_tool_latency_seconds_bucket{tool="Find_Path",le="+Inf"} 3' in text
+    await call_tool("Server_Stats", {"reset": True})
+    # The reset call itself is recorded once it returns
+    assert list(metrics.snapshot()["tools"]) == ["Server_Stats"]
+
+
+@pytest.mark.asyncio
+async def test_unwritable_metrics_file_never_fails_a_call(mock_building_dir, tmp_path):
+    """Test that tool calls go on when the Prometheus file cannot be written"""
+    path = str(tmp_path / "missing" / "metrics.prom")
+    with patch.object(metrics, "dump_path", path), patch.object(metrics, "dump_interval", 0):
+        for _ in range(2):
+            result = await call_tool("Find_Path", {"building_name": TEST_BUILDING_NAME, "start_room_name": "room1",
+                                                   "end_room_name": "room2"})
+            assert "Path found:room1 -> room2" in result[0].text
+    assert not os.path.exists(tmp_path / "missing")
+
+
+@pytest.mark.asyncio
+async def test_slow_tool_calls_are_profiled(mock_building_dir, tmp_path):
+    """Test that calls over the threshold, and calls asking for it, leave a profile behind"""
+    arguments = {"building_name": TEST_BUILDING_NAME, "start_room_name": "room1", "end_room_name": "room2"}
+    with patch.object(profiler, "directory", str(tmp_path)), patch.object(profiler, "threshold_ms", 0):
+        result = await call_tool("Find_Path", arguments)
+    assert result[0].text.startswith("Path found")
+    reports = sorted(tmp_path.glob("*-Find_Path-*.txt"))
+    assert len(reports) == 1
+    assert reports[0].with_suffix(".prof").exists()
+    report = reports[0].read_text()
+    assert "find_path" in report and "allocating lines" in report
+
+    with patch.object(profiler, "directory", str(tmp_path)), patch.object(profiler, "threshold_ms", 60000):
+        await call_tool("Find_Path", arguments)
+        assert len(list(tmp_path.glob("*.txt"))) == 1
+        result = await call_tool("Find_Path", {**arguments, "profile": True})
+    assert result[0].text.startswith("Path found")
+    assert len(list(tmp_path.glob("*.txt"))) == 2
+
+
+@pytest.mark.asyncio
+async def test_tool_registry_lists_every_tool_once(mock_building_dir):
+    """Test that tools and prompts come from the registry, built once, with the read/write split"""
+    listed = await list_tools()
+    assert [tool.name for tool in listed] == [spec.name for spec in tools]
+    assert await list_tools() is listed
+    annotations = {tool.name: tool.annotations.readOnlyHint for tool in listed}
+    assert annotations["Find_Path"] and annotations["Read_Building_data"]
+    assert not annotations["Add_Room"] and not annotations["Apply_Batch"]
+    schema = Read_Building_data.model_json_schema()
+    assert listed[0].inputSchema["properties"] == {**schema["properties"], "profile": tools.common_properties["profile"]}
+    assert listed[0].inputSchema["required"] == schema["required"]
+    assert all(tool.inputSchema["properties"]["profile"]["type"] == "boolean" for tool in listed)
+
+    prompts = {prompt.name: prompt for prompt in await list_prompts()}
+    assert set(prompts) == {spec.name for spec in tools}
+    arguments = {argument.name: argument.required for argument in prompts["Find_Path"].arguments}
+    assert arguments == {"building_name": True, "start_room_name": True, "end_room_name": True,
+                         "bidirectional": False}
+
+    result = await call_tool("Missing_Tool", {})
+    assert "Unknown tool Missing_Tool" in result[0].text
+
+
+def test_tool_registry_rejects_duplicates():
+    """Test that a registered handler is found by name and a name is registered once"""
+    registry = ToolRegistry()
+
+    @registry.tool("Server_Stats", Server_Stats, "Statistics")
+    def handler(args):
+        return []
+
+    assert registry.get("Server_Stats").handler is handler
+    assert registry.get("Server_Stats").prompt == "Statistics"
+    with pytest.raises(ValueError):
+        registry.tool("Server_Stats", Server_Stats, "Statistics again")(handler)
+    with pytest.raises(ValueError):
+        registry.get("Find_Path")
+
+
+def test_store_evicts_least_recently_used_buildings(tmp_path):
+    """Test that resident buildings are evicted in LRU order once over the memory budget"""
+    os.environ["BUILDING_DIR"] = str(tmp_path)
+    footprint = estimate_footprint(write_building(str(tmp_path / "a"), 2, 50))
+    for name in ("b", "c"):
+        write_building(str(tmp_path / name), 2, 50)
+    store = BuildingStore(memory_budget=footprint * 5 // 2)
+    building_a = store.get("a")
+    store.get("b")
+    assert store.get("a") is building_a
+    store.get("c")
+
+    stats = store.cache_stats()
+    assert [resident["building"] for resident in stats["resident_buildings"]] == ["c", "a"]
+    assert stats["resident_bytes"] == 2 * footprint <= stats["memory_budget_bytes"]
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 3, 1)
+    assert store.get("a") is building_a
+
+
+def test_store_flushes_dirty_building_before_eviction(tmp_path):
+    """Test that a building with journaled changes is written to its floor files when evicted"""
+    os.environ["BUILDING_DIR"] = str(tmp_path)
+    footprint = estimate_footprint(write_building(str(tmp_path / "a"), 2, 50))
+    write_building(str(tmp_path / "b"), 2, 50)
+    store = BuildingStore(memory_budget=footprint * 3 // 2)
+    store.mutate("a", "Update_Lights", {"floor_number": 1, "room_name": office_name(1, 0, 0), "new_lights": 42})
+    assert os.path.exists(tmp_path / "a" / JOURNAL_FILENAME)
+
+    store.get("b")
+    stats = store.cache_stats()
+    assert [resident["building"] for resident in stats["resident_buildings"]] == ["b"]
+    assert stats["evictions"] == stats["eviction_flushes"] == 1
+    assert not os.path.exists(tmp_path / "a" / JOURNAL_FILENAME)
+    with open(tmp_path / "a" / "floor_1.json") as f:
+        assert json.load(f)["rooms"][office_name(1, 0, 0)]["lights"] == 42
+
+
+def test_store_evicts_once_mutations_grow_a_building_past_the_budget(tmp_path):
+    """Test that many mutations keep one version resident, counted once, until the growth evicts the LRU building"""
+    import gc
+    import weakref
+    os.environ["BUILDING_DIR"] = str(tmp_path)
+    footprint = estimate_footprint(write_building(str(tmp_path / "a"), 2, 50))
+    write_building(str(tmp_path / "b"), 2, 50)
+    store = BuildingStore(group_commit_window=0, memory_budget=footprint * 5 // 2)
+    store.get("b")
+    versions = []
+    for iteration in range(100):
+        versions.append(weakref.ref(store.get("a")))
+        store.mutate("a", "Add_Room", {"floor_number": 1, "room": {
+            "name": f"Temp_{iteration}", "doors": [corridor_name(1, 0)], "windows": 0, "lights": 0,
+            "adjacent_rooms": [corridor_name(1, 0)]}})
+        stats = store.cache_stats()
+        assert stats["resident_bytes"] <= stats["memory_budget_bytes"]
+        if stats["evictions"]:
+            break
+    gc.collect()
+    building = store.get("a")
+    assert [version for version in versions if version() is not None] == []
+    assert stats["evictions"] == 1 and 0 < iteration < 99
+    assert [resident["building"] for resident in stats["resident_buildings"]] == ["a"]
+    assert stats["resident_bytes"] == estimate_footprint(building) > footprint * 3 // 2
+    assert building.floors[0].stats.rooms == 51 + iteration
+
+
+def test_mutations_publish_new_versions_sharing_unchanged_floors(tmp_path):
+    """Test that a held version never changes and the next one shares the floors a write left alone"""
+    os.environ["BUILDING_DIR"] = str(tmp_path)
+    write_building(str(tmp_path / "tower"), 3, 20)
+    store = BuildingStore()
+    before = store.get("tower")
+    start, end = office_name(1, 0, 0), office_name(3, 0, 0)
+    path_before = [room.name for room in before.find_path_by_name(start, end)]
+    components_before = before.connected_components()
+    store.mutate("tower", "Add_Room", {"floor_number": 2, "room": {
+        "name": "Lab", "doors": [], "windows": 1, "lights": 1, "adjacent_rooms": [],
+        "connectors": {corridor_name(3, 0): "elevator"}}})
+    store.mutate("tower", "Remove_Door", {"floor_number": 1, "room_name": start,
+                                          "adjacent_room_name": corridor_name(1, 0)})
+
+    after = store.get("tower")
+    assert after is not before
+    assert after.floors[1] is not before.floors[1] and after.floors[2] is not before.floors[2]
+    assert after.floors[1].get_room_by_name(corridor_name(2, 1)) is not before.floors[1].get_room_by_name(corridor_name(2, 1))
+    assert before.floors[1].get_room_by_name("Lab") is None and before.get_room_by_name("Lab") is None
+    assert "Lab" not in before.floors[2].get_room_by_name(corridor_name(3, 0)).connectors
+    assert before.floors[1].stats.rooms == 20 and after.floors[1].stats.rooms == 21
+    assert corridor_name(1, 0) in before.floors[0].get_room_by_name(start).doors
+    assert [room.name for room in before.find_path_by_name(start, end)] == path_before
+    assert before.connected_components() == components_before
+    assert after.find_path_by_name(start, end) is None
+    assert all(after.get_room_by_name(room.name) is room for floor in after.floors for room in floor.rooms)
+
+    store.mutate("tower", "Update_Lights", {"floor_number": 2, "room_name": "Lab", "new_lights": 4})
+    latest = store.get("tower")
+    assert latest.floors[0] is after.floors[0] and latest.floors[2] is after.floors[2]
+    assert latest.floors[0].get_room_by_name(start) is after.floors[0].get_room_by_name(start)
+    assert after.floors[1].get_room_by_name("Lab").lights == 1
+
+
+def test_replaced_versions_are_freed(tmp_path):
+    """Test that published versions are freed once replaced, unless a query still holds them"""
+    import gc
+    import weakref
+    os.environ["BUILDING_DIR"] = str(tmp_path)
+    write_building(str(tmp_path / "tower"), 3, 20)
+    store = BuildingStore(group_commit_window=0)
+    store.get("tower").find_path_by_name(office_name(1, 0, 0), office_name(3, 0, 0))
+    versions = []
+    with store.read("tower") as held:
+        for iteration in range(50):
+            versions.append(weakref.ref(store.get("tower")))
+            store.mutate("tower", "Update_Lights", {"floor_number": iteration % 3 + 1,
+                                                    "room_name": office_name(iteration % 3 + 1, 0, 0),
+                                                    "new_lights": iteration})
+            if iteration % 10 == 0:
+                store.mutate("tower", "Add_Room", {"floor_number": 1, "room": {
+                    "name": f"Temp_{iteration}", "doors": [corridor_name(1, 0)], "windows": 0, "lights": 0,
+                    "adjacent_rooms": [corridor_name(1, 0)]}})
+        gc.collect()
+        assert versions[0]() is held
+        assert [index for index, version in enumerate(versions) if version() is not None] == [0]
+        held_ref = weakref.ref(held)
+    del held
+    gc.collect()
+    assert held_ref() is None
+    assert store.get("tower").floors[0].get_room_by_name(office_name(1, 0, 0)).lights == 48
+
+
+def test_queries_never_see_half_applied_mutations(tmp_path):
+    """Test that queries running during a stream of writes always see whole versions"""
+    os.environ["BUILDING_DIR"] = str(tmp_path)
+    write_building(str(tmp_path / "tower"), 2, 50)
+    store = BuildingStore(group_commit_window=0)
+    stop = threading.Event()
+    errors = []
+
+    def query():
+        while not stop.is_set():
+            with store.read("tower") as building:
+                rooms = sum(floor.stats.rooms for floor in building.floors)
+                if rooms != len(building._room_floors) or any(
+                        floor.stats.rooms != len(floor.rooms) for floor in building.floors):
+                    errors.append(rooms)
+                building.find_path_by_name(office_name(1, 0, 0), office_name(2, 0, 0))
+
+    readers = [threading.Thread(target=query) for _ in range(3)]
+    for reader in readers:
+        reader.start()
+    try:
+        for iteration in range(30):
+            store.mutate("tower", "Add_Room", {"floor_number": 1, "room": {
+                "name": f"Temp_{iteration}", "doors": [corridor_name(1, 0)], "windows": 0, "lights": 0,
+                "adjacent_rooms": [corridor_name(1, 0)]}})
+            store.mutate("tower", "Remove_Room", {"floor_number": 1, "room_name": f"Temp_{iteration}"})
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join(5)
+    assert errors == []
+    assert store.get("tower").floors[0].stats.rooms == 50
+